@@ -14,7 +14,17 @@ Usage:
                    [--no_cf_weighting]
             [--neuropathy <degradation>]
             [--noBrainstem | --brainstemType <brainstem>]
+            [--brainstemBackend <backend>]
+            [--wavesOnly]
             [--pypet]
+            [--jobs <n>]
+            [--anfNum <fibers>]
+            [--cache <cachePath>]
+            [--cacheSize <gigabytes>]
+            [--analysisFs <rate>]
+            [--store <format>]
+            [--memmap]
+            [--writers <n>]
 
 Options:
     -h --help                       Show this screen and exit.
@@ -29,13 +39,18 @@ Options:
                                     'h' : High Spontaneous Rate Fiber IFRs
                                     'l' : Low Spontaneous Rate Fiber IFRs
                                     'm' : Medium Spontaneous Rate Fiber IFRs
+                                    'p' : Auditory Nerve Fiber Spike Trains (Zilany model only, see --anfNum)
                                     'e' : Otoacoustic Emissions (Verhulst model only)
                                     's' : The stimulus waveform
                                     'd' : The stimulus level
-                                    [default: cavihlmesd]
+                                    [default: cavihlmpesd]
     --noBrainstem                   Simulate the periphery only.
     --brainstemType=<brainstem>     Which brainstem and midbrain model to use: 'NELSON_CARNEY_2004' or 'CARNEY_2015'
                                     [default: NELSON_CARNEY_2004]
+    --brainstemBackend=<backend>    How the brainstem models filter their inputs: 'fft' (FFT convolutions) or 'iir'
+                                    (recursive filters, linear in the stimulus length). [default: fft]
+    --wavesOnly                     Only simulate the summed brainstem waves, not the CN and IC population responses.
+                                    Much faster for many CFs.
     --no_cf_weighting               Don't sigmoidally weight how many low, medium, and high SR fibers innervate each CF.
     --stimulusFile=<stimulusPath>   Provide one or more stimuli templates as YAML (see stimulus_generator --help ).
                                     If no option is provided, an 80dB click will be used.
@@ -49,6 +64,28 @@ Options:
                                     degrade low-SR fibers only. [default: none]
     --pypet                         Set this option when calling this script from pypet.  Data saving will be managed by
                                     PyPet, and no summary figures will be generated.
+    --jobs=<n>                      Number of worker processes used to simulate the CF channels of the Zilany
+                                    periphery and the levels of the brainstem (or of threads used by the brainstem
+                                    convolutions of a single level).  Negative values use every available core.
+                                    [default: 1]
+    --anfNum=<fibers>               Number of high, medium and low SR fibers per CF whose spike trains are simulated
+                                    by the Zilany periphery, separated by commas.  Spike generation is skipped when
+                                    all are zero. [default: 0,0,0]
+    --cache=<cachePath>             Keep the periphery outputs, AN responses and brainstem responses of every level
+                                    (and the IHC potentials and synapse outputs of the Zilany periphery) in this
+                                    directory, and reuse them for the same stimulus and parameters: changing only the
+                                    brainstem model, say, only simulates the brainstem again.
+    --cacheSize=<gigabytes>         Size cap of the cache; the least recently used results are evicted beyond it.
+                                    [default: 4]
+    --analysisFs=<rate>             Sample rate (Hz) of the auditory nerve, brainstem and midbrain responses.  The AN
+                                    outputs of the periphery (simulated at 100 kHz) are decimated to it; it must divide
+                                    100 kHz. [default: 100000]
+    --store=<format>                Save the results as 'npz' (one file per stimulus level and model stage) or 'hdf5'
+                                    (a single compressed, chunked file per run). [default: npz]
+    --memmap                        Write the periphery outputs and AN responses of every level to memory-mapped .npy
+                                    files in the output directory, so that only one level is held in memory at a time.
+    --writers=<n>                   Number of background threads that save the results while the next stimulus level is
+                                    simulated; 0 saves them synchronously. [default: 1]
     -v --verbose                    Display detailed debug log output to STDOUT.
 """
 
@@ -58,17 +95,21 @@ import sys
 from datetime import datetime
 from logging import info, getLogger, ERROR
 from os import path, system, name
+from typing import Union
 
-from corti import __version__
+from corti import __version__, writer
 from corti.analysis.plots import save_summary_pdf
 from corti.auditory_nerve_response import AuditoryNerveResponse
-from corti.base import runtime_consts, PeripheryType, an_consts as a, sanitize_level
-from corti.brainstem import simulate_brainstem
+from corti.base import runtime_consts, PeripheryType, an_consts as a, brain_consts as b, sanitize_level, n_workers
+from corti.brainstem import iter_brainstem
 from corti.from_docopt import from_docopt
 from corti.periphery import Periphery
 from corti.periphery_configuration import PeripheryConfiguration
 from corti.stimulus import Stimulus
 
+# the parts of a brainstem response that are kept for the summary plots
+BrainstemWaves = (b.Wave1_AN, b.Wave3_CN, b.Wave5_IC, b.BrainstemModelType)
+
 
 def main(inputargs=None):
     """The entry point to the main command line"""
@@ -80,6 +121,19 @@ def main(inputargs=None):
     if not args.verbose:
         getLogger().setLevel(ERROR)
 
+    writer.start(int(args.writers))
+    try:
+        results = simulate(args)
+    finally:
+        # the saves still queued are written even if the simulation failed
+        writer.finish()
+    info("Simulation finished.")
+    return results
+
+
+def simulate(args) -> Union[int, tuple]:
+    """Run the models as the parsed command line `args` say"""
+    jobs = n_workers(int(args.jobs))
     # configure the stimulus
     stimuli_dict = make_stimuli(args)
     # actually run the simulation
@@ -90,7 +144,14 @@ def main(inputargs=None):
                                   stimuli=stimuli_dict,
                                   modelType=PeripheryType[args.peripheryType.upper()],
                                   degradation=args.neuropathy,
-                                  pypet=args.pypet)
+                                  pypet=args.pypet,
+                                  jobs=jobs,
+                                  anf_num=tuple(int(n) for n in args.anfNum.split(",")),
+                                  cache=args.cache,
+                                  cacheBytes=int(float(args.cacheSize) * 2 ** 30),
+                                  analysisFs=float(args.analysisFs),
+                                  store=args.store,
+                                  memmap=args.memmap)
     info("Simulating periphery ({0}) response ...".format(args.peripheryType))
 
     # run all the levels through the periphery model
@@ -109,8 +170,18 @@ def main(inputargs=None):
     # run the brainstem and midbrain models, if requested
     if not args.noBrainstem:
         info("Simulating brainstem response ...")
-        brain_results = simulate_brainstem([(periphs, anrs, args.brainstemType)
-                                            for periphs, anrs in zip(periphery_results, auditory_nerve_responses)])
+        # several levels are simulated in parallel processes, a single one with parallel convolutions
+        levelJobs = jobs if len(periphery_results) > 1 else 1
+        brain_results = []
+        for output in iter_brainstem([(periphs, anrs, args.brainstemType)
+                                      for periphs, anrs in zip(periphery_results, auditory_nerve_responses)],
+                                     workers=jobs if levelJobs == 1 else 1, backend=args.brainstemBackend,
+                                     waves_only=args.wavesOnly, jobs=levelJobs):
+            # every level is saved as it is simulated; only its waves are plotted, so the population responses are
+            # not kept (unless they are handed to pypet)
+            if not args.pypet:
+                output = {key: output[key] for key in BrainstemWaves if key in output}
+            brain_results.append(output)
         #  todo make the enum here
     else:
         brain_results = None
@@ -130,7 +201,6 @@ def main(inputargs=None):
         info("Cleaning up previous model runs ... ")
         clean(conf.dataFolder, periphery_results[0].outputFolder)
 
-    info("Simulation finished.")
     if args.pypet:
         return (
             periphery_results,
@@ -10,11 +10,12 @@ import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 import matplotlib.colors as colors
 import numpy as np
-import yaml
 from matplotlib.backends.backend_pdf import PdfPages
 
 from corti.base import runtime_consts as r, periph_consts as p, brain_consts as b
+from corti.manifest import RunManifest
 from corti.periphery_configuration import PeripheryOutput, PeripheryConfiguration
+from corti.result_store import ResultStore
 
 plt.style.use("seaborn-colorblind")
 
@@ -115,7 +116,7 @@ def plot_brainstem(brain: {}, conf: PeripheryConfiguration, pdf: PdfPages) -> pl
     # Plot the ABR
     abr = brain[b.Wave1_AN] + brain[b.Wave3_CN] + brain[b.Wave5_IC]
     pointCount = len(abr)
-    time = np.linspace(0, pointCount / conf.Fs, num=pointCount)
+    time = np.linspace(0, pointCount / conf.analysisFs, num=pointCount)
     abr_ax = plt.subplot(gs[0, :])
     # plt.xticks(rotation=-70)
     abr_ax.plot(time, abr, lw=2)
@@ -164,16 +165,29 @@ def plot_directory(dirPath: str):
     peripheryFiles = glob.glob(path.join(dirPath, r.PeripheryOutputFilePrefix + "*"))
     brainstemFiles = glob.glob(path.join(dirPath, r.BrainstemOutputFilePrefix + "*"))
     anrFiles = glob.glob(path.join(dirPath, r.AuditoryNerveOutputFilePrefix + "*"))
-    configFile = glob.glob(path.join(dirPath, r.PeripheryConfigurationName))[0]
 
-    if not configFile:
-        info("No configuration file was found in the directory to be plotted.  Returning.")
+    if not path.isfile(path.join(dirPath, r.RunManifestName)):
+        info("No run manifest was found in the directory to be plotted.  Returning.")
+        return
+
+    conf = RunManifest.load(dirPath)
+    storeFile = path.join(dirPath, r.ResultStoreFileName)
+    if path.isfile(storeFile):
+        store = ResultStore.for_run(conf, dirPath)
+        # a run with --noBrainstem has no brainstem group
+        levels = lambda stage: [store.stage(stage, level) for level in store.levels] if store.has_stage(stage) else None
+        save_summary_pdf(periphery=[store.stage('periphery', level) for level in store.levels],
+                         brain=levels('brainstem'),
+                         anr=levels('auditory_nerve'),
+                         conf=conf,
+                         fileName="summary-plots.pdf",
+                         outputPath=dirPath)
         return
 
     save_summary_pdf(periphery=[np.load(x) for x in peripheryFiles],
                      brain=[np.load(x) for x in brainstemFiles],
                      anr=[np.load(x) for x in anrFiles],
-                     conf=yaml.load(open(configFile)),
+                     conf=conf,
                      fileName="summary-plots.pdf",
                      outputPath=dirPath)
 
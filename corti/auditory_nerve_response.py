@@ -1,16 +1,25 @@
 """Computations related to the responses of the auditory nerve to stimuli."""
+import itertools
 import logging
+import zipfile
 from typing import Union
 
 import numpy as np
-import numpy.matlib
 from os import path
 
-from corti import PeripheryOutput, PeripheryType, periph_consts as p, runtime_consts as r, an_consts as a
+from corti import PeripheryOutput, PeripheryType, mapped, writer
+from corti import periph_consts as p, runtime_consts as r, an_consts as a
+from corti.cache import stage_cache
+from corti.result_store import ResultStore
+
+# numbers the memory-mapped files of the responses, so a response never overwrites an earlier one
+_responseNumbers = itertools.count()
 
 
 class AuditoryNerveResponse:
-    """Synthesizes an Auditory Nerve population response from the output of a periphery model
+    """Synthesizes an Auditory Nerve population response from the output of a periphery model.
+    Only the summed response is kept; the weighted responses of each fiber type (lowSR, medSR, highSR) are computed
+    when they are asked for.
     """
 
     TotalFiberPerIHC = 19  # to match the verhulst model scaling.
@@ -26,30 +35,61 @@ class AuditoryNerveResponse:
                             type component, and contain values between zero and one.
         """
         self.periph = an
-        self.Fs = an.conf.Fs
+        self.Fs = an.conf.analysisFs
         self.cf = an.output[p.CenterFrequency]
         self.anfh = an.output[p.AuditoryNerveFiberHighSpont]
         self.anfm = an.output[p.AuditoryNerveFiberMediumSpont]
         self.anfl = an.output[p.AuditoryNerveFiberLowSpont]
         self.timeLen, self.cfCount = self.anfh.shape
         self.degradation = self.parse_degradation(degradation)
-        self.lowSR = None
-        self.medSR = None
-        self.highSR = None
+        self.weights = None
         self.ANR = None
 
+    @property
+    def lowSR(self) -> np.ndarray:
+        """The weighted low SR fiber response of the last population response"""
+        return self._component(self.weights, 0, slice(None))
+
+    @property
+    def medSR(self) -> np.ndarray:
+        """The weighted medium SR fiber response of the last population response"""
+        return self._component(self.weights, 1, slice(None))
+
+    @property
+    def highSR(self) -> np.ndarray:
+        """The weighted high SR fiber response of the last population response"""
+        return self._component(self.weights, 2, slice(None))
+
+    def _component(self, weights: tuple, fiberType: int, rows: slice) -> np.ndarray:
+        if weights is None:
+            return None
+        return np.multiply(weights[fiberType], (self.anfl, self.anfm, self.anfh)[fiberType][rows])
+
     def save(self):
         if self.periph.conf.pypet:
             return
+        # the weights and response of this call, which the next response may replace before they are written
+        writer.submit(self._write, self.weights, self.ANR)
+
+    def _write(self, weights: tuple, anr: np.ndarray) -> None:
         # todo: make this follow the naming conventions in base.py.
-        name = r.AuditoryNerveOutputFilePrefix + "{0}dB".format(self.periph.output[p.StimulusLevel])
+        level = self.periph.output[p.StimulusLevel]
         outpath = self.periph.outputFolder
-        # save the data out to a npz file whose keys are the field names of output.
-        np.savez(path.join(outpath, name), **{
-            a.LowSR : self.lowSR,
-            a.MedSR : self.medSR,
-            a.HighSR: self.highSR,
-            a.SumANR: self.ANR
+        if self.periph.conf.store == 'hdf5':
+            # one component at a time, so they are not all held in memory
+            store = ResultStore.for_run(self.periph.conf, outpath)
+            for key, component in ((a.LowSR, 0), (a.MedSR, 1), (a.HighSR, 2)):
+                store.write('auditory_nerve', level, {key: self._component(weights, component, slice(None))})
+            store.write('auditory_nerve', level, {a.SumANR: anr})
+            return
+        name = r.AuditoryNerveOutputFilePrefix + "{0}dB".format(level)
+        # save the data out to a npz file whose keys are the field names of output.  The fiber type components are
+        # computed and written a block of samples at a time.
+        _savez_blocks(path.join(outpath, name), anr.shape, {
+            a.LowSR : lambda rows: self._component(weights, 0, rows),
+            a.MedSR : lambda rows: self._component(weights, 1, rows),
+            a.HighSR: lambda rows: self._component(weights, 2, rows),
+            a.SumANR: lambda rows: anr[rows]
         })
         logging.info("wrote {0:<10} to {1}".format(name, path.abspath(outpath)))
 
@@ -77,28 +117,81 @@ class AuditoryNerveResponse:
 
         return self.sum_fibers(lsr_weight, msr_weight, hsr_weight, self.degradation)
 
-    def sum_fibers(self, ls_weight, ms_weight, hs_weight, degradation=None):
-        cfs = self.cfCount
-        timeLen = self.timeLen
+    def batched_an_response(self, degradations: [], cf_weighting: bool = True) -> np.ndarray:
+        """Create the auditory nerve population responses for many degradation profiles at once.
+        Each profile is a profile name (see parse_degradation), a scalar, a (low, medium, high) triple, a (1 x CF) row
+        applied to every fiber type or a (low, medium, high) x CF array; see _profile.  The responses are summed one
+        fiber type and block of samples at a time, so the fiber responses are never copied or read into memory whole.
+
+        :param cf_weighting: weight the fiber types per CF as cf_weighted_an_response does, or as
+                             unweighted_an_response does by default
+        :return: (profile x time x CF) AN population responses
+        """
+        if cf_weighting:
+            weights = np.array(self._map_cf_dependent_distribution(self.TotalFiberPerIHC))
+        else:
+            weights = np.array([3., 3., 13.])[:, np.newaxis]
+        # (profile x fiber type x CF) factors of the fiber responses
+        factors = np.stack([self._profile(d) for d in degradations]) * weights * self.scale()
+        responses = np.empty((len(factors), self.timeLen, self.cfCount))
+        for rows in _blocks(self.timeLen, self.cfCount * len(factors)):
+            np.multiply(factors[:, 0, np.newaxis], self.anfl[rows], out=responses[:, rows])
+            responses[:, rows] += factors[:, 1, np.newaxis] * self.anfm[rows]
+            responses[:, rows] += factors[:, 2, np.newaxis] * self.anfh[rows]
+        return responses
+
+    def _profile(self, degradation) -> np.ndarray:
+        """A degradation profile as a (fiber type x CF) array.  A name, scalar or (low, medium, high) triple degrades
+        every CF alike, as in SuperpositionSweep.waves; a per-CF profile has one row for every fiber type, or a single
+        row for all of them.
+        """
+        if isinstance(degradation, str):
+            degradation = self.parse_degradation(degradation)
+        degradation = np.asarray(degradation, dtype=float)
+        if degradation.ndim == 1:
+            if len(degradation) != 3:
+                raise ValueError("a 1-D degradation profile is a (low, medium, high) triple; give a per-CF profile as "
+                                 "a (1 x CF) or (3 x CF) array")
+            degradation = degradation[:, np.newaxis]
+        return np.broadcast_to(degradation, (3, self.cfCount))
 
+    def sum_fibers(self, ls_weight, ms_weight, hs_weight, degradation=None):
         if degradation is not None:
             ls_weight, ms_weight, hs_weight = self.degrade_an_components(ls_weight, ms_weight, hs_weight, degradation)
 
-        lsr = numpy.matlib.repmat(ls_weight * np.ones((1, cfs)), timeLen, 1) * self.anfl
-        msr = numpy.matlib.repmat(ms_weight * np.ones((1, cfs)), timeLen, 1) * self.anfm
-        hsr = numpy.matlib.repmat(hs_weight * np.ones((1, cfs)), timeLen, 1) * self.anfh
+        self.weights = (ls_weight, ms_weight, hs_weight)
+        # with a pipeline cache, the response to the same periphery output and weights is only summed once
+        cache = stage_cache(self.periph.conf) if self.periph.cacheKey is not None else None
+        if cache is None:
+            self.ANR = self._sum(*self.weights)
+        else:
+            key = cache.key('auditory_nerve', self.periph.cacheKey, self.scale(),
+                            *(np.asarray(w, dtype=float) for w in self.weights))
+            self.ANR = cache.fetch(key, lambda: {a.SumANR: self._sum(*self.weights)})[0][a.SumANR]
+        self.save()
+        return self.ANR
+
+    def _sum(self, ls_weight, ms_weight, hs_weight) -> np.ndarray:
+        # scalar or per-CF weights broadcast along time, summed into one buffer (a memory-mapped file if asked to)
+        scale = self.scale()
+        folder = self.periph.outputFolder if self.periph.conf.memmap and not self.periph.conf.pypet else None
+        # a new file for every response: earlier responses, and saves of them that are still queued, keep their data
+        name = "{0}-{1}".format(a.SumANR, next(_responseNumbers))
+        anr = mapped.empty(folder, name, self.periph.output.get(p.StimulusLevel), (self.timeLen, self.cfCount))
+        for rows in _blocks(self.timeLen, self.cfCount):
+            np.multiply(np.multiply(ls_weight, scale), self.anfl[rows], out=anr[rows])
+            anr[rows] += np.multiply(ms_weight, self.anfm[rows]) * scale
+            anr[rows] += np.multiply(hs_weight, self.anfh[rows]) * scale
+        return mapped.seal(anr)
 
-        self.lowSR = lsr
-        self.medSR = msr
-        self.highSR = hsr
+    def scale(self) -> float:
+        """The factor that scales the summed fiber responses of the periphery model to the AN population response"""
         if self.periph.conf.modelType == PeripheryType.VERHULST:
-            self.ANR = (lsr + msr + hsr) * self.M1
+            return self.M1
         elif self.periph.conf.modelType == PeripheryType.ZILANY:
-            self.ANR = (lsr + msr + hsr) * self.Z1
+            return self.Z1
         else:
             raise TypeError("periphery type {} not found".format(self.periph.conf.modelType.name))
-        self.save()
-        return self.ANR
 
     def _map_cf_dependent_distribution(self, total_fiber_scaling_factor=1) -> ():
         """Returns a distribution percentage of hair cell SR types as a function of CF.
@@ -153,3 +246,25 @@ class AuditoryNerveResponse:
                 "ls-moderate": (1, 0.75, 0.75),
                 "ls-severe"  : (1, 0.5, 0.5),
             }.get(d.casefold(), (1, 1, 1))
+
+
+def _blocks(rows: int, columns: int, blockBytes: int = 2 ** 24):
+    """Slices of blocks of rows of a (rows x columns) float64 matrix that are about blockBytes large"""
+    step = max(1, blockBytes // (8 * max(columns, 1)))
+    for start in range(0, rows, step):
+        yield slice(start, start + step)
+
+
+def _savez_blocks(file: str, shape: (int, int), arrays: {}) -> None:
+    """np.savez of (rows x columns) float64 arrays given as functions of a slice of rows, which are called and written
+    one block of rows at a time, so the arrays are never held in memory whole.
+    """
+    if not file.endswith('.npz'):
+        file += '.npz'
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)), 'fortran_order': False, 'shape': shape}
+    with zipfile.ZipFile(file, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, rows in arrays.items():
+            with archive.open(name + '.npy', mode='w', force_zip64=True) as f:
+                np.lib.format.write_array_header_1_0(f, header)
+                for block in _blocks(*shape):
+                    f.write(np.ascontiguousarray(rows(block), dtype=np.float64).tobytes())
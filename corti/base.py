@@ -15,6 +15,15 @@ def sanitize_level(levels: str):
     return [float(f) for f in levels.split(",") if levels and f]
 
 
+def n_workers(n_jobs) -> int:
+    """Translate a `--jobs` style argument into a worker count: negative values (or None) use every core, and 0 is
+    taken as 1
+    """
+    if n_jobs is None or int(n_jobs) < 0:
+        return os.cpu_count() or 1
+    return max(1, int(n_jobs))
+
+
 class PeripheryType(Enum):
     """The model to use for the auditory periphery simulations"""
     VERHULST = auto()
@@ -40,6 +49,10 @@ class RuntimeConstants:
     PeripheryConfigurationName = attr.ib(default="summary-plots.pdf")
     ResourceDirectoryName = attr.ib(default="resources")
     StimulusTemplateName = attr.ib(default="default_stimulus_template.yaml")
+    ResultStoreFileName = attr.ib(default="results.h5")
+    MappedOutputFilePrefix = attr.ib(default="mapped-")
+    RunManifestName = attr.ib(default="run-manifest.yaml")
+    StimulusFileName = attr.ib(default="stimulus.npy")
 
 
 runtime_consts = RuntimeConstants()
@@ -55,6 +68,7 @@ class PeripheryConstants:
     AuditoryNerveFiberHighSpont = attr.ib(default="an_high_spont")
     AuditoryNerveFiberMediumSpont = attr.ib(default="an_medium_spont")
     AuditoryNerveFiberLowSpont = attr.ib(default="an_low_spont")
+    AuditoryNerveSpikes = attr.ib(default="an_spikes")
     InnerHairCell = attr.ib(default="ihc")
     Stimulus = attr.ib(default="stimulus")
     StimulusLevel = attr.ib(default="stimulus_level")
@@ -1,24 +1,162 @@
 import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import numpy as np
-# noinspection PyPackageRequirements
-import progressbar
 from os import path
 
-from corti.base import runtime_consts, brain_consts as b, periph_consts as p, BrainstemType
+from corti import writer
+from corti.base import runtime_consts, brain_consts as b, periph_consts as p, BrainstemType, n_workers
+from corti.cache import StageCache, stage_cache
+from corti.convolution import FFTConvolver, AlphaFilter
 from corti.periphery_configuration import PeripheryOutput
+from corti.result_store import ResultStore
 
 
-def simulate_brainstem(anResults: [(PeripheryOutput, np.ndarray, str)]) -> [{}]:
-    # return Parallel(n_jobs=-1, max_nbytes=100e6)(delayed(_solve_one)(x) for x in anResults)
-    retval = []
-    for i in anResults:
-        retval.append(_solve_one(i))
-    return retval
+def simulate_brainstem(anResults: [(PeripheryOutput, np.ndarray, str)], workers: int = 1, backend: str = 'fft',
+                       waves_only: bool = False, jobs: int = 1) -> [{}]:
+    """Simulate the brainstem response to every (periphery output, AN response, model type) level; see iter_brainstem"""
+    return list(iter_brainstem(anResults, workers, backend, waves_only, jobs))
 
 
-def _solve_one(periphery: (PeripheryOutput, np.ndarray, str)) -> {}:
-    return CentralAuditoryResponse(periphery[0], periphery[1], periphery[2]).run()
+def iter_brainstem(anResults: [(PeripheryOutput, np.ndarray, str)], workers: int = 1, backend: str = 'fft',
+                   waves_only: bool = False, jobs: int = 1):
+    """
+    Simulate the brainstem response to every (periphery output, AN response, model type) level, yielding the responses
+    in level order.
+    :param workers: number of threads used by the convolutions of a level
+    :param jobs: number of worker processes simulating levels at once (negative values use every core).  The AN
+    responses are handed to the workers in shared memory, and at most 2 * jobs levels are in flight, so the memory used
+    does not grow with the number of levels.  The responses are saved by this process, in level order.
+    """
+    jobs = n_workers(jobs)
+    if jobs == 1:
+        for i in anResults:
+            yield _solve_one(i, workers, backend, waves_only)
+        return
+    window = deque()
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=writer.process_context()) as pool:
+        try:
+            for an, anr, modelType in anResults:
+                if len(window) == 2 * jobs:
+                    yield _collect(window.popleft())
+                cache, key = _cache_key(an, anr, modelType, backend, waves_only)
+                output = cache.get(key) if cache is not None else None
+                if output is not None:
+                    # a level found in the pipeline cache is not simulated again
+                    future = Future()
+                    future.set_result(output)
+                    window.append((future, None, an, None, key))
+                    continue
+                block = _share(anr)
+                window.append((pool.submit(_solve_shared, _periphery_summary(an), block.name, anr.shape, anr.dtype.str,
+                                           modelType, workers, backend, waves_only), block, an, cache, key))
+            while window:
+                yield _collect(window.popleft())
+        finally:
+            for future, block, _, _, _ in window:
+                future.cancel()
+                if block is not None:
+                    block.close()
+                    block.unlink()
+
+
+def _solve_one(periphery: (PeripheryOutput, np.ndarray, str), workers: int = 1, backend: str = 'fft',
+               waves_only: bool = False) -> {}:
+    return CentralAuditoryResponse(periphery[0], periphery[1], periphery[2], workers, backend, waves_only).run()
+
+
+def save_brainstem(an: PeripheryOutput, output: {}) -> None:
+    """Save the brainstem response to the stimulus level of the periphery output `an`, on the writer thread if there is
+    one
+    """
+    if an.conf.pypet:
+        return
+    writer.submit(_write_brainstem, an, output)
+
+
+def _write_brainstem(an: PeripheryOutput, output: {}) -> None:
+    level = an.output[p.StimulusLevel]
+    outpath = an.outputFolder
+    if an.conf.store == 'hdf5':
+        ResultStore.for_run(an.conf, outpath).write('brainstem', level, output)
+        return
+    name = runtime_consts.BrainstemOutputFilePrefix + "{0}dB".format(level)
+    # save the data out to a npz file whose keys are the field names of output.
+    np.savez(path.join(outpath, name), **output)
+    logging.log(logging.INFO, "wrote {0:<10} to {1}".format(name, path.abspath(outpath)))
+
+
+def _share(anr: np.ndarray) -> shared_memory.SharedMemory:
+    """Copy an AN response into a new shared memory block"""
+    block = shared_memory.SharedMemory(create=True, size=max(anr.nbytes, 1))
+    np.ndarray(anr.shape, anr.dtype, buffer=block.buf)[...] = anr
+    return block
+
+
+def _collect(job) -> {}:
+    """Wait for a level submitted to the worker pool, free its shared memory, and cache and save its response"""
+    future, block, an, cache, key = job
+    try:
+        output = future.result()
+    finally:
+        if block is not None:
+            block.close()
+            block.unlink()
+    if cache is not None:
+        cache.put(key, output)
+    save_brainstem(an, output)
+    return output
+
+
+def _cache_key(an: PeripheryOutput, anr: np.ndarray, modelType: str, backend: str,
+               waves_only: bool) -> (StageCache, str):
+    """The pipeline cache of a level and the key of its brainstem response in it, or (None, None) if the periphery
+    output of the level is not cached.  The key hashes the AN response itself, so any change to the periphery or to
+    the fiber weighting is a miss.
+    """
+    cache = stage_cache(an.conf) if an.cacheKey is not None else None
+    if cache is None:
+        return None, None
+    return cache, cache.key('brainstem', np.asarray(anr), np.asarray(an.output[p.CenterFrequency], dtype=float),
+                            float(an.conf.analysisFs), modelType, backend, bool(waves_only))
+
+
+def _periphery_summary(an: PeripheryOutput) -> PeripheryOutput:
+    """The parts of a periphery output the brainstem uses, to keep the other outputs out of the worker processes"""
+    return PeripheryOutput(output={key: an.output[key] for key in (p.CenterFrequency, p.StimulusLevel) if
+                                   key in an.output}, conf=an.conf, outputFolder=an.outputFolder)
+
+
+def _solve_shared(an: PeripheryOutput, name: str, shape: (int, int), dtype: str, modelType: str, workers: int,
+                  backend: str, waves_only: bool) -> {}:
+    """Simulate a level in a worker process, reading the AN response from the shared memory block `name`"""
+    block = shared_memory.SharedMemory(name=name)
+    anr = np.ndarray(shape, dtype, buffer=block.buf)
+    try:
+        return CentralAuditoryResponse(an, anr, modelType, workers, backend, waves_only)._simulate()
+    finally:
+        del anr
+        block.close()
+
+
+# convolution engines (and so their kernel spectra) shared by the responses with the same time axis, the most
+# recently used last; only the last MaxConvolvers are kept
+_convolvers = OrderedDict()
+MaxConvolvers = 4
+# the size of the blocks of zeros the wrap-around correction of CentralAuditoryResponse._stage is filtered over
+_CorrectionBlockBytes = 2 ** 24
+
+
+def _convolver(length: int, fs: float, workers: int) -> FFTConvolver:
+    key = (length, fs, workers)
+    if key not in _convolvers:
+        _convolvers[key] = FFTConvolver(length, workers)
+        while len(_convolvers) > MaxConvolvers:
+            _convolvers.popitem(last=False)
+    _convolvers.move_to_end(key)
+    return _convolvers[key]
 
 
 class CentralAuditoryResponse:
@@ -28,20 +166,40 @@ class CentralAuditoryResponse:
     neural responses to amplitude-modulated tones,” J. Acoust. Soc. Am., 116, 2173. doi:10.1121/1.1784442
     - Carney, L. H., Li, T., and McDonough, J. M. (2015). “Speech Coding in the Brain: Representation of Vowel
     Formants by Midbrain Neurons Tuned to Sound Fluctuations,” eNeuro, 2, 1–12. doi:10.1523/ENEURO.0004-15.2015
+    The convolutions with the alpha kernels are computed by FFT (backend 'fft') or by recursive filters ('iir'), which
+    give the same responses.
+    The models are linear, so if only the waves are needed (wavesOnly), the AN responses of the CFs they sum are summed
+    first and filtered once, and the population responses are not computed.
     """
 
     LowFrequencyCutoff = 175.0  # CFs below this threshold will not be used to estimate the compound action potential
+    ICInhibitionDelay = 0.7e-3  # delay of the inhibitory input of every IC model
+    # (Aic, Sic, Tin, Tex) of the IC models
+    ICBandpass = (1, 2, 5e-3, 0.7e-3)  # high-frequency BMF per Carney 2015 Fig 3B
+    ICBandReject = (0.6, 2, 5e-3, 2e-3)  # band-reject BMF per Carney 2015 Fig 3A
+    ICLowpass = (1, 2, 5e-3, 0.7e-3)  # low-pass BMF per Carney 2015 Fig 3B
+    ICScale = (2 * 0.15e-6) / 0.0033  # idem with scaling W1 & 3
+    CalibrationFs = 100e3  # the sample rate the CN and IC scaling factors were found at
 
-    def __init__(self, an: PeripheryOutput, anr: np.ndarray, modelType: str):
+    def __init__(self, an: PeripheryOutput, anr: np.ndarray, modelType: str, workers: int = 1, backend: str = 'fft',
+                 wavesOnly: bool = False):
         self.anr = anr
         self.anfOut = an
-        self.Fs = an.conf.Fs
+        self.Fs = an.conf.analysisFs
+        # the convolutions are sums over samples, so they scale with the sample rate
+        self.kernelScale = self.CalibrationFs / self.Fs
         self.cf = an.output[p.CenterFrequency]
         dur = anr.shape[0]
         self.time = np.linspace(0, dur / self.Fs, num=dur)
         self.cf = self.anfOut.output[p.CenterFrequency]
         self.cutoffCf = [index for index, value in enumerate(self.cf) if value >= self.LowFrequencyCutoff][-1]
         self.brainstemType = BrainstemType[modelType]
+        if backend not in ('fft', 'iir'):
+            raise ValueError("backend must be 'fft' or 'iir'")
+        self.backend = backend
+        self.wavesOnly = wavesOnly
+        self.convolver = _convolver(dur, self.Fs, workers)
+        self._icPathWaves = None
 
     def run(self) -> {}:
         """
@@ -50,19 +208,14 @@ class CentralAuditoryResponse:
         neural responses to amplitude-modulated tones,” J. Acoust. Soc. Am., 116, 2173. doi:10.1121/1.1784442
         """
 
-        output = self._simulate()
-        self._save(output)
+        cache, key = _cache_key(self.anfOut, self.anr, self.brainstemType.name, self.backend, self.wavesOnly)
+        if cache is None:
+            output = self._simulate()
+        else:
+            output, _ = cache.fetch(key, self._simulate)
+        save_brainstem(self.anfOut, output)
         return output
 
-    def _save(self, output: {}) -> None:
-        if self.anfOut.conf.pypet:
-            return
-        name = runtime_consts.BrainstemOutputFilePrefix + "{0}dB".format(self.anfOut.output[p.StimulusLevel])
-        outpath = self.anfOut.outputFolder
-        # save the data out to a npz file whose keys are the field names of output.
-        np.savez(path.join(outpath, name), **output)
-        logging.log(logging.INFO, "wrote {0:<10} to {1}".format(name, path.abspath(outpath)))
-
     def _shift(self, delay: float) -> int:
         return int(round(delay * self.Fs))
 
@@ -87,105 +240,132 @@ class CentralAuditoryResponse:
         inhibition = s * self.__alpha(Tin)
         return np.pad(inhibition, (lag, 0), 'constant')[:-lag]
 
-    def _cn(self, cf) -> np.ndarray:
-        AN = self.anr
+    def _excitation_kernel(self, paths: ((float, float, float, float),)) -> np.ndarray:
+        """The summed excitation waves of the (a, s, tin, tex) paths of a stage, scaled by a"""
+        return sum(a * self._excitation_wave(tex) for a, _, _, tex in paths)
+
+    def _inhibition_kernel(self, paths: ((float, float, float, float),), delay: float) -> np.ndarray:
+        """The summed inhibition waves of the (a, s, tin, tex) paths of a stage, delayed by delay"""
+        return sum(self._inhibition_wave(s, tin, delay) for _, s, tin, _ in paths)
+
+    def _stage(self, x: np.ndarray, wrapped: np.ndarray, paths: ((float, float, float, float),),
+               delay: float) -> np.ndarray:
+        """The excitatory-inhibitory stage of the CN and IC models, for every CF (time x CF): the sum over its (a, s,
+        tin, tex) paths of a * excitation(tex) convolved with x, minus inhibition(s, tin, delay) convolved with x rolled
+        by the delay.
+        The paths are linear in x and share the delay, so they are compiled into one composite kernel (the excitation
+        minus the inhibition delayed once more by the roll), whose spectrum is cached with the convolver.  The samples
+        the roll wraps around to the front of x, `wrapped`, add a correction: their convolution with the inhibition,
+        which recursive alpha filters compute in linear time.
+        """
+        lag = self._shift(delay)
+        dt = self.time[1] - self.time[0]
+        if self.backend == 'iir':
+            return _RecursiveStage(paths, lag, dt, x.shape[1], wrapped)(x)
+        n = len(x)
+
+        def composite():
+            return self._excitation_kernel(paths) - np.pad(self._inhibition_kernel(paths, delay), (lag, 0))[:n]
+
+        out = self.convolver.convolve((x, self.convolver.spectrum(('stage', paths, delay), composite)))
+        if not lag:
+            return out
+        # the filters take `wrapped` as the first lag samples of their input, and then run on from their state over
+        # blocks of zeros, so that no input or output matrix as long as x is allocated
+        step = max(1, _CorrectionBlockBytes // (8 * x.shape[1]))
+        zeros = np.zeros((step, x.shape[1]))
+        for tin, s in _gains(paths)[1].items():
+            inhibition = AlphaFilter(tin, dt, s, lag, x.shape[1])
+            out[:lag] -= inhibition(wrapped)
+            for start in range(lag, n, step):
+                stop = min(start + step, n)
+                out[start:stop] -= inhibition(zeros[:stop - start])
+        return out
+
+    def _stage_tail(self, x: np.ndarray, wrapped: np.ndarray, paths: ((float, float, float, float),), delay: float,
+                    n: int) -> np.ndarray:
+        """The last n samples of the full (2N - 1 long) convolutions of _stage"""
+        rolled = np.concatenate((wrapped, x[:len(x) - self._shift(delay)]))
+        return (FFTConvolver.tail(x, self._excitation_kernel(paths), n) -
+                FFTConvolver.tail(rolled, self._inhibition_kernel(paths, delay), n))
+
+    def _cn(self, AN: np.ndarray) -> (np.ndarray, np.ndarray):
+        """CN responses (time x CF) to the AN responses AN.
+        The full convolutions are 2N - 1 samples long; the IC rolls them, which wraps their last samples to the front,
+        so these are returned as well.
+        """
         Acn = 1.5
         Scn = 0.6
         Dcn = 1e-3
-        M3 = (1.5 * 0.15e-6) / 0.0036  # idem  with scaling W1
+        M3 = (1.5 * 0.15e-6) / 0.0036 * self.kernelScale  # idem  with scaling W1
         Tex = 0.5e-3
         Tin = 2e-3
-        inhCn = self._inhibition_wave(Scn, Tin, Dcn)
-        Rcn1 = Acn * np.convolve(self._excitation_wave(Tex), AN[:, cf])
-        Rcn2 = np.convolve(inhCn, np.roll(AN[:, cf], self._shift(Dcn)))
-        Rcn = (Rcn1 - Rcn2) * M3
-        return Rcn
-
-    def _ic(self, rcn, aic, sic, dic, tin, tex):
-        inhIc = self._inhibition_wave(sic, tin, dic)
-        Ric1 = aic * np.convolve(self._excitation_wave(tex), rcn)
-        Ric2 = np.convolve(inhIc, np.roll(rcn, self._shift(dic)))
-        return (Ric1 - Ric2)
-
-    def _ic_bandpass(self, rcn):
-        """
-        Gives a high-frequency BMF per Carney 2015 Fig 3B.
-        """
-        Tex = 0.7e-3
-        Tin = 5e-3
-        Dic = 0.7e-3
-        Aic = 1
-        Sic = 2
-        return self._ic(rcn, Aic, Sic, Dic, Tin, Tex)
-
-    def _ic_lowpass(self, rcn):
-        """
-        Gives a low-pass BMF per Carney 2015 Fig 3B.
-        :param rcn:
-        :return:
-        """
-        Tex = 0.7e-3
-        Tin = 5e-3
-        Dic = 0.7e-3
-        Aic = 1
-        Sic = 2
-        return self._ic(rcn, Aic, Sic, Dic, Tin, Tex)
-
-    def _ic_band_reject(self, rcn):
-        """
-        Gives a band-reject BMF per Carney 2015 Fig 3A.
-        :param rcn:
-        :return:
-        """
-        Tex = 2e-3
-        Tin = 5e-3
-        Dic = 0.7e-3
-        Aic = 0.6
-        Sic = 2
-        return self._ic(rcn, Aic, Sic, Dic, Tin, Tex)
-
-    def __simulate_IC(self, modelType: BrainstemType, rcn: np.ndarray, weights=(.5, .25, .25)) -> np.ndarray:
-        M5 = (2 * 0.15e-6) / 0.0033  # idem with scaling W1 & 3
+        paths = ((Acn, Scn, Tin, Tex),)
+        wrapped = AN[len(AN) - self._shift(Dcn):]
+        Rcn = M3 * self._stage(AN, wrapped, paths, Dcn)
+        tail = M3 * self._stage_tail(AN, wrapped, paths, Dcn, self._shift(self.ICInhibitionDelay))
+        return Rcn, tail
 
+    def _ic_paths(self, modelType: BrainstemType, weights=(.5, .25, .25)) -> ((float, float, float, float),):
+        """The weighted (Aic, Sic, Tin, Tex) paths of the IC model"""
         if modelType == BrainstemType.NELSON_CARNEY_2004:
-            retval = self._ic_bandpass(rcn)
+            return (self.ICBandpass,)
         elif modelType == BrainstemType.CARNEY_2015:
-            retval = (self._ic_bandpass(weights[0] * rcn) +
-                      self._ic_band_reject(weights[1] * rcn) +
-                      self._ic_lowpass(weights[2] * rcn))
+            return tuple((w * a, w * s, tin, tex) for w, (a, s, tin, tex) in
+                         zip(weights, (self.ICBandpass, self.ICBandReject, self.ICLowpass)))
         else:
             raise NotImplementedError
 
-        return retval * M5
+    def __simulate_IC(self, modelType: BrainstemType, rcn: np.ndarray, rcnTail: np.ndarray,
+                      weights=(.5, .25, .25)) -> np.ndarray:
+        """IC responses (time x CF) to the CN responses rcn, whose full convolutions end in rcnTail"""
+        paths = self._ic_paths(modelType, weights)
+        wrapped = rcnTail[len(rcnTail) - self._shift(self.ICInhibitionDelay):]
+        return self._stage(rcn, wrapped, paths, self.ICInhibitionDelay) * self.ICScale * self.kernelScale
+
+    def wave5_sweep(self, weights: np.ndarray) -> np.ndarray:
+        """
+        Wave V of the CARNEY_2015 model for many (band-pass, band-reject, low-pass) weightings of its IC paths.
+        The IC is linear in the weights, so the Wave V of each unweighted path is computed once (and kept for later
+        calls), and the Wave V of all weightings are a single matrix product.
+        :param weights: (W x 3) weights, one row per weighting
+        :return: (W x time) Wave V waveforms
+        """
+        if self.brainstemType != BrainstemType.CARNEY_2015:
+            raise ValueError("only the CARNEY_2015 model has weighted IC paths")
+        if self._icPathWaves is None:
+            rcn, rcnTail = self._cn(self.anr[:, 0:self.cutoffCf + 1].sum(axis=1, keepdims=True))
+            wrapped = rcnTail[len(rcnTail) - self._shift(self.ICInhibitionDelay):]
+            self._icPathWaves = self.ICScale * self.kernelScale * np.array(
+                [self._stage(rcn, wrapped, (path,), self.ICInhibitionDelay)[:, 0]
+                 for path in (self.ICBandpass, self.ICBandReject, self.ICLowpass)])
+        return np.atleast_2d(weights) @ self._icPathWaves
 
     def _simulate(self, weights: [(float, float, float)] = None) -> {}:
-        timeLen, cfCount = self.anr.shape
-        AN = self.anr
-        W1 = np.zeros(timeLen)
-        IC = np.zeros(timeLen)
-        CN = np.zeros(timeLen)
-        RanF = np.zeros((cfCount, timeLen))
-        RicF = np.zeros((cfCount, timeLen))
-        RcnF = np.zeros((cfCount, timeLen))
-
-        with progressbar.ProgressBar(max_value=cfCount) as bar:
-            for i in range(cfCount):
-
-                Rcn = self._cn(i)
-                if weights is not None:
-                    Ric = self.__simulate_IC(self.brainstemType, Rcn, weights)
-                else:
-                    Ric = self.__simulate_IC(self.brainstemType, Rcn)
-
-                if i <= self.cutoffCf:
-                    W1 += AN[:, i]
-                    CN += Rcn[0:timeLen]
-                    IC += Ric[0:timeLen]
-
-                RanF[i, :] = AN[:, i]
-                RicF[i, :] = Ric[0:timeLen]  # chop off the duplicated convolution side
-                RcnF[i, :] = Rcn[0:timeLen]  # chop off the duplicated convolution side
-                bar.update(i)
+        # the waves sum the CFs above the low frequency cutoff
+        waveCfs = slice(0, self.cutoffCf + 1)
+        AN = self.anr[:, waveCfs].sum(axis=1, keepdims=True) if self.wavesOnly else self.anr
+        Rcn, RcnTail = self._cn(AN)
+        if weights is not None:
+            Ric = self.__simulate_IC(self.brainstemType, Rcn, RcnTail, weights)
+        else:
+            Ric = self.__simulate_IC(self.brainstemType, Rcn, RcnTail)
+
+        if self.wavesOnly:
+            return {
+                b.BrainstemModelType: self.brainstemType.name,
+                b.Wave1_AN    : AN[:, 0],
+                b.Wave3_CN    : Rcn[:, 0],
+                b.Wave5_IC    : Ric[:, 0]
+            }
+
+        W1 = AN[:, waveCfs].sum(axis=1)
+        CN = Rcn[:, waveCfs].sum(axis=1)
+        IC = Ric[:, waveCfs].sum(axis=1)
+
+        RanF = AN.T.copy()
+        RicF = Ric.T
+        RcnF = Rcn.T
         return {
             b.BrainstemModelType: self.brainstemType.name,
             b.Wave1_AN    : W1,
@@ -195,3 +375,84 @@ class CentralAuditoryResponse:
             b.CNPopulation: RcnF,
             b.ICPopulation: RicF
         }
+
+
+class StreamingCentralAuditoryResponse(CentralAuditoryResponse):
+    """
+    The CentralAuditoryResponse computed block by block with recursive filters whose states carry over from one block to
+    the next, for stimuli too long to simulate at once.  The concatenated blocks give the responses of the whole
+    stimulus, except that the delayed inhibitory inputs start from silence instead of wrapping around the end of the
+    stimulus (the np.roll of the batch model).
+    The batch model samples its kernels on np.linspace(0, N / Fs, N), a spacing of N / (Fs * (N - 1)) for a stimulus of
+    N samples.  Given the `length` N of the whole stimulus, the filters use the same spacing, and the blocks match the
+    'iir' backend of the batch model wherever it wraps silence; otherwise they use the exact spacing 1 / Fs.
+    Only process() simulates; run() and wave5_sweep(), which need the whole AN response, are not available.
+        :parameter self.dt: the sample spacing of the filters
+    """
+
+    def __init__(self, an: PeripheryOutput, modelType: str, weights: [(float, float, float)] = None,
+                 wavesOnly: bool = False, length: int = None):
+        self.anfOut = an
+        self.Fs = an.conf.analysisFs
+        self.kernelScale = self.CalibrationFs / self.Fs
+        self.cf = an.output[p.CenterFrequency]
+        self.cutoffCf = [index for index, value in enumerate(self.cf) if value >= self.LowFrequencyCutoff][-1]
+        self.brainstemType = BrainstemType[modelType]
+        self.weights = weights
+        self.wavesOnly = wavesOnly
+        self.dt = 1 / self.Fs if length is None else length / (self.Fs * (length - 1))
+        self._stages = []
+        self._stageIndex = 0
+
+    def process(self, anr: np.ndarray) -> {}:
+        """Simulate the next (time x CF) block of the AN response"""
+        self.anr = anr
+        self._stageIndex = 0
+        return self._simulate(self.weights)
+
+    def run(self) -> {}:
+        raise NotImplementedError("a streaming response is simulated block by block with process()")
+
+    def wave5_sweep(self, weights: np.ndarray) -> np.ndarray:
+        raise NotImplementedError("the Wave V sweep needs the whole AN response; use CentralAuditoryResponse")
+
+    def _stage(self, x, wrapped, paths, delay):
+        # the stages run in the same order in every block
+        if self._stageIndex == len(self._stages):
+            self._stages.append(_RecursiveStage(paths, self._shift(delay), self.dt, x.shape[1]))
+        stage = self._stages[self._stageIndex]
+        self._stageIndex += 1
+        return stage(x)
+
+    def _stage_tail(self, x, wrapped, paths, delay, n):
+        return np.zeros((n, x.shape[1]))
+
+
+class _RecursiveStage:
+    """
+    The excitatory-inhibitory stage of CentralAuditoryResponse as recursive alpha filters, one per distinct excitatory
+    and inhibitory time constant of its (a, s, tin, tex) paths.  The inhibitory input is delayed twice by lag, once by
+    the roll of the input and once by the delayed kernel; the delay line starts with the `wrapped` samples, which the
+    roll moves to the front, or with silence.
+    """
+
+    def __init__(self, paths: ((float, float, float, float),), lag: int, dt: float, channels: int,
+                 wrapped: np.ndarray = None):
+        excitation, inhibition = _gains(paths)
+        self.filters = [AlphaFilter(tex, dt, a, 0, channels) for tex, a in excitation.items()]
+        for tin, s in inhibition.items():
+            self.filters.append(AlphaFilter(tin, dt, -s, 2 * lag, channels))
+            if wrapped is not None:
+                self.filters[-1].prime(np.concatenate((np.zeros((lag, channels)), wrapped)))
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        return sum(f(x) for f in self.filters)
+
+
+def _gains(paths: ((float, float, float, float),)) -> ({}, {}):
+    """The summed gains of the (a, s, tin, tex) paths of a stage, as {tex: a} and {tin: s}"""
+    excitation, inhibition = {}, {}
+    for a, s, tin, tex in paths:
+        excitation[tex] = excitation.get(tex, 0) + a
+        inhibition[tin] = inhibition.get(tin, 0) + s
+    return excitation, inhibition
@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import os
+import tempfile
+from os import path
+
+import numpy as np
+
+from corti.periphery_configuration import SpikeTrains
+
+
+class ArrayCache:
+    """
+    An on-disk cache of numpy arrays, content-addressed by a hash of the arrays and parameters they were computed from.
+    Cached arrays are memory-mapped read-only when read.  When the cache grows past `maxBytes`, the least recently used
+    entries (by file modification time, which is refreshed on every hit) are evicted.  Several processes can share a
+    cache directory; entries are written atomically.
+        :parameter self.directory: where the cached arrays are stored
+        :parameter self.maxBytes: size cap of the cache in bytes
+    """
+
+    def __init__(self, directory: str, maxBytes: int = 2 ** 32):
+        self.directory = path.realpath(path.expanduser(directory))
+        self.maxBytes = maxBytes
+        self._size = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hash arrays (by dtype, shape and content) and other parameters (by repr) into a cache key"""
+        h = hashlib.blake2b(digest_size=20)
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                part = np.ascontiguousarray(part)
+                h.update("{0}{1}".format(part.dtype.str, part.shape).encode())
+                h.update(part.data)
+            else:
+                h.update(repr(part).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return path.join(self.directory, key[:2], key + ".npy")
+
+    def get(self, key: str):
+        """The cached array, memory-mapped read-only, or None"""
+        file = self._path(key)
+        try:
+            array = np.load(file, mmap_mode='r')
+            os.utime(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        """Store an array, evicting the least recently used entries if the cache outgrows its cap"""
+        file = self._path(key)
+        os.makedirs(path.dirname(file), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.dirname(file), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, file)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += path.getsize(file)
+        if self._size > self.maxBytes:
+            self.evict()
+
+    def fetch(self, key: str, compute):
+        """The cached array for `key`; on a miss it is computed by calling `compute()` and stored"""
+        array = self.get(key)
+        if array is None:
+            array = compute()
+            self.put(key, array)
+        return array
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache fits into maxBytes"""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, file in entries:
+            if self._size <= self.maxBytes:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            logging.info("evicted {0} from the cache".format(path.basename(file)))
+
+    def clear(self) -> None:
+        """Delete every entry"""
+        for _, _, file in self._entries():
+            os.remove(file)
+        self._size = 0
+
+    def _entries(self):
+        """(modification time, size, path) of every entry"""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".npy"):
+                    try:
+                        stat = os.stat(path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path.join(root, name)
+
+
+def cached(cache: ArrayCache, compute, *key):
+    """Call `compute`, or look its result up in `cache` by the hash of `key` if a cache is given"""
+    return compute() if cache is None else cache.fetch(cache.key(*key), compute)
+
+
+class StageCache:
+    """
+    The outputs of whole stages of the model (the periphery, the AN response and the brainstem of a stimulus level) in
+    an ArrayCache, keyed by a hash of the inputs and parameters of the stage, so that a stage whose inputs have not
+    changed is not simulated again.  An output is a dict of arrays, numbers, strings, spike trains and Nones: every
+    array is an entry of its own, memory-mapped read-only when read, and an index entry lists them.  An output any
+    entry of which was evicted is a miss.
+        :parameter self.cache: the cache the entries are stored in
+    """
+
+    # what the index says a component is stored as
+    Kinds = ('array', 'number', 'string', 'trains', 'none')
+
+    def __init__(self, cache: ArrayCache):
+        self.cache = cache
+
+    def key(self, stage: str, *parts) -> str:
+        """The key of the output of `stage` for the inputs and parameters `parts`"""
+        return self.cache.key('stage', stage, *parts)
+
+    def get(self, key: str):
+        """The cached output, or None"""
+        index = self.cache.get(key)
+        if index is None:
+            return None
+        output = {}
+        for name, kind in index:
+            name, kind = str(name), str(kind)
+            if kind == 'none':
+                output[name] = None
+                continue
+            if kind == 'trains':
+                arrays = {part: self.cache.get(self.cache.key(key, name, part)) for part in _train_parts(name)}
+                if any(array is None for array in arrays.values()):
+                    return None
+                output[name] = SpikeTrains.from_dict(arrays, name)
+                continue
+            array = self.cache.get(self.cache.key(key, name))
+            if array is None:
+                return None
+            output[name] = array if kind == 'array' else array.item()
+        return output
+
+    def put(self, key: str, output: {}) -> None:
+        """Store an output; the index is written last, so a partly written output is a miss"""
+        index = []
+        for name, value in output.items():
+            if value is None:
+                index.append((name, 'none'))
+            elif isinstance(value, SpikeTrains):
+                for part, array in value.as_dict(name).items():
+                    self.cache.put(self.cache.key(key, name, part), np.asarray(array))
+                index.append((name, 'trains'))
+            else:
+                kind = 'string' if isinstance(value, str) else 'number' if np.ndim(value) == 0 else 'array'
+                self.cache.put(self.cache.key(key, name), np.asarray(value))
+                index.append((name, kind))
+        self.cache.put(key, np.array(index, dtype=str).reshape(-1, 2))
+
+    def fetch(self, key: str, compute) -> ({}, bool):
+        """The cached output for `key`, and True; on a miss it is computed by calling `compute()` and stored, and
+        returned with False
+        """
+        output = self.get(key)
+        if output is not None:
+            logging.info("found the output of stage {0} in the cache".format(key))
+            return output, True
+        output = compute()
+        self.put(key, output)
+        return output, False
+
+
+def _train_parts(name: str) -> [str]:
+    """The names SpikeTrains.as_dict gives the arrays of spike trains stored under `name`"""
+    return list(SpikeTrains([], [0], [], []).as_dict(name))
+
+
+# the stage caches of the runs, by directory and size cap, so that every stage of a run shares one
+_stageCaches = {}
+
+
+def stage_cache(conf):
+    """The pipeline cache of a run: a StageCache in the cache directory of the configuration `conf`, or None if the run
+    has no cache directory
+    """
+    if getattr(conf, 'cache', None) is None:
+        return None
+    key = (path.realpath(path.expanduser(conf.cache)), conf.cacheBytes)
+    if key not in _stageCaches:
+        _stageCaches[key] = StageCache(ArrayCache(*key))
+    return _stageCaches[key]
@@ -0,0 +1,93 @@
+import numpy as np
+from scipy import fft
+from scipy.signal import lfilter
+
+
+class FFTConvolver:
+    """
+    Convolves the columns of (time x channel) matrices with kernels by FFT, keeping the first `length` samples of the
+    linear convolution (the part np.convolve(kernel, x)[:length] gives for each column).  Kernel spectra are cached by
+    a caller-supplied key, and the columns are transformed in blocks to bound the memory used.
+        :parameter self.length: number of samples of the inputs, kernels and outputs
+        :parameter self.nfft: FFT length; at least 2 * length - 1, so the circular convolution does not wrap
+        :parameter self.workers: number of threads used by the FFTs (-1 uses every core)
+        :parameter self.maxBlockBytes: largest spectrum of a block of columns, in bytes
+    """
+
+    def __init__(self, length: int, workers: int = 1, maxBlockBytes: int = 2 ** 27):
+        self.length = length
+        self.nfft = fft.next_fast_len(2 * length - 1, real=True)
+        self.workers = workers
+        self.maxBlockBytes = maxBlockBytes
+        self._spectra = {}
+
+    def spectrum(self, key, make) -> np.ndarray:
+        """The spectrum of the kernel returned by `make()`, cached under `key`"""
+        if key not in self._spectra:
+            self._spectra[key] = fft.rfft(make(), self.nfft, workers=self.workers)
+        return self._spectra[key]
+
+    def convolve(self, *terms) -> np.ndarray:
+        """The sum of the convolutions of every (x, kernel spectrum) term.
+        :param terms: pairs of a (time x channel) input and a kernel spectrum.  Kernels applied to the same input should
+        be summed in the frequency domain by the caller, so that every input is transformed once.
+        :return: (time x channel) matrix of the first `length` samples of the summed convolutions
+        """
+        channels = terms[0][0].shape[1]
+        out = np.empty((self.length, channels))
+        block = max(1, self.maxBlockBytes // (16 * (self.nfft // 2 + 1)))
+        for start in range(0, channels, block):
+            cols = slice(start, start + block)
+            acc = None
+            for x, spectrum in terms:
+                product = fft.rfft(x[:, cols], self.nfft, axis=0, workers=self.workers)
+                product *= spectrum[:, np.newaxis]
+                acc = product if acc is None else np.add(acc, product, out=acc)
+            out[:, cols] = fft.irfft(acc, self.nfft, axis=0, workers=self.workers)[:self.length]
+        return out
+
+    @staticmethod
+    def tail(x: np.ndarray, kernel: np.ndarray, n: int) -> np.ndarray:
+        """The last `n` samples of the full linear convolution of `kernel` with each column of `x`, i.e.
+        np.convolve(kernel, x[:, i])[-n:].  Only the last n samples of both contribute, so this is a small direct sum.
+        """
+        if n == 0:
+            return np.zeros((0, x.shape[1]))
+        k = kernel[-n:]
+        m, b = np.indices((n, n))
+        # tail[m] = sum over b >= m of k[n - 1 + m - b] * x[-n + b]
+        toeplitz = np.where(b >= m, k[np.clip(n - 1 + m - b, 0, n - 1)], 0.0)
+        return toeplitz @ x[-n:]
+
+
+class AlphaFilter:
+    """
+    The convolution with a delayed alpha kernel, gain * t / tau^2 * exp(-t / tau) at t = (n - delay) * dt, as a
+    second-order recursive filter.  Its impulse response is exact: with r = exp(-dt / tau), n * r^n has the
+    z-transform r z^-1 / (1 - r z^-1)^2.  The filter and delay line states are carried from one call to the next, so
+    long signals can be filtered block by block in linear time.
+        :parameter self.b: numerator coefficients
+        :parameter self.a: denominator coefficients
+        :parameter self.delay: delay in samples
+    """
+
+    def __init__(self, tau: float, dt: float, gain: float = 1.0, delay: int = 0, channels: int = 1):
+        r = np.exp(-dt / tau)
+        self.b = np.array([0, gain * dt * r / tau ** 2])
+        self.a = np.array([1, -2 * r, r * r])
+        self.delay = delay
+        self._zi = np.zeros((2, channels))
+        self._delayLine = np.zeros((delay, channels))
+
+    def prime(self, history: np.ndarray) -> None:
+        """Fill the delay line with the `delay` input samples that precede the first block (zeros by default)"""
+        self._delayLine = np.array(history, dtype=float).reshape(self._delayLine.shape)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Filter the next (time x channel) block"""
+        if self.delay:
+            x = np.concatenate((self._delayLine, x))
+            self._delayLine = x[len(x) - self.delay:]
+            x = x[:len(x) - self.delay]
+        y, self._zi = lfilter(self.b, self.a, x, axis=0, zi=self._zi)
+        return y
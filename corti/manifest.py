@@ -0,0 +1,118 @@
+"""A compact record of the parameters of a run, saved with its results in place of the whole PeripheryConfiguration."""
+import logging
+from os import path
+
+import attr
+import numpy as np
+import yaml
+
+from corti.base import runtime_consts, stim_consts as sc, PeripheryType
+from corti.cache import ArrayCache
+
+# the C loader of PyYAML, if it was built with libyaml
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+@attr.s
+class RunManifest:
+    """
+    The scalar parameters of a model run, named as in PeripheryConfiguration, so that the manifest can stand in for
+    the configuration when results are read back (e.g. by ResultStore.for_run or the summary plots).  The stimulus
+    waveforms are not part of it: they are saved once as a binary .npy file in the run directory and referenced by a
+    content hash, so the manifest is small, plain YAML that loads quickly.
+        :parameter self.modelType: the periphery model
+        :parameter self.stimulusHash: ArrayCache.key of the (level x time) stimulus matrix
+        :parameter self.stimulusFile: name of the stimulus file in the run directory
+        :parameter self.stimulusParameters: the scalar entries of the stimulus configuration (type, timing, ...)
+        :parameter self.modelParameters: scalar parameters of the periphery model, e.g. those of the Verhulst model
+    """
+    modelType = attr.ib()
+    Fs = attr.ib()
+    analysisFs = attr.ib()
+    NumberOfSections = attr.ib()
+    stimulusLevels = attr.ib()
+    degradation = attr.ib()
+    storeFlag = attr.ib()
+    store = attr.ib()
+    storeCompression = attr.ib()
+    storeDtypes = attr.ib()
+    memmap = attr.ib()
+    jobs = attr.ib()
+    anf_num = attr.ib()
+    runTimestamp = attr.ib()
+    stimulusHash = attr.ib()
+    stimulusFile = attr.ib(default=runtime_consts.StimulusFileName)
+    stimulusParameters = attr.ib(default=attr.Factory(dict))
+    modelParameters = attr.ib(default=attr.Factory(dict))
+
+    # the PeripheryConfiguration attributes of the Verhulst model that are kept in modelParameters
+    VerhulstParameters = ('probeString', 'random_seed', 'irrPct', 'nonlinearType')
+
+    @classmethod
+    def for_configuration(cls, conf) -> 'RunManifest':
+        """The manifest of the run with the PeripheryConfiguration `conf`"""
+        return cls(modelType=conf.modelType,
+                   Fs=float(conf.Fs),
+                   analysisFs=float(conf.analysisFs),
+                   NumberOfSections=int(conf.NumberOfSections),
+                   stimulusLevels=_plain(list(conf.stimulusLevels)),
+                   degradation=_plain(conf.degradation),
+                   storeFlag=conf.storeFlag,
+                   store=conf.store,
+                   storeCompression=int(conf.storeCompression),
+                   storeDtypes={name: np.dtype(dtype).str for name, dtype in (conf.storeDtypes or {}).items()} or None,
+                   memmap=bool(conf.memmap),
+                   jobs=int(conf.jobs),
+                   anf_num=[int(n) for n in conf.anf_num],
+                   runTimestamp=conf.run_timestamp.isoformat(),
+                   stimulusHash=ArrayCache.key(_stimulus_matrix(conf.stimulus)),
+                   stimulusParameters=_scalars(conf.stimulus_configuration, exclude=(sc.Stimulus, sc.Levels)),
+                   modelParameters=_scalars({name: getattr(conf, name) for name in cls.VerhulstParameters
+                                             if hasattr(conf, name)}))
+
+    def save(self, folder: str, stimulus: np.ndarray) -> None:
+        """Write the manifest, and the stimulus it references, to the run directory `folder`"""
+        np.save(path.join(folder, self.stimulusFile), _stimulus_matrix(stimulus))
+        fields = attr.asdict(self)
+        fields['modelType'] = self.modelType.name
+        with open(path.join(folder, runtime_consts.RunManifestName), "w") as f:
+            yaml.dump(fields, f, Dumper=_Dumper, default_flow_style=False)
+        logging.info("wrote {0} to {1}".format(runtime_consts.RunManifestName, path.abspath(folder)))
+
+    @classmethod
+    def load(cls, folder: str) -> 'RunManifest':
+        """The manifest of the run saved in `folder`"""
+        with open(path.join(folder, runtime_consts.RunManifestName)) as f:
+            fields = yaml.load(f, Loader=_Loader)
+        fields['modelType'] = PeripheryType[fields['modelType']]
+        return cls(**fields)
+
+    def stimulus(self, folder: str) -> np.ndarray:
+        """The (level x time) stimulus of the run saved in `folder`, memory-mapped; raises ValueError if the file does
+        not match the hash in the manifest
+        """
+        stimulus = np.load(path.join(folder, self.stimulusFile), mmap_mode='r')
+        if ArrayCache.key(stimulus) != self.stimulusHash:
+            raise ValueError("{0} does not match the stimulus of the run".format(self.stimulusFile))
+        return stimulus
+
+
+def _stimulus_matrix(stimulus) -> np.ndarray:
+    return np.atleast_2d(np.asarray(stimulus, dtype=float))
+
+
+def _plain(value):
+    """A number, string or bool, or a list of them, as plain Python values; None if it is anything else"""
+    if isinstance(value, (list, tuple)):
+        values = [_plain(x) for x in value]
+        return None if any(x is None or isinstance(x, list) for x in values) else values
+    if isinstance(value, np.generic):
+        value = value.item()
+    return value if isinstance(value, (bool, int, float, str)) else None
+
+
+def _scalars(values: {}, exclude=()) -> {}:
+    """The entries of `values` that are scalars, or lists of scalars, as plain Python values"""
+    return {str(name): _plain(value) for name, value in values.items()
+            if name not in exclude and _plain(value) is not None}
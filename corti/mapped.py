@@ -0,0 +1,47 @@
+"""Model outputs kept in memory-mapped .npy files in the run directory instead of in memory."""
+import os
+
+import numpy as np
+from os import path
+
+from corti.base import runtime_consts
+
+
+def mapped_file(folder: str, name: str, level) -> str:
+    return path.join(folder, "{0}{1}-{2}dB.npy".format(runtime_consts.MappedOutputFilePrefix, name, level))
+
+
+def empty(folder: str, name: str, level, shape: (int, int)) -> np.ndarray:
+    """A zeroed float64 output array to fill: a writable memmap of a .npy file in `folder`, or an array in memory if
+    `folder` is None
+    """
+    if folder is None:
+        return np.zeros(shape)
+    return np.lib.format.open_memmap(mapped_file(folder, name, level), mode='w+', dtype=np.float64, shape=shape)
+
+
+def seal(array: np.ndarray) -> np.ndarray:
+    """Flush an output array from `empty` to its file and map it again read-only; arrays in memory are returned as they
+    are
+    """
+    if not isinstance(array, np.memmap):
+        return array
+    array.flush()
+    return np.load(array.filename, mmap_mode='r')
+
+
+def keep(folder: str, name: str, level, array: np.ndarray) -> np.ndarray:
+    """Write an output computed in memory to a .npy file in `folder` and return it mapped read-only, so the memory
+    can be released; if `folder` is None the array is returned as it is
+    """
+    if folder is None:
+        return array
+    file = mapped_file(folder, name, level)
+    np.save(file, array)
+    return np.load(file, mmap_mode='r')
+
+
+def discard(array: np.ndarray) -> None:
+    """Delete the file of a memory-mapped output that is no longer needed; arrays in memory are left alone"""
+    if isinstance(array, np.memmap) and array.filename is not None and path.exists(array.filename):
+        os.remove(array.filename)
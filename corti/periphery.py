@@ -3,11 +3,15 @@ from datetime import datetime
 
 import numpy as np
 import os
-import yaml
 from os import path
+from scipy.signal import resample_poly
 
+from corti import mapped, writer
 from corti.base import runtime_consts, periph_consts as p, PeripheryType
-from corti.periphery_configuration import PeripheryConfiguration, PeripheryOutput
+from corti.cache import stage_cache
+from corti.manifest import RunManifest
+from corti.periphery_configuration import PeripheryConfiguration, PeripheryOutput, SpikeTrains
+from corti.result_store import ResultStore
 from corti.zilany2014 import run_zilany2014
 
 
@@ -49,9 +53,10 @@ class Periphery:
         :return: A list of output data, one for each stimulus level
         """
         results = []
+        cache = stage_cache(self.conf)
         if self.conf.modelType == PeripheryType.VERHULST:
             for i, v in enumerate(self.cochlear_list):
-                results.append(self.solve_one_cochlea(v))
+                results.append(self.solve_level(i, lambda: self.solve_one_cochlea(v)))
                 self.save_model_results(i, results[i].output)
         elif self.conf.modelType == PeripheryType.ZILANY:
             for i, v in enumerate(self.conf.stimulus):
@@ -59,15 +64,21 @@ class Periphery:
                     output = self.output_folder
                 except AttributeError:
                     output = None
-                results.append(run_zilany2014(sound=v,
-                                              fs=self.conf.Fs,
-                                              anf_num=(1, 1, 1),
-                                              species="human",
-                                              seed=0,
-                                              conf=self.conf,
-                                              output=output,
-                                              level=self.conf.stimulusLevels[i],
-                                              cf=(125, 20e3, self.conf.NumberOfSections)))
+
+                def solve():
+                    return run_zilany2014(sound=v,
+                                          fs=self.conf.Fs,
+                                          anf_num=self.conf.anf_num,
+                                          spikes=any(self.conf.anf_num),
+                                          species="human",
+                                          seed=0,
+                                          conf=self.conf,
+                                          output=output,
+                                          level=self.conf.stimulusLevels[i],
+                                          cf=(125, 20e3, self.conf.NumberOfSections),
+                                          n_jobs=self.conf.jobs,
+                                          cache=cache.cache if cache is not None else None)
+                results.append(self.solve_level(i, solve))
                 self.save_model_results(i, results[i].output)
 
         else:
@@ -76,6 +87,32 @@ class Periphery:
         self.save_model_configuration()
         return results
 
+    def solve_level(self, ii: int, solve) -> PeripheryOutput:
+        """The decimated periphery output of stimulus level ii, simulated by calling `solve()`, or taken from the
+        pipeline cache if the same stimulus was simulated with the same parameters before
+        """
+        def simulate():
+            result = solve()
+            self.decimate(result)
+            return result
+
+        cache = stage_cache(self.conf)
+        if cache is None:
+            return simulate()
+        key = cache.key('periphery', np.asarray(self.conf.stimulus[ii], dtype=float), *self._parameters(ii))
+        output, _ = cache.fetch(key, lambda: simulate().output)
+        return PeripheryOutput(output=output, conf=self.conf, outputFolder=getattr(self, 'output_folder', None),
+                               cacheKey=key)
+
+    def _parameters(self, ii: int) -> tuple:
+        """The parameters the periphery output of stimulus level ii depends on, besides the stimulus"""
+        parameters = (self.conf.modelType.name, self.conf.stimulusLevels[ii], float(self.Fs),
+                      float(self.conf.analysisFs), self.conf.NumberOfSections)
+        if self.conf.modelType == PeripheryType.VERHULST:
+            return parameters + (self.probes, self.irr_on[ii], self.random_seed, self.irrPct, self.nonlinearType)
+        # the species, seed and CF range of run()
+        return parameters + (tuple(self.conf.anf_num), "human", 0, 125, 20e3)
+
     def solve_one_cochlea(self, model: []) -> PeripheryOutput:
         """Compute unweighted periphery and AN output for one stimulus level
         :return: a periphery output container
@@ -107,18 +144,20 @@ class Periphery:
         logging.info("Calculating IFRs (low)")
         anfL = anf_model(rp, coch.cf, fs, 'low')
         # save intermediate results out to the output container (and possibly to disk)
+        level = self.conf.stimulusLevels[ii]
+        keep = lambda name, array: mapped.keep(self._mapped_folder(), name, level, array)
         out = PeripheryOutput()
         out.output = {
-            p.BMVelocity                   : coch.Vsolution,
-            p.BMDisplacement               : coch.Ysolution,
+            p.BMVelocity                   : keep(p.BMVelocity, coch.Vsolution),
+            p.BMDisplacement               : keep(p.BMDisplacement, coch.Ysolution),
             p.OtoacousticEmission          : coch.oto_emission,
             p.CenterFrequency              : coch.cf,
-            p.InnerHairCell                : rp,
-            p.AuditoryNerveFiberLowSpont   : anfL,
-            p.AuditoryNerveFiberMediumSpont: anfM,
-            p.AuditoryNerveFiberHighSpont  : anfH,
+            p.InnerHairCell                : keep(p.InnerHairCell, rp),
+            p.AuditoryNerveFiberLowSpont   : keep(p.AuditoryNerveFiberLowSpont, anfL),
+            p.AuditoryNerveFiberMediumSpont: keep(p.AuditoryNerveFiberMediumSpont, anfM),
+            p.AuditoryNerveFiberHighSpont  : keep(p.AuditoryNerveFiberHighSpont, anfH),
             p.Stimulus                     : stimulus,
-            p.StimulusLevel                : self.conf.stimulusLevels[ii]
+            p.StimulusLevel                : level
         }
         out.conf = self.conf
         out.stimulusLevel = self.conf.stimulusLevels[ii]
@@ -127,11 +166,30 @@ class Periphery:
 
         return out
 
+    def decimate(self, result: PeripheryOutput) -> None:
+        """Anti-alias filter and downsample the AN responses of a periphery output to the analysis sample rate"""
+        factor = int(round(self.Fs / self.conf.analysisFs))
+        if factor == 1:
+            return
+        for key in (p.AuditoryNerveFiberHighSpont, p.AuditoryNerveFiberMediumSpont, p.AuditoryNerveFiberLowSpont):
+            full = result.output[key]
+            result.output[key] = mapped.keep(self._mapped_folder(), key + "-decimated", result.output[p.StimulusLevel],
+                                             resample_poly(full, 1, factor, axis=0))
+            # the full-rate file is not needed any more
+            mapped.discard(full)
+
+    def _mapped_folder(self) -> str:
+        """Where the outputs are memory-mapped, or None to keep them in memory"""
+        return self.output_folder if self.conf.memmap and not self.conf.pypet else None
+
     def save_model_results(self, ii: int, periph: {}) -> None:
-        """ store the parts of the periphery output specified in storeflag.
+        """ store the parts of the periphery output specified in storeflag, on the writer thread if there is one.
         """
         if self.conf.pypet or not self.storeFlag:
             return
+        writer.submit(self._write_model_results, ii, dict(periph))
+
+    def _write_model_results(self, ii: int, periph: {}) -> None:
         tm = lambda x: (x, periph[x] if x in periph else None)
         # saveMap makes a dict of tuples. the key is the storeFlag character,
         # [0] is the key that will be used in the npz file,
@@ -145,6 +203,7 @@ class Periphery:
             'h': tm(p.AuditoryNerveFiberHighSpont),
             'm': tm(p.AuditoryNerveFiberMediumSpont),
             'l': tm(p.AuditoryNerveFiberLowSpont),
+            'p': tm(p.AuditoryNerveSpikes),
             'i': tm(p.InnerHairCell),
             's': tm(p.Stimulus),
             'd': tm(p.StimulusLevel)
@@ -154,15 +213,21 @@ class Periphery:
         tosave = {key: value for key, value in saveMap.items() if key in self.storeFlag and value[1] is not None}
         if not tosave:
             return
+        if self.conf.store == 'hdf5':
+            ResultStore.for_run(self.conf, self.output_folder).write('periphery', self.conf.stimulusLevels[ii],
+                                                                     dict(tosave.values()))
+            return
         outfile = runtime_consts.PeripheryOutputFilePrefix + str(self.conf.stimulusLevels[ii]) + "dB"
-        np.savez(path.join(self.output_folder, outfile), **{name: data for name, data in tosave.values()})
+        arrays = {}
+        for name, data in tosave.values():
+            # spike trains are stored as their CSR arrays
+            arrays.update(data.as_dict(name) if isinstance(data, SpikeTrains) else {name: data})
+        np.savez(path.join(self.output_folder, outfile), **arrays)
         logging.info("wrote {0} to {1}".format(outfile, path.abspath(self.output_folder)))
 
     def save_model_configuration(self) -> None:
         if self.conf.pypet:
             return
-        # and store the configuration parameters so we know what we did.
-        with open(path.join(self.output_folder, runtime_consts.PeripheryConfigurationName), "w") as _:
-            yaml.dump(self.conf, _)
-            logging.info("wrote {} to {}".format(runtime_consts.PeripheryConfigurationName,
-                                                 path.abspath(self.output_folder)))
+        # and store the configuration parameters so we know what we did: the scalars in a manifest, and the stimulus
+        # it references by its hash in a binary file next to it
+        RunManifest.for_configuration(self.conf).save(self.output_folder, self.conf.stimulus)
@@ -21,6 +21,20 @@ class PeripheryConfiguration:
         :parameter self.NumberOfSections: number of basilar membrane sections to simulate (1000)
         :parameter self.PolesDirectoryName: relative path to PolesFileName
         :parameter self.PolesFileName: name of file containing starting Shera poles
+        :parameter self.jobs: number of worker processes used to simulate the CF channels (Zilany model only)
+        :parameter self.anf_num: number of (HSR, MSR, LSR) fibers per CF whose spike trains are simulated; all zeros
+                                 (default) simulates the firing rates only (Zilany model only)
+        :parameter self.cache: directory of the pipeline cache (see StageCache), which also holds the IHC and synapse
+                               outputs of the Zilany model, or None
+        :parameter self.cacheBytes: size cap of the cache directory, in bytes
+        :parameter self.analysisFs: sample rate of the AN responses and everything computed from them; the AN outputs
+                                    of the periphery are decimated to it.  Must divide Fs (default Fs)
+        :parameter self.store: how results are saved: 'npz' (one file per level and stage) or 'hdf5' (one compressed
+                               file per run, see ResultStore)
+        :parameter self.storeCompression: compression level (0-9) of the HDF5 store
+        :parameter self.storeDtypes: {component name: dtype} of components stored in the HDF5 store with another dtype
+        :parameter self.memmap: write the (time x CF) outputs of the periphery and the AN responses to .npy files in the
+                                run directory as they are computed, and pass them on as read-only memory maps
     """
 
     # Magic Constants.
@@ -29,7 +43,9 @@ class PeripheryConfiguration:
     NumberOfSections = 1000  # possibly also "number of frequency bands", if there's a 1:1 between section and cf.
 
     def __init__(self, dataFolder: str, storeFlag: str, stimuli: dict, modelType: PeripheryType,
-                 degradation: Union[tuple, list], pypet: str):
+                 degradation: Union[tuple, list], pypet: str, jobs: int = 1,
+                 anf_num: tuple = (0, 0, 0), cache: str = None, analysisFs: float = None, store: str = 'npz',
+                 storeCompression: int = 5, storeDtypes: dict = None, memmap: bool = False, cacheBytes: int = 2 ** 32):
         # model parameters from RUN_BMAN
         # these are used in making the stimulus waveform
         self.modelType = modelType
@@ -53,6 +69,19 @@ class PeripheryConfiguration:
         self.degradation = degradation
         self.run_timestamp = datetime.now()
         self.pypet = pypet
+        self.jobs = jobs
+        self.anf_num = tuple(anf_num)
+        self.cache = cache
+        self.cacheBytes = cacheBytes
+        self.analysisFs = self.Fs if analysisFs is None else analysisFs
+        if self.Fs % self.analysisFs:
+            raise ValueError("the analysis sample rate {0} does not divide {1}".format(self.analysisFs, self.Fs))
+        if store not in ('npz', 'hdf5'):
+            raise ValueError("store must be 'npz' or 'hdf5'")
+        self.store = store
+        self.storeCompression = storeCompression
+        self.storeDtypes = storeDtypes
+        self.memmap = memmap
 
 
 @attr.s
@@ -62,8 +91,57 @@ class PeripheryOutput:
             :parameter self.output: a dict containing the output from the periphery.
             :parameter self.conf: the configuration that generated these outputs
             :type self.conf: PeripheryConfiguration
+            :parameter self.cacheKey: the pipeline cache key of the output, or None if it is not cached
         :return:
     """
     output = attr.ib(default=None)
     conf = attr.ib(default=None)
     outputFolder = attr.ib(default=None)
+    cacheKey = attr.ib(default=None)
+
+
+@attr.s
+class SpikeTrains:
+    """
+        SpikeTrains: the spike trains of a population of auditory nerve fibers in a compressed sparse row layout.
+            :parameter self.times: spike times (s) of all fibers, concatenated fiber by fiber (float32)
+            :parameter self.offsets: the spikes of fiber i are times[offsets[i]:offsets[i + 1]]
+            :parameter self.fiberType: the type of each fiber, as an index into self.fiberTypes
+            :parameter self.cf: the center frequency of each fiber
+            :parameter self.fiberTypes: names of the fiber types
+    """
+    times = attr.ib()
+    offsets = attr.ib()
+    fiberType = attr.ib()
+    cf = attr.ib()
+    fiberTypes = attr.ib(default=('hsr', 'msr', 'lsr'))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def train(self, i: int) -> np.ndarray:
+        """The spike times of fiber i"""
+        return self.times[self.offsets[i]:self.offsets[i + 1]]
+
+    def counts(self) -> np.ndarray:
+        """The number of spikes of each fiber"""
+        return np.diff(self.offsets)
+
+    def as_dict(self, prefix: str) -> dict:
+        """The arrays of the spike trains, named for storing them with np.savez"""
+        return {
+            prefix + "_times"      : self.times,
+            prefix + "_offsets"    : self.offsets,
+            prefix + "_fiber_type" : self.fiberType,
+            prefix + "_cf"         : self.cf,
+            prefix + "_fiber_types": np.array(self.fiberTypes),
+        }
+
+    @classmethod
+    def from_dict(cls, data, prefix: str):
+        """Inverse of as_dict, e.g. for the contents of a loaded npz file"""
+        return cls(times=data[prefix + "_times"],
+                   offsets=data[prefix + "_offsets"],
+                   fiberType=data[prefix + "_fiber_type"],
+                   cf=data[prefix + "_cf"],
+                   fiberTypes=tuple(str(x) for x in data[prefix + "_fiber_types"]))
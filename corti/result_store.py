@@ -0,0 +1,123 @@
+"""An HDF5 store of the results of a model run, one file per run."""
+import logging
+import threading
+from os import path
+
+import numpy as np
+import tables
+
+from corti.base import runtime_consts
+
+# HDF5 files are not written from several threads at once
+_lock = threading.Lock()
+
+
+class ResultStore:
+    """
+    The results of every stimulus level of a run in one HDF5 file (written with PyTables), in place of one npz file per
+    level and stage.  Every component is a compressed array with a leading level dimension, chunked along time and CF,
+    so a reader can slice a level, a CF or a time window without loading the whole matrix.  Components that differ in
+    size between levels (spike trains) are stored per level instead, in a group named after the component.
+        :parameter self.file: path of the HDF5 file
+        :parameter self.levels: the stimulus levels of the run, in the order of the level dimension
+        :parameter self.filters: the compression of every array
+        :parameter self.dtypes: {component name: dtype} of the components stored with another dtype than they have
+    """
+
+    # chunks of waveforms are at most this long, and chunks of (time x CF) matrices this large along either axis
+    ChunkSamples = 2 ** 16
+    ChunkSide = 256
+
+    def __init__(self, file: str, levels: [], complevel: int = 5, complib: str = 'zlib', dtypes: {} = None):
+        self.file = file
+        self.levels = list(levels)
+        self.filters = tables.Filters(complevel=complevel, complib=complib, shuffle=complevel > 0)
+        self.dtypes = dtypes or {}
+
+    @classmethod
+    def for_run(cls, conf, outputFolder: str) -> 'ResultStore':
+        """The store of the run with the configuration `conf`, in its output folder"""
+        return cls(path.join(outputFolder, runtime_consts.ResultStoreFileName), conf.stimulusLevels,
+                   conf.storeCompression, dtypes=conf.storeDtypes)
+
+    def write(self, stage: str, level, components: {}) -> None:
+        """Store the components of one stimulus level.
+        :param stage: group of the components, e.g. 'periphery'
+        :param components: {name: array, or object with an as_dict(name) method, or string}
+        """
+        index = self.levels.index(level)
+        with _lock, tables.open_file(self.file, mode='a') as h5:
+            group = self._group(h5, '/', stage)
+            for name, value in components.items():
+                if value is None:
+                    continue
+                if hasattr(value, 'as_dict'):
+                    levelGroup = self._group(h5, self._group(h5, group, name), "level{0}".format(index))
+                    for key, array in value.as_dict(name).items():
+                        self._replace(h5, levelGroup, key, np.asarray(array))
+                elif isinstance(value, str):
+                    group._v_attrs[name] = value
+                else:
+                    self._level_array(h5, group, name, np.asarray(value))[index] = value
+        logging.info("wrote {0} of {1}dB to {2}".format(stage, level, path.abspath(self.file)))
+
+    def read(self, stage: str, name: str, level=None, *index) -> np.ndarray:
+        """Read a component, or a slice of it: read('brainstem', 'ic_pop_resp', 60, slice(0, 10)) reads the first 10
+        CFs of the IC response at 60 dB.  Only the chunks the slice touches are read.
+        """
+        with tables.open_file(self.file, mode='r') as h5:
+            node = h5.get_node('/' + stage, name)
+            if isinstance(node, tables.Group):
+                levelGroup = node._f_get_child("level{0}".format(self.levels.index(level)))
+                return {array.name: array.read() for array in levelGroup._f_iter_nodes()}
+            if level is None:
+                return node.read()
+            return node[(self.levels.index(level),) + index]
+
+    def attribute(self, stage: str, name: str) -> str:
+        with tables.open_file(self.file, mode='r') as h5:
+            return h5.get_node('/' + stage)._v_attrs[name]
+
+    def has_stage(self, stage: str) -> bool:
+        """Whether any component of `stage` was stored, e.g. False for 'brainstem' in a run without the brainstem"""
+        with tables.open_file(self.file, mode='r') as h5:
+            return '/' + stage in h5
+
+    def stage(self, stage: str, level) -> {}:
+        """Every component of one level of a stage, as the dict the npz file of the level would give"""
+        with tables.open_file(self.file, mode='r') as h5:
+            group = h5.get_node('/' + stage)
+            index = self.levels.index(level)
+            components = {name: group._v_attrs[name] for name in group._v_attrs._f_list('user')}
+            for node in group._f_iter_nodes():
+                if isinstance(node, tables.Group):
+                    levelGroup = "level{0}".format(index)
+                    if levelGroup in node:
+                        components.update({array.name: array.read() for array in node._f_get_child(levelGroup)})
+                else:
+                    components[node.name] = node[index]
+        return components
+
+    def _group(self, h5: tables.File, parent, name: str) -> tables.Group:
+        parentPath = parent if isinstance(parent, str) else parent._v_pathname
+        if name in h5.get_node(parentPath):
+            return h5.get_node(parentPath, name)
+        return h5.create_group(parentPath, name)
+
+    def _replace(self, h5: tables.File, group: tables.Group, name: str, array: np.ndarray) -> None:
+        if name in group:
+            h5.remove_node(group, name)
+        if array.size:
+            h5.create_carray(group, name, obj=array, filters=self.filters)
+        else:
+            h5.create_array(group, name, obj=array)
+
+    def _level_array(self, h5: tables.File, group: tables.Group, name: str, array: np.ndarray) -> tables.CArray:
+        """The (level x ...) array of a component, created on its first write"""
+        if name in group:
+            return group._f_get_child(name)
+        shape = (len(self.levels),) + array.shape
+        side = self.ChunkSamples if array.ndim == 1 else self.ChunkSide
+        chunks = (1,) + tuple(min(max(n, 1), side) for n in array.shape)
+        atom = tables.Atom.from_dtype(np.dtype(self.dtypes.get(name, array.dtype)))
+        return h5.create_carray(group, name, atom=atom, shape=shape, chunkshape=chunks, filters=self.filters)
@@ -0,0 +1,66 @@
+"""Sweeps of the neuropathy and fiber weighting of the auditory nerve, by linear superposition."""
+import numpy as np
+
+from corti.auditory_nerve_response import AuditoryNerveResponse
+from corti.base import brain_consts as b, periph_consts as p
+from corti.brainstem import CentralAuditoryResponse
+from corti.periphery_configuration import PeripheryOutput
+
+
+class SuperpositionSweep:
+    """
+    The ABR waves of one periphery output for many combinations of neuropathy (degradation profile), fiber weighting
+    and brainstem model.
+    The AN population response is a weighted sum of the low, medium and high SR fiber responses of each CF, and the
+    brainstem and midbrain models are linear, so each wave is the same weighted sum of the responses to every single
+    (fiber type, CF) input.  These are simulated once, for the CFs the waves sum; any combination is then an einsum.
+        :parameter self.modelTypes: the brainstem models simulated
+        :parameter self.basis: {model type: {wave: (fiber type x CF x time) responses}}, fiber types in (low, medium,
+                               high) order
+    """
+
+    def __init__(self, periphery: PeripheryOutput, modelTypes=('NELSON_CARNEY_2004', 'CARNEY_2015'), workers: int = 1,
+                 backend: str = 'fft'):
+        self.an = AuditoryNerveResponse(periphery, None)
+        fibers = (periphery.output[p.AuditoryNerveFiberLowSpont], periphery.output[p.AuditoryNerveFiberMediumSpont],
+                  periphery.output[p.AuditoryNerveFiberHighSpont])
+        cutoffCf = [index for index, value in enumerate(self.an.cf) if
+                    value >= CentralAuditoryResponse.LowFrequencyCutoff][-1]
+        self.waveCfs = slice(0, cutoffCf + 1)
+        # every (fiber type, CF) is one column of a single brainstem simulation
+        anr = self.an.scale() * np.hstack([fiber[:, self.waveCfs] for fiber in fibers])
+        summary = PeripheryOutput(output={p.CenterFrequency: np.tile(self.an.cf[self.waveCfs], len(fibers))},
+                                  conf=periphery.conf, outputFolder=periphery.outputFolder)
+        self.modelTypes = modelTypes
+        self.basis = {}
+        for modelType in modelTypes:
+            output = CentralAuditoryResponse(summary, anr, modelType, workers, backend)._simulate()
+            self.basis[modelType] = {
+                wave: output[population].reshape(len(fibers), -1, anr.shape[0])
+                for wave, population in ((b.Wave1_AN, b.ANPopulation), (b.Wave3_CN, b.CNPopulation),
+                                         (b.Wave5_IC, b.ICPopulation))
+            }
+
+    def weightings(self) -> {}:
+        """The (low, medium, high) SR fiber counts per IHC of the weighting schemes of AuditoryNerveResponse"""
+        return {
+            'cf_weighted': self.an._map_cf_dependent_distribution(AuditoryNerveResponse.TotalFiberPerIHC),
+            'unweighted' : (3, 3, 13)
+        }
+
+    def waves(self, degradations: [], weightings: []) -> {}:
+        """
+        The waves of every combination of degradation profile and fiber weighting.
+        :param degradations: degradation profiles, in any form AuditoryNerveResponse.batched_an_response takes
+        :param weightings: (low, medium, high) fiber counts, scalars or one per CF
+        :return: {model type: {wave: (weighting x degradation x time) waveforms}}
+        """
+        cfCount = len(self.an.cf)
+        d = np.array([self.an._profile(x)[:, self.waveCfs] for x in degradations])
+        w = np.array([[np.broadcast_to(count, cfCount)[self.waveCfs] for count in weighting]
+                      for weighting in weightings], dtype=float)
+        return {
+            modelType: {wave: np.einsum('wfc,dfc,fcn->wdn', w, d, basis, optimize=True) for wave, basis in
+                        self.basis[modelType].items()}
+            for modelType in self.modelTypes
+        }
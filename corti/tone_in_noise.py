@@ -6,13 +6,15 @@ of models.
 Usage:
     tone_in_noise.py -h | --help
     tone_in_noise.py --version
-    tone_in_noise.py [--out <outpath>]
+    tone_in_noise.py [--out <outpath>] [--cache <cachepath>]
 
 Options:
     -h --help           Show this screen and exit.
     --version           Display the version and exit.
     --out=<outpath>     Specify where pypet's output HDF5 database file should be saved.
                         [default: ~/pypet-output/tone-in-noise.hdf5]
+    --cache=<cachepath> Where the IHC and synapse outputs shared by the runs are cached.
+                        [default: ~/pypet-output/cache]
 """
 import glob
 import sys
@@ -34,11 +36,13 @@ cf_weighting = '--no-cf-weighting'
 wavfile = "--wavFile"
 level = "--level"
 neuropathy = "--neuropathy"
+cache = "--cache"
 
 
 def tone_in_noise(traj: Environment.trajectory):
     commandstr = " ".join([periphery_type, traj.periphery, brainstem_type, traj.brainstem, neuropathy, traj.neuropathy,
-                           traj.weighting, wavfile, traj.wavfile, level, str(traj.level), "--pypet"])
+                           traj.weighting, wavfile, traj.wavfile, level, str(traj.level), cache, traj.cache,
+                           "--pypet"])
     print("Command String: " + commandstr)
     periphery, anr, brain = corti.main(commandstr)
     periphery = periphery[0]
@@ -106,6 +110,7 @@ def main(inputargs=None):
     traj.f_add_parameter('wavfile', '', comment="Which wav file to run")
     traj.f_add_parameter('level', 80, comment="stimulus level, spl")
     traj.f_add_parameter('neuropathy', "none", comment="")
+    traj.f_add_parameter('cache', path.realpath(path.expanduser(args["--cache"])), comment="IHC and synapse cache")
 
     parameter_dict = {
         "periphery" : ['verhulst', 'zilany'],
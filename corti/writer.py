@@ -0,0 +1,96 @@
+"""Saving results on background threads, so that the next level is simulated while the last one is written."""
+import logging
+import multiprocessing
+import queue
+import threading
+
+
+class BackgroundWriter:
+    """
+    Runs write calls on writer threads.  At most `maxPending` calls wait in the queue; submitting more blocks until a
+    thread takes one, so results cannot pile up in memory faster than the disk takes them.  The data handed to a write
+    call must not be changed after it is submitted.
+        :parameter self.threads: the writer threads
+    """
+
+    def __init__(self, threads: int = 1, maxPending: int = 2):
+        self._queue = queue.Queue(maxsize=maxPending)
+        self._errors = []
+        self.threads = [threading.Thread(target=self._work, name="corti-writer-{0}".format(i), daemon=True)
+                        for i in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, write, *args, **kwargs) -> None:
+        """Queue the call write(*args, **kwargs), waiting while the queue is full"""
+        self._raise()
+        self._queue.put((write, args, kwargs))
+
+    def flush(self) -> None:
+        """Wait until every submitted write has finished, and raise the first error of a failed one"""
+        self._queue.join()
+        self._raise()
+
+    def close(self) -> None:
+        """Flush, then stop the writer threads"""
+        try:
+            self.flush()
+        finally:
+            for _ in self.threads:
+                self._queue.put(None)
+            for thread in self.threads:
+                thread.join()
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                write, args, kwargs = job
+                write(*args, **kwargs)
+            except Exception as e:
+                logging.exception("saving results failed")
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def _raise(self) -> None:
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise errors[0]
+
+
+# the writer of this process, or None to write synchronously
+_writer = None
+
+
+def start(threads: int = 1, maxPending: int = 2) -> None:
+    """Save results on `threads` background threads from now on (synchronously if threads is 0)"""
+    global _writer
+    finish()
+    _writer = BackgroundWriter(threads, maxPending) if threads > 0 else None
+
+
+def submit(write, *args, **kwargs) -> None:
+    """Call write(*args, **kwargs) on a writer thread, or right away if no writer was started"""
+    if _writer is None:
+        write(*args, **kwargs)
+    else:
+        _writer.submit(write, *args, **kwargs)
+
+
+def finish() -> None:
+    """Wait for every pending write and stop the writer threads"""
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+def process_context() -> multiprocessing.context.BaseContext:
+    """The multiprocessing context of worker pools.  Its processes are not forked from this process, whose writer
+    threads may be in the middle of writing a file (and holding its locks) when a pool starts.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
@@ -18,19 +18,30 @@
 
 from __future__ import division, print_function, absolute_import
 
-import progressbar
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 __author__ = "Marek Rudnicki"
 
 import numpy as np
 
 from . import _zilany2014
-from .util import calc_cfs
+from .util import calc_cfs, ffgn
 from .zilany2014_rate import run_zilany2014_rate
-from corti.base import periph_consts as p
-from corti.periphery import PeripheryOutput, PeripheryConfiguration
+from corti import mapped, writer
+from corti.base import n_workers, periph_consts as p
+from corti.cache import ArrayCache, cached
+from corti.periphery_configuration import PeripheryOutput, PeripheryConfiguration, SpikeTrains
 from tqdm import tqdm
 
+ANF_TYPES = ('hsr', 'msr', 'lsr')
+# the periphery output names of the fiber types, which also name their memory-mapped files
+ANF_OUTPUTS = {
+    'hsr': p.AuditoryNerveFiberHighSpont,
+    'msr': p.AuditoryNerveFiberMediumSpont,
+    'lsr': p.AuditoryNerveFiberLowSpont,
+}
+
 
 def run_zilany2014(
         sound,
@@ -45,7 +56,13 @@ def run_zilany2014(
         cohc=1,
         cihc=1,
         powerlaw='approximate',
-        ffGn=False
+        ffGn=False,
+        powerlaw_tol=1e-6,
+        spikes=False,
+        n_jobs=1,
+        executor='process',
+        chunk_size=None,
+        cache=None
 ):
     """Run the inner ear model by [Zilany2014]_.
 
@@ -65,7 +82,7 @@ def run_zilany2014(
         The desired number of auditory nerve fibers per frequency
         channel (CF), (HSR#, MSR#, LSR#).  For example, (100, 75, 25)
         means that we want 100 HSR fibers, 75 MSR fibers and 25 LSR
-        fibers per CF.
+        fibers per CF.  Only used when `spikes` is True.
     cf : float or array_like or tuple
         The center frequency(s) of the simulated auditory nerve fibers.
         If float, then defines a single frequency channel.  If
@@ -76,23 +93,55 @@ def run_zilany2014(
     species : {'cat', 'human', 'human_glasberg1990'}
         Species.
     seed : int
-        Random seed for the spike generator.
+        Random seed of the fractional Gaussian noise and the spike
+        generator.  Every (CF, fiber type) draws from its own stream
+        derived from the seed, so the results do not depend on
+        `n_jobs`, `executor` or `chunk_size`.
     conf: PeripheryConfiguration
         Runtime data.
     cohc : float <0-1>, optional
         Degredation of the outer hair cells.
     cihc : float <0-1>, optional
         Degredation of the inner hair cells.
-    powerlaw : {'approximate', 'actual'}, optional
+    powerlaw : {'approximate', 'actual', 'fast'}, optional
         Defines which power law implementation should be used.
+        'fast' computes the actual power law in linear time by
+        expanding its kernel into a sum of exponentials.
     ffGn : bool
         Enable/disable factorial Gaussian noise.
+    powerlaw_tol : float, optional
+        Relative error bound of the 'fast' power law kernels.
+    spikes : bool, optional
+        Simulate the spike trains of the `anf_num` fibers of every CF.
+        If False (default), only the synapse outputs (rates) are
+        computed and the spike generator is not run.
+    n_jobs : int, optional
+        Number of workers used to simulate the CF channels.  1
+        (default) runs every channel in the calling thread, None or a
+        negative number uses all available cores.
+    executor : {'process', 'thread'} or concurrent.futures.Executor, optional
+        Run the CF batches in a pool of `n_jobs` processes or threads.
+        The C model releases the GIL, so threads avoid pickling the
+        stimulus into worker processes.  An already running executor
+        can be given as well; `n_jobs` is then ignored and the
+        executor is not shut down.
+    chunk_size : int, optional
+        Number of CF channels sent to a worker at once.  By default
+        the CFs are split into about four batches per worker.
+    cache : ArrayCache or str, optional
+        Cache (or directory of a cache) of the IHC receptor potentials
+        and synapse outputs.  Channels whose stimulus and parameters
+        were simulated before are read from the cache instead of
+        being run again.
 
 
     Returns
     -------
-    spike_trains
-        Auditory nerve spike trains.
+    PeripheryOutput
+        The HSR, MSR and LSR synapse outputs as (time x CF) matrices
+        and, if `spikes` is True, the spike trains of all fibers as
+        SpikeTrains.  The fibers are ordered by CF, then by type
+        (HSR, MSR, LSR).
 
 
     References
@@ -110,69 +159,165 @@ def run_zilany2014(
     assert np.max(sound) < 1000, "Signal should be given in Pa"
     assert sound.ndim == 1
     assert species in ('cat', 'human', 'human_glasberg1990')
+    if spikes:
+        assert len(anf_num) == len(ANF_TYPES) and min(anf_num) >= 0, "anf_num must be (HSR#, MSR#, LSR#)"
+
+    cfs = np.asarray(calc_cfs(cf, species), dtype=float)
+    if isinstance(cache, str):
+        cache = ArrayCache(cache)
+
+    channel_args = {
+        # the middle ear does not depend on CF, so it is filtered once for all channels
+        'middle_ear': _zilany2014.run_middle_ear(sound, fs, species),
+        'cache'   : cache,
+        'sound_key': ArrayCache.key(np.asarray(sound, dtype=float)) if cache is not None else None,
+        'fs'      : fs,
+        'cohc'    : cohc,
+        'cihc'    : cihc,
+        'anf_num' : anf_num,
+        'powerlaw': powerlaw,
+        'powerlaw_tol': powerlaw_tol,
+        # pin the entropy of seed=None, so that every channel derives its streams from the same root
+        'seed'    : np.random.SeedSequence(seed).entropy,
+        'species' : species,
+        'ffGn'    : ffGn,
+        'spikes'  : spikes,
+        # one noise length for all CFs keeps the noise of a channel independent of its batch
+        'noise_length': max(_zilany2014.synapse_noise_length(len(sound), fs, cf) for cf in cfs) if ffGn else 0,
+    }
 
-    np.random.seed(seed)
-
-    cfs = calc_cfs(cf, species)
-
-    channel_args = [
-        {
-            'signal'  : sound,
-            'cf'      : cf,
-            'fs'      : fs,
-            'cohc'    : cohc,
-            'cihc'    : cihc,
-            'anf_num' : anf_num,
-            'powerlaw': powerlaw,
-            'seed'    : seed,
-            'conf'    : conf,
-            'level'   : level,
-            'species' : species,
-            'ffGn'    : ffGn,
-        }
-        for cf in cfs
-        ]
+    ### Preallocate the outputs, in memory-mapped files if asked to; every channel writes its own column
+    folder = output if conf is not None and conf.memmap else None
+    anfout = {anf_type: mapped.empty(folder, ANF_OUTPUTS[anf_type], level, (len(sound), len(cfs)))
+              for anf_type in ANF_TYPES}
+    # the spike trains of each batch, by the index of its first CF
+    trains = {}
 
     ### Run model for each channel
-    # nested = map(
-    #        _run_channel,
-    #        channel_args
-    # )
-    nested = []
-    for i, arg in tqdm(enumerate(channel_args), desc='zilany'):
-        nested.append(_run_channel(arg))
+    workers = n_workers(n_jobs)
+    if isinstance(executor, Executor):
+        _run_parallel(executor, channel_args, cfs, anfout, trains,
+                      chunk_size or _chunk_size(len(cfs), os.cpu_count()))
+    elif workers == 1:
+        chunk_size = chunk_size or min(64, _chunk_size(len(cfs), 1))
+        with tqdm(total=len(cfs), desc='zilany') as bar:
+            for start in range(0, len(cfs), chunk_size):
+                chunk = _run_chunk(channel_args, cfs[start:start + chunk_size], start)
+                bar.update(_store_chunk(chunk, start, anfout, trains))
+    elif executor in _EXECUTORS:
+        with _EXECUTORS[executor](max_workers=workers) as pool:
+            _run_parallel(pool, channel_args, cfs, anfout, trains, chunk_size or _chunk_size(len(cfs), workers))
+    else:
+        raise ValueError("executor must be 'process', 'thread' or a concurrent.futures.Executor")
+
+    spike_trains = _spike_trains(trains, cfs, anf_num) if spikes else None
+    anfout = {anf_type: mapped.seal(rates) for anf_type, rates in anfout.items()}
+    return __munge(cfs, anfout, spike_trains, sound, conf, level, output)
+
+
+_EXECUTORS = {
+    # the workers do not inherit the threads of a writer that may be saving the last level
+    'process': lambda max_workers: ProcessPoolExecutor(max_workers, mp_context=writer.process_context()),
+    'thread' : ThreadPoolExecutor,
+}
+
+
+def _chunk_size(cf_count, workers):
+    """Split the CFs into about four batches per worker."""
+    return max(1, int(np.ceil(cf_count / (4 * (workers or 1)))))
+
+
+def _run_parallel(executor: Executor, channel_args, cfs, anfout, trains, chunk_size):
+    """Submit batches of CFs to `executor` and store each batch as it finishes."""
+    futures = {
+        executor.submit(_run_chunk, channel_args, cfs[start:start + chunk_size], start): start
+        for start in range(0, len(cfs), chunk_size)
+    }
+    with tqdm(total=len(cfs), desc='zilany') as bar:
+        for future in as_completed(futures):
+            bar.update(_store_chunk(future.result(), futures[future], anfout, trains))
+
 
-    np.fft.fftpack._fft_cache = {}
+def _store_chunk(chunk, start, anfout, trains):
+    """Copy the rates of a batch starting at CF `start` into `anfout` and keep its spikes; returns the batch size."""
+    stop = start + chunk[ANF_TYPES[0]].shape[1]
+    for anf_type in ANF_TYPES:
+        anfout[anf_type][:, start:stop] = chunk[anf_type]
+    if chunk['spikes'] is not None:
+        trains[start] = chunk['spikes']
+    return stop - start
 
-    return __munge(nested, sound, output)
 
-    # short-circuiting this entirely --gv
-    ### Unpack the results
-    # trains = itertools.chain(*nested)
-    # spike_trains = pd.DataFrame(list(trains))
+def _run_chunk(channel_args, cfs, offset):
+    """Simulate a batch of CFs, the first of which is CF number `offset`, in a worker.
+
+    Returns one (time x CF) matrix per fiber type and, under 'spikes', the spike times of the batch's fibers
+    concatenated (float32) with the spike count of each fiber, or None if no spikes were requested.
+    """
+    out = {anf_type: np.zeros((len(channel_args['middle_ear']), len(cfs))) for anf_type in ANF_TYPES}
+    spikes = []
+    for i, cf in enumerate(cfs):
+        synout, trains = _run_channel(dict(channel_args, cf=cf, cf_index=offset + i))
+        for anf_type in ANF_TYPES:
+            out[anf_type][:, i] = synout[anf_type]
+        spikes.extend(trains)
+    if channel_args['spikes']:
+        out['spikes'] = (np.concatenate([times for times, _ in spikes] or [np.zeros(0, np.float32)]),
+                         np.concatenate([counts for _, counts in spikes] or [np.zeros(0, np.int64)]))
+    else:
+        out['spikes'] = None
+    return out
+
+
+def _spike_trains(trains, cfs, anf_num):
+    """Assemble the spikes of all batches, in CF order, into SpikeTrains."""
+    starts = sorted(trains)
+    counts = np.concatenate([trains[start][1] for start in starts] or [np.zeros(0, np.int64)])
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    fiber_type = np.repeat(np.arange(len(ANF_TYPES), dtype=np.int8), anf_num)
+    return SpikeTrains(times=np.concatenate([trains[start][0] for start in starts] or [np.zeros(0, np.float32)]),
+                       offsets=offsets,
+                       fiberType=np.tile(fiber_type, len(cfs)),
+                       cf=np.repeat(cfs, len(fiber_type)),
+                       fiberTypes=ANF_TYPES)
+
+
+def _streams(seed, cf_index):
+    """Independent random streams of the fiber types of CF number `cf_index`.
+
+    The streams form a SeedSequence spawn tree rooted at `seed` with the keys (cf_index, fiber type, use), where use
+    is 0 for the fractional Gaussian noise and 1 for the seeds of the fibers.
+
+    :return: one (noise, fibers) pair of SeedSequences per fiber type.
+    """
+    return [np.random.SeedSequence(seed, spawn_key=(cf_index, i)).spawn(2) for i in range(len(ANF_TYPES))]
+
 
-    # return spike_trains
+def _synapse_noise(channel_args, streams):
+    """Generate the fractional Gaussian noise of every fiber type of a CF in one call.
 
+    :return: a {fiber type: noise} dict, with None entries when ffGn is off.
+    """
+    if not channel_args['ffGn']:
+        return dict.fromkeys(ANF_TYPES)
+    noise = ffgn.generate(channel_args['noise_length'], 1 / 10e3, 0.9,
+                          mu=[_zilany2014.SPONT[anf_type] for anf_type in ANF_TYPES],
+                          count=len(ANF_TYPES),
+                          rng=[np.random.default_rng(noise_stream) for noise_stream, _ in streams])
+    return dict(zip(ANF_TYPES, noise))
 
-def __munge(zil, sound, output):
-    cfCount = len(zil)
-    timeLen = len(zil[0]['anfout']['hsr'])
-    anfhs = np.zeros((timeLen, cfCount))
-    anfms = np.zeros_like(anfhs)
-    anfls = np.zeros_like(anfhs)
 
+def __munge(cfs, anfout, spike_trains, sound, conf, level, output):
     retval = PeripheryOutput()
-    retval.conf = zil[0]['conf']
-    for i in range(cfCount):
-        anfhs[:, i] = zil[i]['anfout']['hsr']
-        anfms[:, i] = zil[i]['anfout']['msr']
-        anfls[:, i] = zil[i]['anfout']['lsr']
+    retval.conf = conf
     retval.output = {
-        p.CenterFrequency              : np.array(list(reversed([zil[i]['cf'] for i in range(cfCount)]))),
-        p.AuditoryNerveFiberHighSpont  : anfhs,
-        p.AuditoryNerveFiberMediumSpont: anfms,
-        p.AuditoryNerveFiberLowSpont   : anfls,
-        p.StimulusLevel                : zil[0]['level'],
+        p.CenterFrequency              : np.array(list(reversed(cfs))),
+        p.AuditoryNerveFiberHighSpont  : anfout['hsr'],
+        p.AuditoryNerveFiberMediumSpont: anfout['msr'],
+        p.AuditoryNerveFiberLowSpont   : anfout['lsr'],
+        p.AuditoryNerveSpikes          : spike_trains,
+        p.StimulusLevel                : level,
         p.Stimulus                     : sound,
     }
     if output is not None:
@@ -183,55 +328,67 @@ def __munge(zil, sound, output):
 def _run_channel(args):
     fs = args['fs']
     cf = args['cf']
-    signal = args['signal']
+    middle_ear = args['middle_ear']
     cohc = args['cohc']
     cihc = args['cihc']
     powerlaw = args['powerlaw']
-    seed = args['seed']
-    conf = args['conf']
-    level = args['level']
+    powerlaw_tol = args.get('powerlaw_tol', 1e-6)
     anf_num = args['anf_num']
     species = args['species']
     ffGn = args['ffGn']
+    cache = args.get('cache')
+    streams = _streams(args['seed'], args['cf_index'])
+
+    # cache keys of the IHC and synapse outputs; with ffGn, the synapse also depends on the channel's noise stream
+    ihc_key = ('zilany2014.ihc', args.get('sound_key'), float(cf), float(fs), species, float(cohc), float(cihc))
+    noise_key = (args['seed'], args['cf_index'], args['noise_length']) if ffGn else None
+    synapse_keys = {anf_type: ihc_key + ('zilany2014.synapse', anf_type, powerlaw, powerlaw_tol, noise_key)
+                    for anf_type in ANF_TYPES}
+
+    synout = dict.fromkeys(ANF_TYPES)
+    if cache is not None:
+        synout = {anf_type: cache.get(cache.key(*synapse_keys[anf_type])) for anf_type in ANF_TYPES}
+    missing = [anf_type for anf_type in ANF_TYPES if synout[anf_type] is None]
+
+    if missing:
+        ### Run BM, IHC
+        # noinspection PyTypeChecker
+        vihc = cached(cache, lambda: _zilany2014.run_ihc(
+                signal=middle_ear,
+                cf=cf,
+                fs=fs,
+                species=species,
+                cohc=float(cohc),
+                cihc=float(cihc),
+                middle_ear=True
+        ), *ihc_key)
+        noise = _synapse_noise(args, streams)
+
+    for anf_type in missing:
+        # Run synapse
+        synout[anf_type] = _zilany2014.run_synapse(
+                fs=fs,
+                vihc=vihc,
+                cf=cf,
+                anf_type=anf_type,
+                powerlaw=powerlaw,
+                ffGn=ffGn,
+                noise=noise[anf_type],
+                powerlaw_tol=powerlaw_tol
+        )
+        if cache is not None:
+            cache.put(cache.key(*synapse_keys[anf_type]), synout[anf_type])
 
-    ### Run BM, IHC
-    # noinspection PyTypeChecker
-    vihc = _zilany2014.run_ihc(
-            signal=signal,
-            cf=cf,
-            fs=fs,
-            species=species,
-            cohc=float(cohc),
-            cihc=float(cihc)
-    )
-
-    duration = len(vihc) / fs
-    anf_types = np.repeat(['hsr', 'msr', 'lsr'], anf_num)
-
-    synout = {}
+    # (spike times, spike counts) of the fibers of each type
     trains = []
-    for anf_type in anf_types:
-
-        if anf_type not in synout:
-            # Run synapse
-            synout[anf_type] = _zilany2014.run_synapse(
-                    fs=fs,
-                    vihc=vihc,
-                    cf=cf,
-                    anf_type=anf_type,
-                    powerlaw=powerlaw,
-                    ffGn=ffGn
-            )
-
-        # Run spike generator
-        spikes = _zilany2014.run_spike_generator(
+    if not args['spikes']:
+        return synout, trains
+    for anf_type, fiber_num, (_, fiber_stream) in zip(ANF_TYPES, anf_num, streams):
+        # Run spike generator for all fibers of the type at once
+        trains.append(_zilany2014.run_spike_generator_batch(
                 synout=synout[anf_type],
                 fs=fs,
-        )
-    return {
-        'cf'    : args['cf'],
-        'fs'    : args['fs'],
-        'anfout': synout,
-        'conf'  : conf,
-        'level' : level,
-    }
+                fiber_num=fiber_num,
+                seeds=fiber_stream.generate_state(fiber_num, np.uint64)
+        ))
+    return synout, trains
@@ -20,6 +20,8 @@ from __future__ import division, print_function, absolute_import
 
 import numpy as np
 from libc.stdlib cimport malloc
+from libc.math cimport ceil, floor
+from libc.stdint cimport uint64_t, int64_t
 from . import util
 import scipy.signal as dsp
 
@@ -29,7 +31,7 @@ cdef extern from "stdlib.h":
     void *memcpy(void *str1, void *str2, size_t n)
 
 
-cdef extern from "model_IHC.h":
+cdef extern from "model_IHC.h" nogil:
     void IHCAN(
         double *px,
         double cf,
@@ -41,8 +43,31 @@ cdef extern from "model_IHC.h":
         int species,
         double *ihcout
     )
+    void MiddleEar(
+        double *px,
+        double tdres,
+        int totalstim,
+        int species,
+        double *meout
+    )
+    void IHCANFromMiddleEar(
+        const double *meout,
+        double cf,
+        int nrep,
+        double tdres,
+        int totalstim,
+        double cohc,
+        double cihc,
+        int species,
+        double *ihcout
+    )
+
+cdef extern from "model_Synapse.h" nogil:
+    ctypedef struct PowerLawKernel:
+        int nterms
+        const double *weights
+        const double *decays
 
-cdef extern from "model_Synapse.h":
     double Synapse(
         double *ihcout,
         double tdres,
@@ -50,10 +75,14 @@ cdef extern from "model_Synapse.h":
         int totalstim,
         int nrep,
         double spont,
-        double noiseType,
+        const double *randNums,
         double implnt,
         double sampFreq,
-        double *synouttmp
+        double *synouttmp,
+        const double *taps,
+        int ntaps,
+        const PowerLawKernel *plk1,
+        const PowerLawKernel *plk2
     )
     int SpikeGenerator(
         double *synouttmp,
@@ -62,6 +91,20 @@ cdef extern from "model_Synapse.h":
         int nrep,
         double *sptime
     )
+    long SpikeGeneratorBatch(
+        const double *synouttmp,
+        double tdres,
+        int totalstim,
+        int nrep,
+        int nfibers,
+        const uint64_t *seeds,
+        float *sptime,
+        long capacity,
+        int64_t *counts,
+        int64_t *psth,
+        int nbins,
+        double binwidth
+    )
 
 
 cdef extern from "Python.h":
@@ -82,20 +125,108 @@ cdef extern from "numpy/arrayobject.h":
 np.import_array()
 
 
+# Spontaneous rates of the fiber types
+SPONT = {
+    'lsr': 0.1,
+    'msr': 4.0,
+    'hsr': 100.0,
+}
+
+
+# Time constants (beta1, beta2) of the power-law adaptation in model_Synapse.c
+POWERLAW_BETA = (5e-4, 1e-1)
+
+
+# Anti-aliasing filters of the synapse decimation, one per decimation factor
+_decimation_taps = {}
+
+
+def decimation_taps(int q):
+    """Return the FIR low-pass filter used to decimate by `q`.
+
+    The taps are designed once per decimation factor and shared by the
+    native decimator and the `decimate` callback.
+
+    """
+    if q not in _decimation_taps:
+        _decimation_taps[q] = np.ascontiguousarray(
+            dsp.firwin(q+1, 1./q, window='hamming')
+        )
+    return _decimation_taps[q]
+
+
+SPECIES = {
+    'cat': 1,
+    'human': 2,
+    'human_glasberg1990': 3,
+}
+
+
+def run_middle_ear(
+        np.ndarray[np.float64_t, ndim=1] signal,
+        double fs,
+        species='cat'
+):
+    """Run middle ear filter.
+
+    The middle ear does not depend on CF, so its output can be
+    computed once and passed to `run_ihc` for every CF.
+
+    Parameters
+    ----------
+    signal : array_like
+        Sound pressure in Pascal.
+    fs : float
+        Sampling frequency in Hz.
+    species : {'cat', 'human', 'human_glasberg1990'}
+        Species.
+
+    Returns
+    -------
+    array_like
+        Output of the middle ear filter.
+
+    """
+    assert (fs >= 100e3) and (fs <= 500e3), "Wrong Fs: 100e3 <= fs <= 500e3"
+
+    cdef int species_id = SPECIES[species]
+    cdef int totalstim = len(signal)
+
+    if not signal.flags['C_CONTIGUOUS']:
+        signal = signal.copy(order='C')
+    cdef double *signal_data = <double *>np.PyArray_DATA(signal)
+
+    meout = np.zeros(len(signal))
+    cdef double *meout_data = <double *>np.PyArray_DATA(meout)
+
+    with nogil:
+        MiddleEar(
+            signal_data,
+            1.0/fs,
+            totalstim,
+            species_id,
+            meout_data
+        )
+
+    return meout
+
+
 def run_ihc(
         np.ndarray[np.float64_t, ndim=1] signal,
         double cf,
         double fs,
         species='cat',
         double cohc=1.,
-        double cihc=1.
+        double cihc=1.,
+        middle_ear=False
 ):
     """Run middle ear filter, BM filters and IHC model.
 
     Parameters
     ----------
     signal : array_like
-        Output of the middle ear filter in Pascal.
+        Sound pressure in Pascal, or the output of `run_middle_ear`
+        if `middle_ear` is True.
     cf : float
         Characteristic frequency in Hz.
     fs : float
@@ -104,6 +235,9 @@ def run_ihc(
         Species.
     cihc, cohc : float
         Degeneration parameters for IHC and OHC cells.
+    middle_ear : bool
+        If True, `signal` has already been filtered by the middle
+        ear and only the BM filters and the IHC are run.
 
     Returns
     -------
@@ -121,11 +255,8 @@ def run_ihc(
     assert (cihc >= 0) and (cihc <= 1), "0 <= cihc <= 1"
 
 
-    species_map = {
-        'cat': 1,
-        'human': 2,
-        'human_glasberg1990': 3,
-    }
+    cdef int species_id = SPECIES[species]
+    cdef int totalstim = len(signal)
 
     # Input sound
     if not signal.flags['C_CONTIGUOUS']:
@@ -137,17 +268,34 @@ def run_ihc(
     cdef double *ihcout_data = <double *>np.PyArray_DATA(ihcout)
 
 
-    IHCAN(
-        signal_data,
-        cf,
-        1,
-        1.0/fs,
-        len(signal),
-        cohc,
-        cihc,
-        species_map[species],
-        ihcout_data
-    )
+    # IHCAN keeps its filter states per call, so other threads can
+    # simulate their own channels meanwhile
+    cdef bint filtered = middle_ear
+    with nogil:
+        if filtered:
+            IHCANFromMiddleEar(
+                signal_data,
+                cf,
+                1,
+                1.0/fs,
+                totalstim,
+                cohc,
+                cihc,
+                species_id,
+                ihcout_data
+            )
+        else:
+            IHCAN(
+                signal_data,
+                cf,
+                1,
+                1.0/fs,
+                totalstim,
+                cohc,
+                cihc,
+                species_id,
+                ihcout_data
+            )
 
 
     return ihcout
@@ -155,21 +303,45 @@ def run_ihc(
 
 
 
+def synapse_noise_length(int totalstim, double fs, double cf, double sampFreq=10e3):
+    """Number of fractional Gaussian noise samples used by the synapse.
+
+    totalstim: number of samples of the IHC receptor potential
+    fs: sampling frequency of the IHC receptor potential
+    cf: characteristic frequency
+    sampFreq: sampling frequency of the power-law adaptation
+
+    """
+    cdef int delaypoint = <int>floor(7500/(cf/1e3))
+    return <int>ceil((totalstim+2*delaypoint)*(1.0/fs)*sampFreq)
+
+
 def run_synapse(
         np.ndarray[np.float64_t, ndim=1] vihc,
         double fs,
         double cf,
         anf_type='hsr',
         powerlaw='actual',
-        ffGn=True
+        ffGn=True,
+        decimation='native',
+        noise=None,
+        powerlaw_tol=1e-6
 ):
     """Run synapse simulation.
 
     vihc: IHC receptor potential
     cf: characteristic frequency
     anf_type: auditory nerve fiber type ('hsr', 'msr' or 'lsr')
-    powerlaw: implementation of the powerlaw ('actual', 'approximate')
+    powerlaw: implementation of the powerlaw ('actual', 'approximate',
+        'fast'); 'fast' runs the actual power law in O(N) with a
+        sum-of-exponentials kernel (see util.powerlaw_kernel)
     ffGn: enable/disable factorial Gauss noise generator
+    noise: precomputed fractional Gaussian noise of at least
+        `synapse_noise_length` samples, e.g. one row of
+        util.ffgn.generate(); generated here when None and ffGn is on
+    powerlaw_tol: bound on the relative error of the 'fast' power law
+    decimation: decimate the synapse input in C ('native') or through
+        the scipy.signal callback ('scipy')
 
     return: PSTH from ANF
 
@@ -177,23 +349,66 @@ def run_synapse(
     assert (cf > 79.9) and (cf < 40e3), "Wrong CF: 80 <= cf < 40e3, CF = %s"%str(cf)
     assert (fs >= 100e3) and (fs <= 500e3), "Wrong Fs: 100e3 <= fs <= 500e3"
     assert anf_type in ['hsr', 'msr', 'lsr'], "anf_type not hsr/msr/lsr"
-    assert powerlaw in ['actual', 'approximate'], "powerlaw not actual/approximate"
-
-    spont = {
-        'lsr': 0.1,
-        'msr': 4.0,
-        'hsr': 100.0,
-    }
+    assert powerlaw in ['actual', 'approximate', 'fast'], "powerlaw not actual/approximate/fast"
+    assert decimation in ['native', 'scipy'], "decimation not native/scipy"
 
     powerlaw_map = {
         'actual': 1,
-        'approximate': 0
+        'approximate': 0,
+        'fast': 1
     }
 
+    cdef double spont_rate = SPONT[anf_type]
+    cdef double implnt = powerlaw_map[powerlaw]
+    cdef int totalstim = len(vihc)
+    cdef double sampFreq = 10e3
+
+    # Fractional Gaussian noise, NULL runs without noise
+    cdef np.ndarray[np.float64_t, ndim=1] noise_arr
+    cdef PowerLawKernel plk[2]
+    cdef PowerLawKernel *plk1 = NULL
+    cdef PowerLawKernel *plk2 = NULL
+    cdef double *noise_data = NULL
     if ffGn:
-        noise_type = 1.
-    else:
-        noise_type = 0.
+        if noise is None:
+            noise = util.ffgn.generate(
+                synapse_noise_length(totalstim, fs, cf, sampFreq),
+                1/sampFreq,
+                0.9,
+                spont_rate
+            )
+        noise_arr = np.ascontiguousarray(noise, dtype=np.float64)
+        assert len(noise_arr) >= synapse_noise_length(totalstim, fs, cf, sampFreq), "noise too short"
+        noise_data = <double *>np.PyArray_DATA(noise_arr)
+
+    # Sum-of-exponentials power-law kernels, NULL sums over the whole history
+    cdef np.ndarray[np.float64_t, ndim=1] arr
+    kernels = []
+    if powerlaw == 'fast':
+        for i, beta in enumerate(POWERLAW_BETA):
+            weights, decays = util.powerlaw_kernel(
+                beta,
+                1/sampFreq,
+                synapse_noise_length(totalstim, fs, cf, sampFreq),
+                powerlaw_tol
+            )
+            kernels.extend([weights, decays])
+            arr = weights
+            plk[i].weights = <double *>np.PyArray_DATA(arr)
+            arr = decays
+            plk[i].decays = <double *>np.PyArray_DATA(arr)
+            plk[i].nterms = len(weights)
+        plk1 = &plk[0]
+        plk2 = &plk[1]
+
+    # Decimation filter, NULL selects the Python callback
+    cdef np.ndarray[np.float64_t, ndim=1] taps
+    cdef double *taps_data = NULL
+    cdef int ntaps = 0
+    if decimation == 'native':
+        taps = decimation_taps(int(np.ceil(1/(1.0/fs*sampFreq))))
+        taps_data = <double *>np.PyArray_DATA(taps)
+        ntaps = len(taps)
 
 
     # Input IHC voltage
@@ -207,19 +422,24 @@ def run_synapse(
     cdef double *synout_data = <double *>np.PyArray_DATA(synout)
 
 
-    # Run synapse model
-    Synapse(
-        vihc_data,                   # ihcout
-        1.0/fs,                      # tdres
-        cf,                          # cf
-        len(vihc),                   # totalstim
-        1,                           # nrep
-        spont[anf_type],             # spont
-        noise_type,                  # noiseType
-        powerlaw_map[powerlaw],      # implnt
-        10e3,                        # sampFreq
-        synout_data                  # synouttmp
-    )
+    # Run synapse model; the Python callbacks reacquire the GIL
+    with nogil:
+        Synapse(
+            vihc_data,                   # ihcout
+            1.0/fs,                      # tdres
+            cf,                          # cf
+            totalstim,                   # totalstim
+            1,                           # nrep
+            spont_rate,                  # spont
+            noise_data,                  # randNums
+            implnt,                      # implnt
+            sampFreq,                    # sampFreq
+            synout_data,                 # synouttmp
+            taps_data,                   # taps
+            ntaps,                       # ntaps
+            plk1,                        # plk1
+            plk2                         # plk2
+        )
 
     return synout
 
@@ -241,27 +461,101 @@ def run_spike_generator(
         synout = synout.copy(order='C')
     cdef double *synout_data = <double *>np.PyArray_DATA(synout)
 
+    cdef int totalstim = len(synout)
+
     # Output spikes (signal)
     sptimes = np.zeros(np.ceil(len(synout)/0.00075/fs).astype(int))
     cdef double *sptimes_data = <double *>np.PyArray_DATA(sptimes)
 
 
     # Run synapse model
-    SpikeGenerator(
-        synout_data,            # synouttmp
-        1./fs,                  # tdres
-        len(synout),            # totalstim
-        1,                      # nprep
-        sptimes_data            # sptime
-    )
+    with nogil:
+        SpikeGenerator(
+            synout_data,            # synouttmp
+            1./fs,                  # tdres
+            totalstim,              # totalstim
+            1,                      # nprep
+            sptimes_data            # sptime
+        )
 
     spikes = np.array(sptimes[sptimes != 0])
 
     return spikes
 
 
+def run_spike_generator_batch(
+        np.ndarray[np.float64_t, ndim=1] synout,
+        double fs,
+        int fiber_num,
+        seeds=None,
+        psth_binwidth=None
+):
+    """Run spike generator for many fibers driven by the same synapse output.
+
+    All fibers are simulated in one native call, each with its own
+    xoshiro256** random stream.
+
+    synout: synapse output
+    fs: sampling frequency
+    fiber_num: number of fibers
+    seeds: uint64 seed of the random stream of every fiber; drawn
+        from np.random if None
+    psth_binwidth: if given, return the PSTH of all fibers with bins
+        of this width (s) instead of the spike times
+
+    return: (sptimes, counts) with the float32 spike times of all
+        fibers one fiber after the other and the spike count of every
+        fiber, or the PSTH (spikes per bin) if psth_binwidth is given
+
+    """
+    if not synout.flags['C_CONTIGUOUS']:
+        synout = synout.copy(order='C')
+    cdef double *synout_data = <double *>np.PyArray_DATA(synout)
 
-cdef public double* generate_random_numbers(long length):
+    cdef int totalstim = len(synout)
+    cdef double tdres = 1./fs
+
+    if seeds is None:
+        seeds = np.random.randint(0, 2**64, fiber_num, dtype=np.uint64)
+    cdef np.ndarray[np.uint64_t, ndim=1] seeds_arr = np.ascontiguousarray(seeds, dtype=np.uint64)
+    assert len(seeds_arr) == fiber_num, "one seed per fiber is needed"
+    cdef uint64_t *seeds_data = <uint64_t *>np.PyArray_DATA(seeds_arr)
+
+    cdef long total
+    cdef long capacity
+    cdef int nbins
+    cdef double binwidth
+    cdef np.ndarray[np.int64_t, ndim=1] psth
+    cdef int64_t *psth_data
+    if psth_binwidth is not None:
+        binwidth = psth_binwidth
+        nbins = int(np.ceil(totalstim * tdres / binwidth))
+        psth = np.zeros(nbins, dtype=np.int64)
+        psth_data = <int64_t *>np.PyArray_DATA(psth)
+        with nogil:
+            SpikeGeneratorBatch(synout_data, tdres, totalstim, 1, fiber_num, seeds_data,
+                                NULL, 0, NULL, psth_data, nbins, binwidth)
+        return psth
+
+    # Guess the number of spikes from the mean rate; the same seeds are
+    # rerun with the exact size if the guess was too small
+    cdef np.ndarray[np.float32_t, ndim=1] sptimes
+    cdef np.ndarray[np.int64_t, ndim=1] counts = np.zeros(fiber_num, dtype=np.int64)
+    cdef int64_t *counts_data = <int64_t *>np.PyArray_DATA(counts)
+    capacity = int(fiber_num * (1.25 * np.sum(np.maximum(synout, 0)) * tdres + 16))
+    while True:
+        sptimes = np.empty(capacity, dtype=np.float32)
+        with nogil:
+            total = SpikeGeneratorBatch(synout_data, tdres, totalstim, 1, fiber_num, seeds_data,
+                                        <float *>np.PyArray_DATA(sptimes), capacity, counts_data,
+                                        NULL, 0, 0.)
+        if total <= capacity:
+            return sptimes[:total].copy(), counts
+        capacity = total
+
+
+
+cdef public double* generate_random_numbers(long length) with gil:
     arr = np.random.rand(length)
 
     if not arr.flags['C_CONTIGUOUS']:
@@ -280,7 +574,7 @@ cdef public double* decimate(
     int k,
     double *signal,
     int q
-):
+) with gil:
     """Decimate a signal
 
     k: number of samples in signal
@@ -306,7 +600,7 @@ cdef public double* decimate(
     # )
 
 
-    b = dsp.firwin(q+1, 1./q, window='hamming')
+    b = decimation_taps(q)
     a = [1.]
 
     filtered = dsp.filtfilt(
@@ -328,19 +622,3 @@ cdef public double* decimate(
     memcpy(out_ptr, resampled_ptr, len(resampled)*sizeof(double))
 
     return out_ptr
-
-
-cdef public double* ffGn(int N, double tdres, double Hinput, double noiseType, double mu):
-    """util.ffGn() wrapper"""
-
-    a = util.ffGn(N, tdres, Hinput, noiseType, mu)
-
-    if not a.flags['C_CONTIGUOUS']:
-        a = a.copy(order='C')
-
-    # Copy data to output array
-    cdef double *ptr = <double *>np.PyArray_DATA(a)
-    cdef double *out_ptr = <double *>malloc(len(a)*sizeof(double))
-    memcpy(out_ptr, ptr, len(a)*sizeof(double))
-
-    return out_ptr
@@ -68,6 +68,7 @@ The Oryginal Note
 */
 
 #include "Python.h"
+#include "model_IHC.h"
 
 #include <stdio.h>
 #include <stdlib.h>
@@ -91,17 +92,117 @@ The Oryginal Note
 #define __min(a,b) (((a) < (b))? (a): (b))
 #endif
 
+/* Filter states of one CF channel.  They used to be function-level static
+   variables; keeping them in a per-channel struct makes IHCAN reentrant, so
+   several channels can be simulated concurrently without holding the GIL. */
 
+typedef struct {
+    double gain_norm, initphase;
+    double input[12][4], output[12][4];
+} ChirpFiltState;
 
+typedef struct {
+    double phase;
+    COMPLEX gtf[4], gtfl[4];
+} WbGammaToneState;
 
+typedef struct {
+    double y[8], yl[8];
+} LowPassState;
+
+typedef struct {
+    ChirpFiltState c1, c2;
+    WbGammaToneState wb;
+    LowPassState ohc, ihc;
+} IHCState;
+
+
+
+
+/* The middle-ear filter does not depend on CF: MiddleEar() is run once per stimulus and its
+   output is shared by the cochlear model of every CF, IHCANFromMiddleEar() */
 void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
                 double cohc, double cihc, int species, double *ihcout)
 {
+    double *meout;
+
+    meout = (double*)calloc(totalstim,sizeof(double));
+    MiddleEar(px, tdres, totalstim, species, meout);
+    IHCANFromMiddleEar(meout, cf, nrep, tdres, totalstim, cohc, cihc, species, ihcout);
+    free(meout);
+}
 
-    /*variables for middle-ear model */
+/* Middle-ear filter: sound pressure px in Pa to the middle-ear output meout */
+void MiddleEar(double *px, double tdres, int totalstim, int species, double *meout)
+{
 	double megainmax;
-    double *mey1, *mey2, *mey3, meout,c1filterouttmp,c2filterouttmp,c1vihctmp,c2vihctmp;
+    double *mey1, *mey2, *mey3;
     double fp,C,m11,m12,m13,m14,m15,m16,m21,m22,m23,m24,m25,m26,m31,m32,m33,m34,m35,m36;
+	int    n;
+
+	mey1 = (double*)calloc(totalstim,sizeof(double));
+	mey2 = (double*)calloc(totalstim,sizeof(double));
+	mey3 = (double*)calloc(totalstim,sizeof(double));
+
+    /* Prewarping and related constants for the middle ear */
+     fp = 1e3;  /* prewarping frequency 1 kHz */
+     C  = TWOPI*fp/tan(TWOPI/2*fp*tdres);
+     if (species==1) /* for cat */
+     {
+         /* Cat middle-ear filter - simplified version from Bruce et al. (JASA 2003) */
+         m11 = C/(C + 693.48);                    m12 = (693.48 - C)/C;            m13 = 0.0;
+         m14 = 1.0;                               m15 = -1.0;                      m16 = 0.0;
+         m21 = 1/(pow(C,2) + 11053*C + 1.163e8);  m22 = -2*pow(C,2) + 2.326e8;     m23 = pow(C,2) - 11053*C + 1.163e8;
+         m24 = pow(C,2) + 1356.3*C + 7.4417e8;    m25 = -2*pow(C,2) + 14.8834e8;   m26 = pow(C,2) - 1356.3*C + 7.4417e8;
+         m31 = 1/(pow(C,2) + 4620*C + 909059944); m32 = -2*pow(C,2) + 2*909059944; m33 = pow(C,2) - 4620*C + 909059944;
+         m34 = 5.7585e5*C + 7.1665e7;             m35 = 14.333e7;                  m36 = 7.1665e7 - 5.7585e5*C;
+         megainmax=41.1405;
+     };
+     if (species>1) /* for human */
+     {
+         /* Human middle-ear filter - based on Pascal et al. (JASA 1998)  */
+         m11=1/(pow(C,2)+5.9761e+003*C+2.5255e+007);m12=(-2*pow(C,2)+2*2.5255e+007);m13=(pow(C,2)-5.9761e+003*C+2.5255e+007);m14=(pow(C,2)+5.6665e+003*C);             m15=-2*pow(C,2);					m16=(pow(C,2)-5.6665e+003*C);
+         m21=1/(pow(C,2)+6.4255e+003*C+1.3975e+008);m22=(-2*pow(C,2)+2*1.3975e+008);m23=(pow(C,2)-6.4255e+003*C+1.3975e+008);m24=(pow(C,2)+5.8934e+003*C+1.7926e+008); m25=(-2*pow(C,2)+2*1.7926e+008);	m26=(pow(C,2)-5.8934e+003*C+1.7926e+008);
+         m31=1/(pow(C,2)+2.4891e+004*C+1.2700e+009);m32=(-2*pow(C,2)+2*1.2700e+009);m33=(pow(C,2)-2.4891e+004*C+1.2700e+009);m34=(3.1137e+003*C+6.9768e+008);     m35=2*6.9768e+008;				m36=(-3.1137e+003*C+6.9768e+008);
+         megainmax=2;
+     };
+  	for (n=0;n<totalstim;n++)
+    {
+        if (n==0)  /* Start of the middle-ear filtering section  */
+		{
+	    	mey1[0]  = m11*px[0];
+            if (species>1) mey1[0] = m11*m14*px[0];
+            mey2[0]  = mey1[0]*m24*m21;
+            mey3[0]  = mey2[0]*m34*m31;
+            meout[0] = mey3[0]/megainmax;
+        }
+
+        else if (n==1)
+		{
+            mey1[1]  = m11*(-m12*mey1[0] + px[1]       - px[0]);
+            if (species>1) mey1[1] = m11*(-m12*mey1[0]+m14*px[1]+m15*px[0]);
+			mey2[1]  = m21*(-m22*mey2[0] + m24*mey1[1] + m25*mey1[0]);
+            mey3[1]  = m31*(-m32*mey3[0] + m34*mey2[1] + m35*mey2[0]);
+            meout[1] = mey3[1]/megainmax;
+		}
+	    else
+		{
+            mey1[n]  = m11*(-m12*mey1[n-1]  + px[n]         - px[n-1]);
+            if (species>1) mey1[n]= m11*(-m12*mey1[n-1]-m13*mey1[n-2]+m14*px[n]+m15*px[n-1]+m16*px[n-2]);
+            mey2[n]  = m21*(-m22*mey2[n-1] - m23*mey2[n-2] + m24*mey1[n] + m25*mey1[n-1] + m26*mey1[n-2]);
+            mey3[n]  = m31*(-m32*mey3[n-1] - m33*mey3[n-2] + m34*mey2[n] + m35*mey2[n-1] + m36*mey2[n-2]);
+            meout[n] = mey3[n]/megainmax;
+		}; 	/* End of the middle-ear filtering section */
+    };
+
+    free(mey1); free(mey2); free(mey3);
+}
+
+/* BM filters and IHC model of one CF, driven by the middle-ear output meout of MiddleEar() */
+void IHCANFromMiddleEar(const double *meout, double cf, int nrep, double tdres, int totalstim,
+                double cohc, double cihc, int species, double *ihcout)
+{
+    double c1filterouttmp,c2filterouttmp,c1vihctmp,c2vihctmp;
 
 	/*variables for the signal-path, control-path and onward */
 	double *ihcouttmp,*tmpgain;
@@ -112,10 +213,13 @@ void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
 	int    i,n,delaypoint,grdelay[1],bmorder,wborder;
 	double wbout1,wbout,ohcnonlinout,ohcout,tmptauc1,tauc1,rsigma,wb_gain;
 
+	/* filter states of this channel */
+	IHCState state;
+
     /* Declarations of the functions used in the program */
-	double C1ChirpFilt(double, double,double, int, double, double);
-	double C2ChirpFilt(double, double,double, int, double, double);
-    double WbGammaTone(double, double, double, int, double, double, int);
+	double C1ChirpFilt(double, double,double, int, double, double, ChirpFiltState *);
+	double C2ChirpFilt(double, double,double, int, double, double, ChirpFiltState *);
+    double WbGammaTone(double, double, double, int, double, double, int, WbGammaToneState *);
 
     double Get_tauwb(double, int, int, double *, double *);
 	double Get_taubm(double, int, double, double *, double *, double *);
@@ -123,8 +227,8 @@ void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
     double delay_cat(double cf);
     double delay_human(double cf);
 
-    double OhcLowPass(double, double, double, int, double, int);
-    double IhcLowPass(double, double, double, int, double, int);
+    double OhcLowPass(double, double, double, int, double, int, LowPassState *);
+    double IhcLowPass(double, double, double, int, double, int, LowPassState *);
 	double Boltzman(double, double, double, double, double);
     double NLafterohc(double, double, double, double);
 	double ControlSignal(double, double, double, double, double);
@@ -134,10 +238,6 @@ void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
     /* Allocate dynamic memory for the temporary variables */
 	ihcouttmp  = (double*)calloc(totalstim*nrep,sizeof(double));
 
-	mey1 = (double*)calloc(totalstim,sizeof(double));
-	mey2 = (double*)calloc(totalstim,sizeof(double));
-	mey3 = (double*)calloc(totalstim,sizeof(double));
-
 	tmpgain = (double*)calloc(totalstim,sizeof(double));
 
 	/** Calculate the center frequency for the control-path wideband filter
@@ -189,64 +289,16 @@ void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
 	ohcasym  = 7.0;
 	ihcasym  = 3.0;
   	/*===============================================================*/
-    /*===============================================================*/
-    /* Prewarping and related constants for the middle ear */
-     fp = 1e3;  /* prewarping frequency 1 kHz */
-     C  = TWOPI*fp/tan(TWOPI/2*fp*tdres);
-     if (species==1) /* for cat */
-     {
-         /* Cat middle-ear filter - simplified version from Bruce et al. (JASA 2003) */
-         m11 = C/(C + 693.48);                    m12 = (693.48 - C)/C;            m13 = 0.0;
-         m14 = 1.0;                               m15 = -1.0;                      m16 = 0.0;
-         m21 = 1/(pow(C,2) + 11053*C + 1.163e8);  m22 = -2*pow(C,2) + 2.326e8;     m23 = pow(C,2) - 11053*C + 1.163e8;
-         m24 = pow(C,2) + 1356.3*C + 7.4417e8;    m25 = -2*pow(C,2) + 14.8834e8;   m26 = pow(C,2) - 1356.3*C + 7.4417e8;
-         m31 = 1/(pow(C,2) + 4620*C + 909059944); m32 = -2*pow(C,2) + 2*909059944; m33 = pow(C,2) - 4620*C + 909059944;
-         m34 = 5.7585e5*C + 7.1665e7;             m35 = 14.333e7;                  m36 = 7.1665e7 - 5.7585e5*C;
-         megainmax=41.1405;
-     };
-     if (species>1) /* for human */
-     {
-         /* Human middle-ear filter - based on Pascal et al. (JASA 1998)  */
-         m11=1/(pow(C,2)+5.9761e+003*C+2.5255e+007);m12=(-2*pow(C,2)+2*2.5255e+007);m13=(pow(C,2)-5.9761e+003*C+2.5255e+007);m14=(pow(C,2)+5.6665e+003*C);             m15=-2*pow(C,2);					m16=(pow(C,2)-5.6665e+003*C);
-         m21=1/(pow(C,2)+6.4255e+003*C+1.3975e+008);m22=(-2*pow(C,2)+2*1.3975e+008);m23=(pow(C,2)-6.4255e+003*C+1.3975e+008);m24=(pow(C,2)+5.8934e+003*C+1.7926e+008); m25=(-2*pow(C,2)+2*1.7926e+008);	m26=(pow(C,2)-5.8934e+003*C+1.7926e+008);
-         m31=1/(pow(C,2)+2.4891e+004*C+1.2700e+009);m32=(-2*pow(C,2)+2*1.2700e+009);m33=(pow(C,2)-2.4891e+004*C+1.2700e+009);m34=(3.1137e+003*C+6.9768e+008);     m35=2*6.9768e+008;				m36=(-3.1137e+003*C+6.9768e+008);
-         megainmax=2;
-     };
   	for (n=0;n<totalstim;n++) /* Start of the loop */
     {
-        if (n==0)  /* Start of the middle-ear filtering section  */
-		{
-	    	mey1[0]  = m11*px[0];
-            if (species>1) mey1[0] = m11*m14*px[0];
-            mey2[0]  = mey1[0]*m24*m21;
-            mey3[0]  = mey2[0]*m34*m31;
-            meout = mey3[0]/megainmax ;
-        }
-
-        else if (n==1)
-		{
-            mey1[1]  = m11*(-m12*mey1[0] + px[1]       - px[0]);
-            if (species>1) mey1[1] = m11*(-m12*mey1[0]+m14*px[1]+m15*px[0]);
-			mey2[1]  = m21*(-m22*mey2[0] + m24*mey1[1] + m25*mey1[0]);
-            mey3[1]  = m31*(-m32*mey3[0] + m34*mey2[1] + m35*mey2[0]);
-            meout = mey3[1]/megainmax;
-		}
-	    else
-		{
-            mey1[n]  = m11*(-m12*mey1[n-1]  + px[n]         - px[n-1]);
-            if (species>1) mey1[n]= m11*(-m12*mey1[n-1]-m13*mey1[n-2]+m14*px[n]+m15*px[n-1]+m16*px[n-2]);
-            mey2[n]  = m21*(-m22*mey2[n-1] - m23*mey2[n-2] + m24*mey1[n] + m25*mey1[n-1] + m26*mey1[n-2]);
-            mey3[n]  = m31*(-m32*mey3[n-1] - m33*mey3[n-2] + m34*mey2[n] + m35*mey2[n-1] + m36*mey2[n-2]);
-            meout = mey3[n]/megainmax;
-		}; 	/* End of the middle-ear filtering section */
 
 		/* Control-path filter */
 
-        wbout1 = WbGammaTone(meout,tdres,centerfreq,n,tauwb,wbgain,wborder);
+        wbout1 = WbGammaTone(meout[n],tdres,centerfreq,n,tauwb,wbgain,wborder,&state.wb);
         wbout  = pow((tauwb/TauWBMax),wborder)*wbout1*10e3*__max(1,cf/5e3);
 
         ohcnonlinout = Boltzman(wbout,ohcasym,12.0,5.0,5.0); /* pass the control signal through OHC Nonlinear Function */
-		ohcout = OhcLowPass(ohcnonlinout,tdres,600,n,1.0,2);/* lowpass filtering after the OHC nonlinearity */
+		ohcout = OhcLowPass(ohcnonlinout,tdres,600,n,1.0,2,&state.ohc);/* lowpass filtering after the OHC nonlinearity */
 
 		tmptauc1 = NLafterohc(ohcout,bmTaumin[0],bmTaumax[0],ohcasym); /* nonlinear function after OHC low-pass filter */
 		tauc1    = cohc*(tmptauc1-bmTaumin[0])+bmTaumin[0];  /* time -constant for the signal-path C1 filter */
@@ -274,12 +326,12 @@ void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
 
         /*====== Signal-path C1 filter ======*/
 
-		 c1filterouttmp = C1ChirpFilt(meout, tdres, cf, n, bmTaumax[0], rsigma); /* C1 filter output */
+		 c1filterouttmp = C1ChirpFilt(meout[n], tdres, cf, n, bmTaumax[0], rsigma, &state.c1); /* C1 filter output */
 
 
         /*====== Parallel-path C2 filter ======*/
 
-		 c2filterouttmp  = C2ChirpFilt(meout, tdres, cf, n, bmTaumax[0], 1/ratiobm[0]); /* parallel-filter output*/
+		 c2filterouttmp  = C2ChirpFilt(meout[n], tdres, cf, n, bmTaumax[0], 1/ratiobm[0], &state.c2); /* parallel-filter output*/
 
 	    /*=== Run the inner hair cell (IHC) section: NL function and then lowpass filtering ===*/
 
@@ -287,7 +339,7 @@ void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
 
 		c2vihctmp = -NLogarithm(c2filterouttmp*fabs(c2filterouttmp)*cf/10*cf/2e3,0.2,1.0,cf); /* C2 transduction output */
 
-        ihcouttmp[n] = IhcLowPass(c1vihctmp+c2vihctmp,tdres,3000,n,1.0,7);
+        ihcouttmp[n] = IhcLowPass(c1vihctmp+c2vihctmp,tdres,3000,n,1.0,7,&state.ihc);
    };  /* End of the loop */
 
     /* Stretched out the IHC output according to nrep (number of repetitions) */
@@ -313,7 +365,6 @@ void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
     /* Freeing dynamic memory allocated earlier */
 
     free(ihcouttmp);
-    free(mey1); free(mey2); free(mey3);
     free(tmpgain);
 
 } /* End of the SingleAN function */
@@ -379,11 +430,8 @@ double Get_taubm(double cf, int species, double taumax,double *bmTaumax,double *
 /* -------------------------------------------------------------------------------------------- */
 /** Pass the signal through the signal-path C1 Tenth Order Nonlinear Chirp-Gammatone Filter */
 
-double C1ChirpFilt(double x, double tdres,double cf, int n, double taumax, double rsigma)
+double C1ChirpFilt(double x, double tdres,double cf, int n, double taumax, double rsigma, ChirpFiltState *state)
 {
-    static double C1gain_norm, C1initphase;
-    static double C1input[12][4], C1output[12][4];
-
     double ipw, ipb, rpa, pzero, rzero;
 	double sigma0,fs_bilinear,CF,norm_gain,phase,c1filterout;
 	int i,r,order_of_pole,half_order_pole,order_of_zero;
@@ -423,35 +471,35 @@ double C1ChirpFilt(double x, double tdres,double cf, int n, double taumax, doubl
 
     p[7]   = p[1]; p[8] = p[2]; p[9] = p[5]; p[10]= p[6];
 
-	   C1initphase = 0.0;
+	   state->initphase = 0.0;
        for (i=1;i<=half_order_pole;i++)
 	   {
            preal     = p[i*2-1].x;
 		   pimg      = p[i*2-1].y;
-	       C1initphase = C1initphase + atan(CF/(-rzero))-atan((CF-pimg)/(-preal))-atan((CF+pimg)/(-preal));
+	       state->initphase = state->initphase + atan(CF/(-rzero))-atan((CF-pimg)/(-preal))-atan((CF+pimg)/(-preal));
 	   };
 
-	/*===================== Initialize C1input & C1output =====================*/
+	/*===================== Initialize state->input & state->output =====================*/
 
       for (i=1;i<=(half_order_pole+1);i++)
       {
-		   C1input[i][3] = 0;
-		   C1input[i][2] = 0;
-		   C1input[i][1] = 0;
-		   C1output[i][3] = 0;
-		   C1output[i][2] = 0;
-		   C1output[i][1] = 0;
+		   state->input[i][3] = 0;
+		   state->input[i][2] = 0;
+		   state->input[i][1] = 0;
+		   state->output[i][3] = 0;
+		   state->output[i][2] = 0;
+		   state->output[i][1] = 0;
       }
 
 	/*===================== normalize the gain =====================*/
 
-      C1gain_norm = 1.0;
+      state->gain_norm = 1.0;
       for (r=1; r<=order_of_pole; r++)
-		   C1gain_norm = C1gain_norm*(pow((CF - p[r].y),2) + p[r].x*p[r].x);
+		   state->gain_norm = state->gain_norm*(pow((CF - p[r].y),2) + p[r].x*p[r].x);
 
    };
 
-    norm_gain= sqrt(C1gain_norm)/pow(sqrt(CF*CF+rzero*rzero),order_of_zero);
+    norm_gain= sqrt(state->gain_norm)/pow(sqrt(CF*CF+rzero*rzero),order_of_zero);
 
 	p[1].x = -sigma0 - rsigma;
 
@@ -478,7 +526,7 @@ double C1ChirpFilt(double x, double tdres,double cf, int n, double taumax, doubl
 	       phase = phase-atan((CF-pimg)/(-preal))-atan((CF+pimg)/(-preal));
 	};
 
-	rzero = -CF/tan((C1initphase-phase)/order_of_zero);
+	rzero = -CF/tan((state->initphase-phase)/order_of_zero);
 
 	if (rzero>0.0) {
 	     printf("The zeros are in the right-half plane.\n");
@@ -490,9 +538,9 @@ double C1ChirpFilt(double x, double tdres,double cf, int n, double taumax, doubl
    /*%      time loop begins here                         */
    /*%==================================================  */
 
-       C1input[1][3]=C1input[1][2];
-	   C1input[1][2]=C1input[1][1];
-	   C1input[1][1]= x;
+       state->input[1][3]=state->input[1][2];
+	   state->input[1][2]=state->input[1][1];
+	   state->input[1][1]= x;
 
        for (i=1;i<=half_order_pole;i++)
        {
@@ -508,21 +556,21 @@ double C1ChirpFilt(double x, double tdres,double cf, int n, double taumax, doubl
 
            dy = dy-output[i][2]*((fs_bilinear+preal)*(fs_bilinear+preal)+pimg*pimg);*/
 
-	       dy = C1input[i][1]*(fs_bilinear-rzero) - 2*rzero*C1input[i][2] - (fs_bilinear+rzero)*C1input[i][3]
-                 +2*C1output[i][1]*(fs_bilinear*fs_bilinear-preal*preal-pimg*pimg)
-			     -C1output[i][2]*((fs_bilinear+preal)*(fs_bilinear+preal)+pimg*pimg);
+	       dy = state->input[i][1]*(fs_bilinear-rzero) - 2*rzero*state->input[i][2] - (fs_bilinear+rzero)*state->input[i][3]
+                 +2*state->output[i][1]*(fs_bilinear*fs_bilinear-preal*preal-pimg*pimg)
+			     -state->output[i][2]*((fs_bilinear+preal)*(fs_bilinear+preal)+pimg*pimg);
 
 		   dy = dy/temp;
 
-		   C1input[i+1][3] = C1output[i][2];
-		   C1input[i+1][2] = C1output[i][1];
-		   C1input[i+1][1] = dy;
+		   state->input[i+1][3] = state->output[i][2];
+		   state->input[i+1][2] = state->output[i][1];
+		   state->input[i+1][1] = dy;
 
-		   C1output[i][2] = C1output[i][1];
-		   C1output[i][1] = dy;
+		   state->output[i][2] = state->output[i][1];
+		   state->output[i][1] = dy;
        }
 
-	   dy = C1output[half_order_pole][1]*norm_gain;  /* don't forget the gain term */
+	   dy = state->output[half_order_pole][1]*norm_gain;  /* don't forget the gain term */
 	   c1filterout= dy/4.0;   /* signal path output is divided by 4 to give correct C1 filter gain */
 
      return (c1filterout);
@@ -531,11 +579,8 @@ double C1ChirpFilt(double x, double tdres,double cf, int n, double taumax, doubl
 /* -------------------------------------------------------------------------------------------- */
 /** Parallelpath C2 filter: same as the signal-path C1 filter with the OHC completely impaired */
 
-double C2ChirpFilt(double xx, double tdres,double cf, int n, double taumax, double fcohc)
+double C2ChirpFilt(double xx, double tdres,double cf, int n, double taumax, double fcohc, ChirpFiltState *state)
 {
-	static double C2gain_norm, C2initphase;
-    static double C2input[12][4];  static double C2output[12][4];
-
 	double ipw, ipb, rpa, pzero, rzero;
 
 	double sigma0,fs_bilinear,CF,norm_gain,phase,c2filterout;
@@ -575,34 +620,34 @@ double C2ChirpFilt(double xx, double tdres,double cf, int n, double taumax, doub
 
     p[7] = p[1]; p[8] = p[2]; p[9] = p[5]; p[10]= p[6];
 
-	   C2initphase = 0.0;
+	   state->initphase = 0.0;
        for (i=1;i<=half_order_pole;i++)
 	   {
            preal     = p[i*2-1].x;
 		   pimg      = p[i*2-1].y;
-	       C2initphase = C2initphase + atan(CF/(-rzero))-atan((CF-pimg)/(-preal))-atan((CF+pimg)/(-preal));
+	       state->initphase = state->initphase + atan(CF/(-rzero))-atan((CF-pimg)/(-preal))-atan((CF+pimg)/(-preal));
 	   };
 
-	/*===================== Initialize C2input & C2output =====================*/
+	/*===================== Initialize state->input & state->output =====================*/
 
       for (i=1;i<=(half_order_pole+1);i++)
       {
-		   C2input[i][3] = 0;
-		   C2input[i][2] = 0;
-		   C2input[i][1] = 0;
-		   C2output[i][3] = 0;
-		   C2output[i][2] = 0;
-		   C2output[i][1] = 0;
+		   state->input[i][3] = 0;
+		   state->input[i][2] = 0;
+		   state->input[i][1] = 0;
+		   state->output[i][3] = 0;
+		   state->output[i][2] = 0;
+		   state->output[i][1] = 0;
       }
 
     /*===================== normalize the gain =====================*/
 
-     C2gain_norm = 1.0;
+     state->gain_norm = 1.0;
      for (r=1; r<=order_of_pole; r++)
-		   C2gain_norm = C2gain_norm*(pow((CF - p[r].y),2) + p[r].x*p[r].x);
+		   state->gain_norm = state->gain_norm*(pow((CF - p[r].y),2) + p[r].x*p[r].x);
     };
 
-    norm_gain= sqrt(C2gain_norm)/pow(sqrt(CF*CF+rzero*rzero),order_of_zero);
+    norm_gain= sqrt(state->gain_norm)/pow(sqrt(CF*CF+rzero*rzero),order_of_zero);
 
 	p[1].x = -sigma0*fcohc;
 
@@ -629,7 +674,7 @@ double C2ChirpFilt(double xx, double tdres,double cf, int n, double taumax, doub
 	       phase = phase-atan((CF-pimg)/(-preal))-atan((CF+pimg)/(-preal));
 	};
 
-	rzero = -CF/tan((C2initphase-phase)/order_of_zero);
+	rzero = -CF/tan((state->initphase-phase)/order_of_zero);
 	if (rzero>0.0) {
 	     printf("The zeros are in the right-hand plane.\n");
 	     exit(-1);
@@ -638,9 +683,9 @@ double C2ChirpFilt(double xx, double tdres,double cf, int n, double taumax, doub
    /*%      time loop begins here                         */
    /*%==================================================  */
 
-       C2input[1][3]=C2input[1][2];
-	   C2input[1][2]=C2input[1][1];
-	   C2input[1][1]= xx;
+       state->input[1][3]=state->input[1][2];
+	   state->input[1][2]=state->input[1][1];
+	   state->input[1][1]= xx;
 
       for (i=1;i<=half_order_pole;i++)
       {
@@ -655,22 +700,22 @@ double C2ChirpFilt(double xx, double tdres,double cf, int n, double taumax, doub
 
            dy = dy-output[i][2]*((fs_bilinear+preal)*(fs_bilinear+preal)+pimg*pimg);*/
 
-	      dy = C2input[i][1]*(fs_bilinear-rzero) - 2*rzero*C2input[i][2] - (fs_bilinear+rzero)*C2input[i][3]
-                 +2*C2output[i][1]*(fs_bilinear*fs_bilinear-preal*preal-pimg*pimg)
-			     -C2output[i][2]*((fs_bilinear+preal)*(fs_bilinear+preal)+pimg*pimg);
+	      dy = state->input[i][1]*(fs_bilinear-rzero) - 2*rzero*state->input[i][2] - (fs_bilinear+rzero)*state->input[i][3]
+                 +2*state->output[i][1]*(fs_bilinear*fs_bilinear-preal*preal-pimg*pimg)
+			     -state->output[i][2]*((fs_bilinear+preal)*(fs_bilinear+preal)+pimg*pimg);
 
 		   dy = dy/temp;
 
-		   C2input[i+1][3] = C2output[i][2];
-		   C2input[i+1][2] = C2output[i][1];
-		   C2input[i+1][1] = dy;
+		   state->input[i+1][3] = state->output[i][2];
+		   state->input[i+1][2] = state->output[i][1];
+		   state->input[i+1][1] = dy;
 
-		   C2output[i][2] = C2output[i][1];
-		   C2output[i][1] = dy;
+		   state->output[i][2] = state->output[i][1];
+		   state->output[i][1] = dy;
 
        };
 
-	  dy = C2output[half_order_pole][1]*norm_gain;
+	  dy = state->output[half_order_pole][1]*norm_gain;
 	  c2filterout= dy/4.0;
 
 	  return (c2filterout);
@@ -679,38 +724,35 @@ double C2ChirpFilt(double xx, double tdres,double cf, int n, double taumax, doub
 /* -------------------------------------------------------------------------------------------- */
 /** Pass the signal through the Control path Third Order Nonlinear Gammatone Filter */
 
-double WbGammaTone(double x,double tdres,double centerfreq, int n, double tau,double gain,int order)
+double WbGammaTone(double x,double tdres,double centerfreq, int n, double tau,double gain,int order, WbGammaToneState *state)
 {
-  static double wbphase;
-  static COMPLEX wbgtf[4], wbgtfl[4];
-
   double delta_phase,dtmp,c1LP,c2LP,out;
   int i,j;
 
   if (n==0)
   {
-      wbphase = 0;
+      state->phase = 0;
       for(i=0; i<=order;i++)
       {
-            wbgtfl[i] = compmult(0,compexp(0));
-            wbgtf[i]  = compmult(0,compexp(0));
+            state->gtfl[i] = compmult(0,compexp(0));
+            state->gtf[i]  = compmult(0,compexp(0));
       }
   }
 
   delta_phase = -TWOPI*centerfreq*tdres;
-  wbphase += delta_phase;
+  state->phase += delta_phase;
 
   dtmp = tau*2.0/tdres;
   c1LP = (dtmp-1)/(dtmp+1);
   c2LP = 1.0/(dtmp+1);
-  wbgtf[0] = compmult(x,compexp(wbphase));                 /* FREQUENCY SHIFT */
+  state->gtf[0] = compmult(x,compexp(state->phase));                 /* FREQUENCY SHIFT */
 
   for(j = 1; j <= order; j++)                              /* IIR Bilinear transformation LPF */
-  wbgtf[j] = comp2sum(compmult(c2LP*gain,comp2sum(wbgtf[j-1],wbgtfl[j-1])),
-      compmult(c1LP,wbgtfl[j]));
-  out = REAL(compprod(compexp(-wbphase), wbgtf[order])); /* FREQ SHIFT BACK UP */
+  state->gtf[j] = comp2sum(compmult(c2LP*gain,comp2sum(state->gtf[j-1],state->gtfl[j-1])),
+      compmult(c1LP,state->gtfl[j]));
+  out = REAL(compprod(compexp(-state->phase), state->gtf[order])); /* FREQ SHIFT BACK UP */
 
-  for(i=0; i<=order;i++) wbgtfl[i] = wbgtf[i];
+  for(i=0; i<=order;i++) state->gtfl[i] = state->gtf[i];
   return(out);
 }
 
@@ -780,10 +822,8 @@ double Boltzman(double x, double asym, double s0, double s1, double x1)
 /* -------------------------------------------------------------------------------------------- */
 /* Get the output of the OHC Low Pass Filter in the Control path */
 
-double OhcLowPass(double x,double tdres,double Fc, int n,double gain,int order)
+double OhcLowPass(double x,double tdres,double Fc, int n,double gain,int order, LowPassState *state)
 {
-  static double ohc[4],ohcl[4];
-
   double c,c1LP,c2LP;
   int i,j;
 
@@ -791,8 +831,8 @@ double OhcLowPass(double x,double tdres,double Fc, int n,double gain,int order)
   {
       for(i=0; i<(order+1);i++)
       {
-          ohc[i] = 0;
-          ohcl[i] = 0;
+          state->y[i] = 0;
+          state->yl[i] = 0;
       }
   }
 
@@ -800,19 +840,17 @@ double OhcLowPass(double x,double tdres,double Fc, int n,double gain,int order)
   c1LP = ( c - TWOPI*Fc ) / ( c + TWOPI*Fc );
   c2LP = TWOPI*Fc / (TWOPI*Fc + c);
 
-  ohc[0] = x*gain;
+  state->y[0] = x*gain;
   for(i=0; i<order;i++)
-    ohc[i+1] = c1LP*ohcl[i+1] + c2LP*(ohc[i]+ohcl[i]);
-  for(j=0; j<=order;j++) ohcl[j] = ohc[j];
-  return(ohc[order]);
+    state->y[i+1] = c1LP*state->yl[i+1] + c2LP*(state->y[i]+state->yl[i]);
+  for(j=0; j<=order;j++) state->yl[j] = state->y[j];
+  return(state->y[order]);
 }
 /* -------------------------------------------------------------------------------------------- */
 /* Get the output of the IHC Low Pass Filter  */
 
-double IhcLowPass(double x,double tdres,double Fc, int n,double gain,int order)
+double IhcLowPass(double x,double tdres,double Fc, int n,double gain,int order, LowPassState *state)
 {
-  static double ihc[8],ihcl[8];
-
   double C,c1LP,c2LP;
   int i,j;
 
@@ -820,8 +858,8 @@ double IhcLowPass(double x,double tdres,double Fc, int n,double gain,int order)
   {
       for(i=0; i<(order+1);i++)
       {
-          ihc[i] = 0;
-          ihcl[i] = 0;
+          state->y[i] = 0;
+          state->yl[i] = 0;
       }
   }
 
@@ -829,11 +867,11 @@ double IhcLowPass(double x,double tdres,double Fc, int n,double gain,int order)
   c1LP = ( C - TWOPI*Fc ) / ( C + TWOPI*Fc );
   c2LP = TWOPI*Fc / (TWOPI*Fc + C);
 
-  ihc[0] = x*gain;
+  state->y[0] = x*gain;
   for(i=0; i<order;i++)
-    ihc[i+1] = c1LP*ihcl[i+1] + c2LP*(ihc[i]+ihcl[i]);
-  for(j=0; j<=order;j++) ihcl[j] = ihc[j];
-  return(ihc[order]);
+    state->y[i+1] = c1LP*state->yl[i+1] + c2LP*(state->y[i]+state->yl[i]);
+  for(j=0; j<=order;j++) state->yl[j] = state->y[j];
+  return(state->y[order]);
 }
 /* -------------------------------------------------------------------------------------------- */
 /* Get the output of the Control path using Nonlinear Function after OHC */
@@ -1,2 +1,5 @@
 void IHCAN(double *px, double cf, int nrep, double tdres, int totalstim,
 	   double cohc, double cihc, int species, double *ihcout);
+void MiddleEar(double *px, double tdres, int totalstim, int species, double *meout);
+void IHCANFromMiddleEar(const double *meout, double cf, int nrep, double tdres, int totalstim,
+	   double cohc, double cihc, int species, double *ihcout);
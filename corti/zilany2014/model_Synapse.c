@@ -70,12 +70,14 @@ The Oryginal Note
 
 #include "Python.h"
 #include "_zilany2014.h"
+#include "model_Synapse.h"
 
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 #include <math.h>      /* Added for MS Visual C++ compatability, by Ian Bruce, 1999 */
 #include <time.h>
+#include <stdint.h>
 /* #include <iostream.h> */
 
 #include "complex.hpp"
@@ -100,7 +102,7 @@ The Oryginal Note
    the immediate pool could be as low as negative, at this time there is an alert message
    print out and the concentration is set at saturated level  */
 /* --------------------------------------------------------------------------------------------*/
-double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep, double spont, double noiseType, double implnt, double sampFreq, double *synouttmp)
+double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep, double spont, const double *randNums, double implnt, double sampFreq, double *synouttmp, const double *taps, int ntaps, const PowerLawKernel *plk1, const PowerLawKernel *plk2)
 {
     /* Initalize Variables */
     int z, b;
@@ -115,10 +117,9 @@ double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep,
 
     double *sout1, *sout2, *synSampOut, *powerLawIn, *exponOut, *TmpSyn;
     double *m1, *m2, *m3, *m4, *m5;
+    double *plsum1, *plsum2;
 	double *n1, *n2, *n3;
 
-    double *randNums;
-
     double *sampIHC, *ihcDims;
 
     exponOut = (double*)calloc((long) ceil(totalstim*nrep),sizeof(double));
@@ -146,13 +147,11 @@ double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep,
     alpha1 = 2.5e-6*100e3; beta1 = 5e-4; I1 = 0;
     alpha2 = 1e-2*100e3; beta2 = 1e-1; I2 = 0;
     /*----------------------------------------------------------*/
-    /*------- Generating a random sequence ---------------------*/
+    /*------- Random sequence ----------------------------------*/
     /*----------------------------------------------------------*/
-     randNums = ffGn((int)ceil((totalstim*nrep+2*delaypoint)*tdres*sampFreq),
-		     1/sampFreq,
-		     0.9,
-		     noiseType,
-		     spont);
+    /* randNums holds ceil((totalstim*nrep+2*delaypoint)*tdres*sampFreq)
+       samples of fractional Gaussian noise generated by the caller, or
+       is NULL to run without noise */
 
     /*----------------------------------------------------------*/
     /*----- Double Exponential Adaptation ----------------------*/
@@ -233,21 +232,30 @@ double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep,
    /*----------------------------------------------------------*/
    /*------ Downsampling to sampFreq (Low) sampling rate ------*/
    /*----------------------------------------------------------*/
-	sampIHC = decimate(k, powerLawIn, resamp);
+    if (taps != NULL)
+        sampIHC = DecimateFIR(k, powerLawIn, resamp, taps, ntaps);
+    else
+        sampIHC = decimate(k, powerLawIn, resamp);
 
 
     free(powerLawIn); free(exponOut);
    /*----------------------------------------------------------*/
    /*----- Running Power-law Adaptation -----------------------*/
    /*----------------------------------------------------------*/
+    /* Running sums of the exponential terms, if the power-law kernels are given */
+    if (plk1 != NULL)
+    {
+        plsum1 = (double*)calloc(plk1->nterms,sizeof(double));
+        plsum2 = (double*)calloc(plk2->nterms,sizeof(double));
+    }
     k = 0;
     for (indx=0; indx<floor((totalstim*nrep+2*delaypoint)*tdres*sampFreq); indx++)
     {
-          sout1[k]  = __max( 0, sampIHC[indx] + randNums[indx]- alpha1*I1);
+          sout1[k]  = __max( 0, sampIHC[indx] + (randNums != NULL ? randNums[indx] : 0)- alpha1*I1);
           /*sout1[k]  = __max( 0, sampIHC[indx] - alpha1*I1); */   /* No fGn condition */
           sout2[k]  = __max( 0, sampIHC[indx] - alpha2*I2);
 
-         if (implnt==1)    /* ACTUAL Implementation */
+         if (implnt==1 && plk1 == NULL)    /* ACTUAL Implementation */
          {
               I1 = 0; I2 = 0;
               for (j=0; j<k+1; ++j)
@@ -257,6 +265,22 @@ double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep,
                    }
          } /* end of actual */
 
+         if (implnt==1 && plk1 != NULL)    /* ACTUAL Implementation, sum-of-exponentials kernels */
+         {
+              I1 = 0; I2 = 0;
+              for (j=0; j<plk1->nterms; ++j)
+                  {
+                      plsum1[j] = plsum1[j]*plk1->decays[j] + sout1[k];
+                      I1 += plk1->weights[j]*plsum1[j];
+                  }
+              for (j=0; j<plk2->nterms; ++j)
+                  {
+                      plsum2[j] = plsum2[j]*plk2->decays[j] + sout2[k];
+                      I2 += plk2->weights[j]*plsum2[j];
+                  }
+              I1 *= binwidth; I2 *= binwidth;
+         } /* end of actual, sum-of-exponentials */
+
          if (implnt==0)    /* APPROXIMATE Implementation */
          {
                 if (k==0)
@@ -307,6 +331,7 @@ double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep,
         k = k+1;
       }   /* end of all samples */
       free(sout1); free(sout2);
+      if (plk1 != NULL) { free(plsum1); free(plsum2); }
       free(m1); free(m2); free(m3); free(m4); free(m5); free(n1); free(n2); free(n3);
     /*----------------------------------------------------------*/
     /*----- Upsampling to original (High 100 kHz) sampling rate --------*/
@@ -323,11 +348,63 @@ double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep,
         synouttmp[i] = TmpSyn[i+delaypoint];
 
     free(synSampOut); free(TmpSyn);
-    free(randNums);
     free(sampIHC);
 
     return((long) ceil(totalstim*nrep));
 }
+/* ------------------------------------------------------------------------------------ */
+/* Zero-phase FIR low-pass filtering and decimation by q.  This is the native
+   counterpart of the `decimate' callback: it matches scipy.signal.filtfilt
+   (odd extension of 3*ntaps samples at both ends, initial conditions at
+   steady state) followed by keeping every q-th sample.  Only the kept
+   samples of the backward pass are computed.  The returned array holds
+   ceil(k/q) samples and has to be freed by the caller. */
+
+double *DecimateFIR(int k, double *signal, int q, const double *taps, int ntaps)
+{
+    int padlen, next, nout, n, m, i, j;
+    double *ext, *fwd, *out, acc;
+
+    padlen = __min(3*ntaps, k-1);
+    next   = k + 2*padlen;
+    nout   = (k + q - 1)/q;
+
+    ext = (double*)malloc(next*sizeof(double));
+    fwd = (double*)malloc(next*sizeof(double));
+    out = (double*)calloc(nout, sizeof(double));
+
+    /* Odd extension of the signal at both ends */
+    for (i=0; i<padlen; i++)
+        ext[i] = 2*signal[0] - signal[padlen-i];
+    for (i=0; i<k; i++)
+        ext[padlen+i] = signal[i];
+    for (i=0; i<padlen; i++)
+        ext[padlen+k+i] = 2*signal[k-1] - signal[k-2-i];
+
+    /* Forward pass; samples before the start are held at ext[0] */
+    for (n=0; n<next; n++)
+    {
+        acc = 0;
+        for (j=0; j<ntaps; j++)
+            acc += taps[j]*ext[__max(n-j, 0)];
+        fwd[n] = acc;
+    }
+
+    /* Backward pass, evaluated only at the samples that are kept;
+       samples past the end are held at fwd[next-1] */
+    for (m=0; m<nout; m++)
+    {
+        i = padlen + m*q;
+        acc = 0;
+        for (j=0; j<ntaps; j++)
+            acc += taps[j]*fwd[__min(i+j, next-1)];
+        out[m] = acc;
+    }
+
+    free(ext); free(fwd);
+    return(out);
+}
+
 /* ------------------------------------------------------------------------------------ */
 /* Pass the output of Synapse model through the Spike Generator */
 
@@ -405,3 +482,137 @@ int SpikeGenerator(double *synouttmp, double tdres, int totalstim, int nrep, dou
 	nspikes = Nout;  /* Number of spikes that occurred. */
 	return(nspikes);
 }
+
+
+/* ------------------------------------------------------------------------ */
+/* Batched spike generator with an internal PRNG                            */
+/* ------------------------------------------------------------------------ */
+
+/* splitmix64, used to expand a 64-bit seed into a xoshiro256** state */
+static uint64_t splitmix64(uint64_t *x)
+{
+    uint64_t z = (*x += 0x9E3779B97F4A7C15ULL);
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    return z ^ (z >> 31);
+}
+
+static uint64_t rotl(const uint64_t x, int k)
+{
+    return (x << k) | (x >> (64 - k));
+}
+
+/* xoshiro256** by D. Blackman and S. Vigna */
+static uint64_t xoshiro256ss(uint64_t *s)
+{
+    const uint64_t result = rotl(s[1] * 5, 7) * 9;
+    const uint64_t t = s[1] << 17;
+
+    s[2] ^= s[0];
+    s[3] ^= s[1];
+    s[1] ^= s[2];
+    s[0] ^= s[3];
+    s[2] ^= t;
+    s[3] = rotl(s[3], 45);
+
+    return result;
+}
+
+/* Uniform random number in the open interval (0,1), safe to take the log of */
+static double rand_open01(uint64_t *s)
+{
+    return ((double)(xoshiro256ss(s) >> 11) + 0.5) * (1.0/9007199254740992.0);
+}
+
+/* Spike train of one fiber, same algorithm as SpikeGenerator().  Spike times are written to sptime
+   (up to `capacity` of them) and/or counted in the bins of psth; returns the number of spikes. */
+static long SpikeTrain(const double *synouttmp, double tdres, int totalstim, int nrep, uint64_t *rng,
+                       float *sptime, long capacity, int64_t *psth, int nbins, double binwidth)
+{
+    double  c0,s0,c1,s1,dead;
+    long    k,Nout,deadtimeIndex,bin;
+    double  deadtimeRnd, endOfLastDeadtime, refracMult0, refracMult1, refracValue0, refracValue1;
+    double  Xsum, unitRateIntrvl, countTime, DT;
+
+    c0      = 0.5;
+    s0      = 0.001;
+    c1      = 0.5;
+    s1      = 0.0125;
+    dead    = 0.00075;
+
+    DT = totalstim * tdres * nrep;  /* Total duration of the rate function */
+    Nout = 0;
+
+    deadtimeIndex = (long) floor(dead/tdres);
+    deadtimeRnd = deadtimeIndex*tdres;
+
+    refracMult0 = 1 - tdres/s0;
+    refracMult1 = 1 - tdres/s1;
+
+    endOfLastDeadtime = __max(0,log(rand_open01(rng)) / synouttmp[0] + dead);
+    refracValue0 = c0*exp(endOfLastDeadtime/s0);
+    refracValue1 = c1*exp(endOfLastDeadtime/s1);
+    Xsum = synouttmp[0] * (-endOfLastDeadtime + c0*s0*(exp(endOfLastDeadtime/s0)-1) + c1*s1*(exp(endOfLastDeadtime/s1)-1));
+
+    unitRateIntrvl = -log(rand_open01(rng))/tdres;
+
+    countTime = tdres;
+    for (k=0; (k<totalstim*nrep) && (countTime<DT); ++k, countTime+=tdres, refracValue0*=refracMult0, refracValue1*=refracMult1)
+    {
+        if (synouttmp[k]>0)
+        {
+            Xsum += synouttmp[k]*(1 - refracValue0 - refracValue1);
+
+            if ( Xsum >= unitRateIntrvl )
+            {
+                if (sptime != NULL && Nout < capacity)
+                    sptime[Nout] = (float)countTime;
+                if (psth != NULL)
+                {
+                    bin = (long)(countTime/binwidth);
+                    psth[__min(bin, nbins-1)] += 1;
+                }
+                Nout = Nout+1;
+                unitRateIntrvl = -log(rand_open01(rng)) /tdres;
+                Xsum = 0;
+
+                k += deadtimeIndex;
+                countTime += deadtimeRnd;
+                refracValue0 = c0;
+                refracValue1 = c1;
+            }
+        }
+    }
+    return(Nout);
+}
+
+/* Spike trains of `nfibers` fibers driven by the same synapse output, fiber i using a xoshiro256** stream
+   seeded by seeds[i].  The spike times of all fibers are written one fiber after the other into sptime, as long
+   as they fit into `capacity`, and the spike count of every fiber into counts; either output can be NULL.  If psth
+   is not NULL, the spikes of all fibers are also counted in its `nbins` bins of `binwidth` seconds.  Returns the
+   total number of spikes, which is larger than `capacity` if sptime was too short; the same seeds then give the
+   same spikes in a longer buffer. */
+long SpikeGeneratorBatch(const double *synouttmp, double tdres, int totalstim, int nrep, int nfibers,
+                         const uint64_t *seeds, float *sptime, long capacity, int64_t *counts,
+                         int64_t *psth, int nbins, double binwidth)
+{
+    int i, j;
+    long nspikes, total;
+    uint64_t x, rng[4];
+
+    total = 0;
+    for (i=0; i<nfibers; ++i)
+    {
+        x = seeds[i];
+        for (j=0; j<4; ++j)
+            rng[j] = splitmix64(&x);
+
+        nspikes = SpikeTrain(synouttmp, tdres, totalstim, nrep, rng,
+                             sptime != NULL && total < capacity ? sptime + total : NULL,
+                             capacity - total, psth, nbins, binwidth);
+        if (counts != NULL)
+            counts[i] = nspikes;
+        total += nspikes;
+    }
+    return(total);
+}
@@ -1,2 +1,16 @@
-double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep, double spont, double noiseType, double implnt, double sampFreq, double *synouttmp);
+#include <stdint.h>
+
+/* Sum-of-exponentials expansion of a power-law kernel: binwidth/(t+beta) is
+   approximated by binwidth*sum(weights*decays^(t/binwidth)) */
+typedef struct {
+    int nterms;
+    const double *weights;
+    const double *decays;
+} PowerLawKernel;
+
+double Synapse(double *ihcout, double tdres, double cf, int totalstim, int nrep, double spont, const double *randNums, double implnt, double sampFreq, double *synouttmp, const double *taps, int ntaps, const PowerLawKernel *plk1, const PowerLawKernel *plk2);
+double *DecimateFIR(int k, double *signal, int q, const double *taps, int ntaps);
 int SpikeGenerator(double *synouttmp, double tdres, int totalstim, int nrep, double *sptime);
+long SpikeGeneratorBatch(const double *synouttmp, double tdres, int totalstim, int nrep, int nfibers,
+                         const uint64_t *seeds, float *sptime, long capacity, int64_t *counts,
+                         int64_t *psth, int nbins, double binwidth);
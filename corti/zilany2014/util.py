@@ -28,84 +28,204 @@ from __future__ import division, print_function, absolute_import
 
 __author__ = "Marek Rudnicki"
 
+from collections import OrderedDict
+
 import numpy as np
-from numpy.random import randn
-from scipy.signal import resample
 from numpy.fft import fft, ifft
-
-
-def ffGn(N, tdres, Hinput, noiseType, mu, sigma=1, random_debug=None):
-    assert (N > 0)
-    assert (tdres < 1)
-    assert (Hinput >= 0) and (Hinput <= 2)
-
-    # Here we change the meaning of `noiseType', if it's 0, then we
-    # return no noise at all.  If necessary, the seed can be set
-    # outside by calling np.radnom.seed().
-    if noiseType == 0:
-        return np.zeros(N)
-
-    # Downsampling No. of points to match with those of Scott jackson (tau 1e-1)
-    resamp = np.ceil(1e-1 / tdres)
-    nop = N
-    N = np.ceil(N / resamp) + 1
-    if N < 10:
-        N = 10
-
-    # Determine whether fGn or fBn should be produced.
-    if Hinput <= 1:
-        H = Hinput
-        fBn = 0
-    else:
-        H = Hinput - 1
-        fBn = 1
-
-    # Calculate the fGn.
-    if H == 0.5:
-        # If H=0.5, then fGn is equivalent to white Gaussian noise.
-        if random_debug is None:
-            y = randn(N)
+from scipy.signal import firwin, resample_poly
+
+
+class FFGN:
+    """Fractional Gaussian noise engine for the synapse model.
+
+    The spectral magnitude of the fGn is cached per (N, H).  The fGn is
+    generated at a very low rate (tau 1e-1) and upsampled with a
+    polyphase resampler; for the short low-rate signals of typical
+    stimuli the resampler is cached as a (N x N*resamp) matrix, so
+    upsampling all channels is a single matrix product.  Repeated calls
+    thus only draw random numbers, run one inverse FFT and one
+    upsampling.  Noise for many channels is generated in one
+    vectorized call.
+
+    """
+
+    # Largest resampling matrix (in elements) that is cached, and how
+    # many of them are kept (the most recently used)
+    MaxResamplerSize = 2 ** 22
+    MaxResamplers = 4
+
+    def __init__(self):
+        self._zmag = {}
+        self._taps = {}
+        self._resamplers = OrderedDict()
+
+    def zmag(self, N, H):
+        """Square root of the spectrum of the fGn autocovariance for N samples."""
+        key = (N, H)
+        if key not in self._zmag:
+            Nfft = int(2 ** np.ceil(np.log2(2 * (N - 1))))
+            NfftHalf = Nfft // 2
+
+            k = np.concatenate((np.arange(0, NfftHalf), np.arange(NfftHalf, 0, -1)))
+            Zmag = 0.5 * ((k + 1) ** (2 * H) - 2 * k ** (2 * H) + np.abs(k - 1) ** (2 * H))
+
+            Zmag = np.real(fft(Zmag))
+            assert np.all(Zmag >= 0)
+
+            self._zmag[key] = np.sqrt(Zmag)
+        return self._zmag[key]
+
+    def taps(self, resamp):
+        """Low-pass filter of the polyphase resampler for an upsampling factor of `resamp`."""
+        if resamp not in self._taps:
+            self._taps[resamp] = firwin(20 * resamp + 1, 1 / resamp, window=('kaiser', 5.0))
+        return self._taps[resamp]
+
+    def upsample(self, y, resamp):
+        """Polyphase upsampling of the rows of `y` by `resamp`."""
+        N = y.shape[-1]
+        if N * N * resamp > self.MaxResamplerSize:
+            return resample_poly(y, resamp, 1, axis=-1, window=self.taps(resamp))
+        key = (N, resamp)
+        if key not in self._resamplers:
+            # the resampler is linear: its matrix is the response to each unit impulse
+            self._resamplers[key] = resample_poly(np.eye(N), resamp, 1, axis=-1, window=self.taps(resamp))
+            while len(self._resamplers) > self.MaxResamplers:
+                self._resamplers.popitem(last=False)
+        self._resamplers.move_to_end(key)
+        return y @ self._resamplers[key]
+
+    def generate(self, N, tdres, Hinput, mu, count=None, rng=None, random_debug=None):
+        """Generate fractional Gaussian (or Brownian) noise.
+
+        N: number of samples per channel
+        tdres: time resolution of the noise (1/sampFreq)
+        Hinput: Hurst index; values above 1 give fBn with H = Hinput - 1
+        mu: spontaneous rate of the fiber(s) the noise is scaled for,
+            scalar or one value per channel
+        count: number of channels; None returns a single 1-d channel
+        rng: numpy Generator or RandomState, defaults to np.random;
+            or one of them per channel, so that the noise of a
+            channel does not depend on the channels it is batched with
+
+        return: noise with shape (N,) or (count, N)
+
+        """
+        assert (N > 0)
+        assert (tdres < 1)
+        assert (Hinput >= 0) and (Hinput <= 2)
+
+        rng = np.random if rng is None else rng
+        shape = (1 if count is None else count,)
+        if isinstance(rng, (list, tuple)):
+            assert len(rng) == shape[0], "one random generator per channel is needed"
+            normal = lambda n: np.stack([r.standard_normal(n) for r in rng])
         else:
-            y = random_debug
-    else:
-        # TODO: make variables persistant
-        Nfft = 2 ** np.ceil(np.log2(2 * (N - 1)))
-        NfftHalf = np.round(Nfft / 2)
-
-        k = np.concatenate((np.arange(0, NfftHalf), np.arange(NfftHalf, 0, -1)))
-        Zmag = 0.5 * ((k + 1) ** (2 * H) - 2 * k ** (2 * H) + np.abs(k - 1) ** (2 * H))
+            normal = lambda n: rng.standard_normal(shape + (n,))
 
-        Zmag = np.real(fft(Zmag))
-        assert np.all(Zmag >= 0)
+        # Downsampling No. of points to match with those of Scott jackson (tau 1e-1)
+        resamp = int(np.ceil(1e-1 / tdres))
+        nop = N
+        N = max(int(np.ceil(N / resamp)) + 1, 10)
 
-        Zmag = np.sqrt(Zmag)
+        # Determine whether fGn or fBn should be produced.
+        if Hinput <= 1:
+            H = Hinput
+            fBn = 0
+        else:
+            H = Hinput - 1
+            fBn = 1
 
-        if random_debug is None:
-            Z = Zmag * (randn(Nfft) + 1j * randn(Nfft))
+        # Calculate the fGn.
+        if H == 0.5:
+            # If H=0.5, then fGn is equivalent to white Gaussian noise.
+            y = normal(N) if random_debug is None else np.atleast_2d(random_debug)
         else:
-            Z = Zmag * (random_debug + 1j * random_debug)
+            Zmag = self.zmag(N, H)
+            Nfft = len(Zmag)
+
+            if random_debug is None:
+                Z = Zmag * (normal(Nfft) + 1j * normal(Nfft))
+            else:
+                Z = Zmag * (np.atleast_2d(random_debug) + 1j * np.atleast_2d(random_debug))
 
-        y = np.real(ifft(Z)) * np.sqrt(Nfft)
+            y = np.real(ifft(Z, axis=-1)) * np.sqrt(Nfft)
 
-        y = y[0:N]
+            y = y[:, 0:N]
 
         # Convert the fGn to fBn, if necessary.
         if fBn == 1:
-            y = np.cumsum(y)
+            y = np.cumsum(y, axis=-1)
 
         # Resampling to match with the AN model
-        y = resample(y, resamp * len(y))
+        y = self.upsample(y, resamp)[:, 0:nop]
 
-        if mu < 0.5:
-            sigma = 3
-        elif mu < 18:
-            sigma = 30  # 7 when added after powerlaw
-        else:
-            sigma = 200  # 40 when added after powerlaw
+        mu = np.reshape(mu, (-1, 1))
+        sigma = np.where(mu < 0.5, 3, np.where(mu < 18, 30, 200))  # 7 and 40 when added after powerlaw
 
         y = y * sigma
 
-        return y[0:nop]
+        return y[0] if count is None else y
+
+
+ffgn = FFGN()
+
+
+def ffGn(N, tdres, Hinput, noiseType, mu, sigma=1, random_debug=None):
+    # Here we change the meaning of `noiseType', if it's 0, then we
+    # return no noise at all.  If necessary, the seed can be set
+    # outside by calling np.radnom.seed().
+    if noiseType == 0:
+        return np.zeros(N)
+
+    return ffgn.generate(N, tdres, Hinput, mu, random_debug=random_debug)
+
+
+_powerlaw_kernels = {}
+
+
+def powerlaw_kernel(beta, binwidth, n, tol):
+    """Sum-of-exponentials expansion of the power-law adaptation kernel.
+
+    The 'actual' power law of the synapse convolves its output with
+    binwidth / (t + beta).  Writing 1 / (t + beta) as the integral of
+    exp(u - exp(u) * (t + beta)) over u and discretizing it with the
+    trapezoidal rule gives
+
+        1 / (t + beta) ~= sum(weights * exp(-rates * t))
+
+    so the convolution can be run as one first-order recursion per
+    term.  The truncation range and step are chosen so that the
+    relative error of the kernel stays below `tol` for every lag of
+    n samples; it is checked and the step refined until it does.
+    Since the synapse output is non-negative, the power-law sums have
+    the same relative error bound.  Kernels are cached per argument.
+
+    beta: time constant of the power law in s
+    binwidth: sampling period in s
+    n: number of samples (longest lag + 1)
+    tol: bound on the relative error of the kernel
+
+    return: (weights, decays) with decays = exp(-rates * binwidth)
+
+    """
+    key = (beta, binwidth, n, tol)
+    if key not in _powerlaw_kernels:
+        t = np.arange(n) * binwidth
+        u_min = np.log(tol / 2 / (t[-1] + beta))  # truncation of the slowest terms
+        u_max = np.log(np.log(2 / tol) / beta)    # truncation of the fastest terms
+        h = np.pi ** 2 / np.log(4 / tol)
+        while True:
+            rates = np.exp(np.arange(u_min, u_max + h, h))
+            weights = h * rates * np.exp(-rates * beta)
+            approx = np.zeros(n)
+            for w, r in zip(weights, rates):
+                approx += w * np.exp(-r * t)
+            if np.max(np.abs(approx * (t + beta) - 1)) <= tol:
+                break
+            h /= 1.25
+        _powerlaw_kernels[key] = (weights, np.exp(-rates * binwidth))
+    return _powerlaw_kernels[key]
 
 
 def calc_cfs(cf, species):
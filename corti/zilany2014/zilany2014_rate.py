@@ -25,6 +25,7 @@ import pandas as pd
 
 from . import _zilany2014
 from .util import calc_cfs
+from corti.cache import ArrayCache, cached
 
 
 def run_zilany2014_rate(
@@ -36,11 +37,16 @@ def run_zilany2014_rate(
         cohc=1,
         cihc=1,
         powerlaw='approximate',
-        ffGn=False
+        ffGn=False,
+        cache=None
 ):
     """Run the inner ear model by [Zilany2014]_.  Return mean firing rate
     of the auditory nerve fibers.
 
+    The IHC receptor potentials and, without ffGn, the synapse outputs
+    are looked up in (and added to) `cache`, an ArrayCache or the
+    directory of one, if it is given.
+
 
     Notes
     -----
@@ -65,6 +71,9 @@ def run_zilany2014_rate(
         anf_types = [anf_types]
 
     cfs = calc_cfs(cf, species)
+    if isinstance(cache, str):
+        cache = ArrayCache(cache)
+    sound_key = ArrayCache.key(np.asarray(sound, dtype=float)) if cache is not None else None
 
     channel_args = [
         {
@@ -77,6 +86,8 @@ def run_zilany2014_rate(
             'powerlaw': powerlaw,
             'species': species,
             'ffGn': ffGn,
+            'cache': cache,
+            'sound_key': sound_key,
         }
         for cf in cfs
     ]
@@ -99,8 +110,6 @@ def run_zilany2014_rate(
         columns=columns
     )
 
-    np.fft.fftpack._fft_cache = {}
-
     return rates
 
 
@@ -114,30 +123,32 @@ def _run_channel(args):
     anf_types = args['anf_types']
     species = args['species']
     ffGn = args['ffGn']
+    cache = args['cache']
+    ihc_key = ('zilany2014.ihc', args['sound_key'], float(cf), float(fs), species, float(cohc), float(cihc))
 
     ### Run BM, IHC
-    vihc = _zilany2014.run_ihc(
+    vihc = cached(cache, lambda: _zilany2014.run_ihc(
         signal=signal,
         cf=cf,
         fs=fs,
         species=species,
         cohc=float(cohc),
         cihc=float(cihc)
-    )
+    ), *ihc_key)
 
     duration = len(vihc) / fs
 
     rates = []
     for anf_type in anf_types:
-        ### Run synapse
-        synout = _zilany2014.run_synapse(
+        ### Run synapse; with ffGn, the noise is drawn anew and the output is not cached
+        synout = cached(None if ffGn else cache, lambda: _zilany2014.run_synapse(
             fs=fs,
             vihc=vihc,
             cf=cf,
             anf_type=anf_type,
             powerlaw=powerlaw,
             ffGn=ffGn
-        )
+        ), *ihc_key + ('zilany2014.synapse', anf_type, powerlaw, 1e-6, None))
 
         rates.append({
             'rate': synout / (1 + 0.75e-3 * synout),
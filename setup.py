@@ -46,7 +46,8 @@ setup(name='corti',
           'PyYAML > 3.10',
           'pandas',
           'cython',
-          'pypet', 'attrs'
+          'pypet', 'attrs',
+          'tables'
       ],
       tests_require=[
           'pytest',
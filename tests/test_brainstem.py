@@ -0,0 +1,170 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from scipy.signal import resample_poly
+
+from corti.base import brain_consts as b, periph_consts as p
+from corti.brainstem import CentralAuditoryResponse, StreamingCentralAuditoryResponse, simulate_brainstem
+from corti.convolution import AlphaFilter, FFTConvolver
+from corti.periphery_configuration import PeripheryOutput
+
+FS = 100e3
+
+
+def reference(response, model):
+    """The CN and IC responses by np.convolve, one CF at a time"""
+    def shift(delay):
+        return int(round(delay * FS))
+
+    def alpha(tau):
+        return response.time / tau ** 2 * np.exp(-response.time / tau)
+
+    def inhibition(s, tau, delay):
+        return np.pad(s * alpha(tau), (shift(delay), 0), 'constant')[:-shift(delay)]
+
+    def ic(rcn, a, s, d, tin, tex):
+        return a * np.convolve(alpha(tex), rcn) - np.convolve(inhibition(s, tin, d), np.roll(rcn, shift(d)))
+
+    n = len(response.time)
+    cn, ics = [], []
+    for x in response.anr.T:
+        rcn = (1.5 * np.convolve(alpha(0.5e-3), x) - np.convolve(inhibition(0.6, 2e-3, 1e-3), np.roll(x, shift(1e-3))))
+        rcn *= (1.5 * 0.15e-6) / 0.0036
+        if model == 'NELSON_CARNEY_2004':
+            ric = ic(rcn, 1, 2, 0.7e-3, 5e-3, 0.7e-3)
+        else:
+            ric = (ic(.5 * rcn, 1, 2, 0.7e-3, 5e-3, 0.7e-3) + ic(.25 * rcn, 0.6, 2, 0.7e-3, 5e-3, 2e-3) +
+                   ic(.25 * rcn, 1, 2, 0.7e-3, 5e-3, 0.7e-3))
+        cn.append(rcn[:n])
+        ics.append(ric[:n] * (2 * 0.15e-6) / 0.0033)
+    return np.array(cn), np.array(ics)
+
+
+def periphery():
+    return PeripheryOutput(output={p.CenterFrequency: np.array([8000., 4000., 1000., 150., 125.])},
+                           conf=SimpleNamespace(Fs=FS, analysisFs=FS, pypet=True))
+
+
+@pytest.mark.parametrize("backend", ['fft', 'iir'])
+@pytest.mark.parametrize("model", ['NELSON_CARNEY_2004', 'CARNEY_2015'])
+def test_convolutions_match_np_convolve(model, backend):
+    rng = np.random.RandomState(0)
+    anr = rng.rand(600, 5) * 100
+    response = CentralAuditoryResponse(periphery(), anr, model, backend=backend)
+    output = response._simulate()
+    cn, ic = reference(response, model)
+    np.testing.assert_allclose(output[b.CNPopulation], cn, atol=1e-12 * np.abs(cn).max())
+    np.testing.assert_allclose(output[b.ICPopulation], ic, atol=1e-12 * np.abs(ic).max())
+    np.testing.assert_allclose(output[b.Wave5_IC], ic[:3].sum(axis=0), atol=1e-12 * np.abs(ic).max())
+
+
+def test_compiled_kernels_are_reused_across_levels():
+    rng = np.random.RandomState(4)
+    first = CentralAuditoryResponse(periphery(), rng.rand(600, 5) * 100, 'CARNEY_2015')
+    first._simulate()
+    spectra = dict(first.convolver._spectra)
+    second = CentralAuditoryResponse(periphery(), rng.rand(600, 5) * 300, 'CARNEY_2015')
+    output = second._simulate()
+    assert second.convolver is first.convolver
+    assert second.convolver._spectra.keys() == spectra.keys()
+    assert all(second.convolver._spectra[key] is spectrum for key, spectrum in spectra.items())
+    # the composite kernel of the IC paths gives the sum of the paths simulated one at a time
+    rcn, tail = second._cn(second.anr)
+    wrapped = tail[len(tail) - second._shift(second.ICInhibitionDelay):]
+    paths = sum(second._stage(rcn, wrapped, (path,), second.ICInhibitionDelay)
+                for path in second._ic_paths(second.brainstemType))
+    expected = paths * second.ICScale * second.kernelScale
+    np.testing.assert_allclose(output[b.ICPopulation], expected.T, atol=1e-12 * np.abs(expected).max())
+
+
+def test_tail_is_the_end_of_the_full_convolution():
+    rng = np.random.RandomState(1)
+    x, kernel = rng.rand(50, 3), rng.rand(50)
+    np.testing.assert_allclose(FFTConvolver.tail(x, kernel, 7),
+                               np.array([np.convolve(kernel, col)[-7:] for col in x.T]).T)
+
+
+def test_alpha_filter_impulse_response():
+    dt, tau, delay = 1e-5, 5e-4, 3
+    t = (np.arange(200) - delay) * dt
+    kernel = np.where(t >= 0, 2 * t / tau ** 2 * np.exp(-t / tau), 0)
+    impulse = np.zeros((200, 1))
+    impulse[0] = 1
+    filt = AlphaFilter(tau, dt, gain=2, delay=delay)
+    np.testing.assert_allclose(np.concatenate((filt(impulse[:77]), filt(impulse[77:])))[:, 0], kernel, atol=1e-9)
+
+
+def test_streaming_blocks_match_one_block():
+    rng = np.random.RandomState(2)
+    anr = rng.rand(900, 5) * 100
+    whole = StreamingCentralAuditoryResponse(periphery(), 'CARNEY_2015').process(anr)
+    streaming = StreamingCentralAuditoryResponse(periphery(), 'CARNEY_2015')
+    blocks = [streaming.process(block) for block in np.split(anr, [250, 251, 700])]
+    for key in (b.Wave5_IC, b.Wave3_CN):
+        np.testing.assert_allclose(np.concatenate([block[key] for block in blocks]), whole[key], rtol=1e-10,
+                                   atol=1e-12 * np.abs(whole[key]).max())
+
+
+def test_streaming_blocks_match_the_iir_backend():
+    rng = np.random.RandomState(6)
+    # silence at the end of the stimulus: the batch model wraps (almost only) zeros to the front
+    anr = np.zeros((3000, 5))
+    anr[:600] = rng.rand(600, 5) * 100
+    batch = CentralAuditoryResponse(periphery(), anr, 'CARNEY_2015', backend='iir')._simulate()
+    streaming = StreamingCentralAuditoryResponse(periphery(), 'CARNEY_2015', length=len(anr))
+    blocks = [streaming.process(block) for block in np.split(anr, [400, 1700])]
+    for key in (b.CNPopulation, b.ICPopulation):
+        streamed = np.concatenate([block[key] for block in blocks], axis=1)
+        np.testing.assert_allclose(streamed, batch[key], atol=1e-9 * np.abs(batch[key]).max())
+    with pytest.raises(NotImplementedError):
+        streaming.run()
+    with pytest.raises(NotImplementedError):
+        streaming.wave5_sweep([.5, .25, .25])
+
+
+@pytest.mark.parametrize("backend", ['fft', 'iir'])
+def test_waves_only_match_the_summed_populations(backend):
+    rng = np.random.RandomState(3)
+    anr = rng.rand(600, 5) * 100
+    full = CentralAuditoryResponse(periphery(), anr, 'CARNEY_2015', backend=backend)._simulate()
+    waves = CentralAuditoryResponse(periphery(), anr, 'CARNEY_2015', backend=backend, wavesOnly=True)._simulate()
+    assert b.ICPopulation not in waves
+    for key in (b.Wave1_AN, b.Wave3_CN, b.Wave5_IC):
+        np.testing.assert_allclose(waves[key], full[key], atol=1e-12 * np.abs(full[key]).max())
+
+
+def test_wave5_sweep_matches_weighted_simulations():
+    rng = np.random.RandomState(4)
+    response = CentralAuditoryResponse(periphery(), rng.rand(600, 5) * 100, 'CARNEY_2015')
+    weights = np.array([[.5, .25, .25], [1, 0, 0], [.2, .7, .1]])
+    sweep = response.wave5_sweep(weights)
+    for w, wave in zip(weights, sweep):
+        expected = response._simulate(tuple(w))[b.Wave5_IC]
+        np.testing.assert_allclose(wave, expected, atol=1e-12 * np.abs(expected).max())
+
+
+def test_levels_in_worker_processes_match_serial():
+    rng = np.random.RandomState(5)
+    levels = [(periphery(), rng.rand(600, 5) * 100, 'CARNEY_2015') for _ in range(5)]
+    serial = simulate_brainstem(levels)
+    parallel = simulate_brainstem(levels, jobs=2)
+    for expected, output in zip(serial, parallel):
+        np.testing.assert_array_equal(output[b.Wave5_IC], expected[b.Wave5_IC])
+        np.testing.assert_array_equal(output[b.ICPopulation], expected[b.ICPopulation])
+    # any job count runs: 0 as one process, negative counts on every core
+    for jobs in (0, -2):
+        for expected, output in zip(serial, simulate_brainstem(levels[:2], jobs=jobs)):
+            np.testing.assert_array_equal(output[b.Wave5_IC], expected[b.Wave5_IC])
+
+
+def test_decimated_responses_match_the_model_rate():
+    t = np.arange(3000) / FS
+    anr = 100 + 300 * np.exp(-((t[:, np.newaxis] - 0.01) / 1e-3) ** 2) * np.array([1, .8, .6, .5, .4])
+    full = CentralAuditoryResponse(periphery(), anr, 'CARNEY_2015')._simulate()
+    an = periphery()
+    an.conf.analysisFs = FS / 5
+    decimated = CentralAuditoryResponse(an, resample_poly(anr, 1, 5, axis=0), 'CARNEY_2015')._simulate()
+    for key in (b.Wave1_AN, b.Wave3_CN, b.Wave5_IC):
+        expected = full[key][::5]
+        np.testing.assert_allclose(decimated[key][50:-50], expected[50:-50], atol=1e-2 * np.abs(expected).max())
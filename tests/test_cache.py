@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pytest
+
+from corti.auditory_nerve_response import AuditoryNerveResponse
+from corti.base import brain_consts as b, stim_consts as sc, PeripheryType
+from corti.brainstem import CentralAuditoryResponse, iter_brainstem
+from corti.cache import ArrayCache, StageCache
+from corti.periphery_configuration import PeripheryConfiguration, SpikeTrains
+
+
+def test_key_depends_on_content_and_parameters():
+    a = np.arange(10.)
+    assert ArrayCache.key(a, 1000.) == ArrayCache.key(a.copy(), 1000.)
+    assert ArrayCache.key(a, 1000.) != ArrayCache.key(a, 2000.)
+    assert ArrayCache.key(a, 1000.) != ArrayCache.key(a.astype(np.float32), 1000.)
+    assert ArrayCache.key(a, 1000.) != ArrayCache.key(a.reshape(2, 5), 1000.)
+
+
+def test_cached_arrays_are_memory_mapped(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    calls = []
+    compute = lambda: calls.append(1) or np.arange(5.)
+    np.testing.assert_array_equal(cache.fetch("k" * 40, compute), np.arange(5.))
+    cached = cache.fetch("k" * 40, compute)
+    assert len(calls) == 1
+    assert isinstance(cached, np.memmap) and not cached.flags.writeable
+    np.testing.assert_array_equal(cached, np.arange(5.))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry = np.zeros(1000)
+    cache = ArrayCache(str(tmp_path), maxBytes=int(2.5 * entry.nbytes))
+    for i, key in enumerate(["a" * 40, "b" * 40]):
+        cache.put(key, entry)
+        os.utime(cache._path(key), (i, i))
+    cache.get("a" * 40)  # a is now more recently used than b
+    cache.put("c" * 40, entry)
+    assert cache.get("b" * 40) is None
+    assert cache.get("a" * 40) is not None and cache.get("c" * 40) is not None
+
+
+def test_stage_outputs_round_trip(tmp_path):
+    cache = StageCache(ArrayCache(str(tmp_path)))
+    trains = SpikeTrains(times=np.array([.1, .2], np.float32), offsets=np.array([0, 1, 2]), fiberType=np.array([0, 1]),
+                         cf=np.array([1000., 500.]))
+    output = {'rates': np.arange(6.).reshape(3, 2), 'level': 60, 'model': 'CARNEY_2015', 'spikes': trains,
+              'missing': None}
+    key = cache.key('periphery', np.arange(3.), 'ZILANY')
+    assert cache.get(key) is None
+    cache.put(key, output)
+    cached = cache.get(key)
+    np.testing.assert_array_equal(cached['rates'], output['rates'])
+    assert cached['level'] == 60 and cached['model'] == 'CARNEY_2015' and cached['missing'] is None
+    np.testing.assert_array_equal(cached['spikes'].times, trains.times)
+    assert cached['spikes'].fiberTypes == trains.fiberTypes
+    # an output with an evicted entry is a miss
+    os.remove(cache.cache._path(cache.cache.key(key, 'rates')))
+    assert cache.get(key) is None
+
+
+def test_changing_the_brainstem_only_simulates_the_brainstem(tmp_path, monkeypatch):
+    pytest.importorskip("corti.zilany2014._zilany2014")
+    import corti.periphery
+    sound = np.zeros((1, 2000))
+    sound[0, 200:300] = 0.1
+    conf = PeripheryConfiguration(dataFolder=str(tmp_path), storeFlag='', stimuli={sc.Levels: [80], sc.Stimulus: sound},
+                                  modelType=PeripheryType.ZILANY, degradation='mild', pypet=True,
+                                  cache=str(tmp_path / "cache"))
+    conf.NumberOfSections = 4
+
+    def pipeline(modelType):
+        periphery = corti.periphery.Periphery(conf).run()[0]
+        anr = AuditoryNerveResponse(periphery, 'mild').cf_weighted_an_response()
+        return periphery, anr, next(iter_brainstem([(periphery, anr, modelType)], waves_only=True))
+
+    periphery, anr, _ = pipeline('NELSON_CARNEY_2004')
+
+    def fail(*args, **kwargs):
+        raise AssertionError("simulated again")
+
+    monkeypatch.setattr(corti.periphery, "run_zilany2014", fail)
+    monkeypatch.setattr(AuditoryNerveResponse, "_sum", fail)
+    cachedPeriphery, cachedAnr, brain = pipeline('CARNEY_2015')
+    np.testing.assert_array_equal(cachedAnr, anr)
+    expected = CentralAuditoryResponse(periphery, anr, 'CARNEY_2015', wavesOnly=True)._simulate()
+    np.testing.assert_array_equal(brain[b.Wave5_IC], expected[b.Wave5_IC])
+    # the brainstem is now cached too
+    monkeypatch.setattr(CentralAuditoryResponse, "_simulate", fail)
+    np.testing.assert_array_equal(pipeline('CARNEY_2015')[2][b.Wave5_IC], expected[b.Wave5_IC])
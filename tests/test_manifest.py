@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from corti.base import runtime_consts, stim_consts as sc, PeripheryType
+from corti.manifest import RunManifest
+from corti.periphery_configuration import PeripheryConfiguration
+from corti.result_store import ResultStore
+
+
+def configuration(tmp_path) -> PeripheryConfiguration:
+    stimuli = {sc.StimulusType: sc.Click, sc.Levels: [60.0, 80.0], sc.PrestimTime: 0.001, sc.StimTime: 8e-5,
+               sc.Stimulus: np.random.RandomState(0).rand(2, 2000)}
+    return PeripheryConfiguration(dataFolder=str(tmp_path), storeFlag='cd', stimuli=stimuli,
+                                  modelType=PeripheryType.VERHULST, degradation='mild', pypet=False,
+                                  analysisFs=20e3, store='hdf5', storeDtypes={'ic_pop_resp': np.float32})
+
+
+def test_manifest_round_trip(tmp_path):
+    conf = configuration(tmp_path)
+    RunManifest.for_configuration(conf).save(str(tmp_path), conf.stimulus)
+    text = (tmp_path / runtime_consts.RunManifestName).read_text()
+    # plain YAML of scalars: no Python tags, and not the waveform
+    assert "!!python" not in text and len(text) < 2000
+
+    manifest = RunManifest.load(str(tmp_path))
+    assert manifest.modelType == PeripheryType.VERHULST
+    assert manifest.stimulusLevels == [60.0, 80.0] and manifest.analysisFs == 20e3
+    assert manifest.stimulusParameters == {sc.StimulusType: sc.Click, sc.PrestimTime: 0.001, sc.StimTime: 8e-5}
+    assert manifest.modelParameters['nonlinearType'] == conf.nonlinearType
+    np.testing.assert_array_equal(manifest.stimulus(str(tmp_path)), conf.stimulus)
+    # it stands in for the configuration where results are read back
+    store = ResultStore.for_run(manifest, str(tmp_path))
+    assert store.levels == [60.0, 80.0] and store.dtypes == {'ic_pop_resp': '<f4'}
+
+
+def test_a_changed_stimulus_does_not_match_its_hash(tmp_path):
+    conf = configuration(tmp_path)
+    manifest = RunManifest.for_configuration(conf)
+    manifest.save(str(tmp_path), conf.stimulus)
+    np.save(str(tmp_path / manifest.stimulusFile), conf.stimulus[::-1])
+    with pytest.raises(ValueError):
+        manifest.stimulus(str(tmp_path))
@@ -0,0 +1,29 @@
+import numpy as np
+
+from corti.periphery_configuration import SpikeTrains
+from corti.result_store import ResultStore
+
+
+def test_levels_round_trip_and_slice(tmp_path):
+    store = ResultStore(str(tmp_path / "results.h5"), levels=[40, 60], dtypes={'ic': np.float32})
+    rng = np.random.RandomState(0)
+    ic = {level: rng.rand(300, 20) for level in store.levels}
+    trains = SpikeTrains(times=np.array([.1, .2, .3], np.float32), offsets=np.array([0, 1, 3]),
+                         fiberType=np.array([0, 2]), cf=np.array([1000., 1000.]), fiberTypes=('hsr', 'msr', 'lsr'))
+    for level in (60, 40):
+        store.write('brainstem', level, {'model': 'CARNEY_2015', 'ic': ic[level], 'wave': ic[level].sum(axis=1),
+                                         'level': level})
+    store.write('periphery', 60, {'spikes': trains})
+
+    np.testing.assert_array_equal(store.read('brainstem', 'ic', 60, slice(10, 20), 3),
+                                  ic[60][10:20, 3].astype(np.float32))
+    np.testing.assert_allclose(store.read('brainstem', 'wave', 40), ic[40].sum(axis=1))
+    np.testing.assert_array_equal(store.read('brainstem', 'level'), [40, 60])
+    assert store.read('brainstem', 'ic').dtype == np.float32
+    stage = store.stage('brainstem', 40)
+    assert stage['model'] == 'CARNEY_2015'
+    np.testing.assert_array_equal(stage['ic'], ic[40].astype(np.float32))
+    spikes = SpikeTrains.from_dict(store.stage('periphery', 60), 'spikes')
+    np.testing.assert_array_equal(spikes.times, trains.times)
+    np.testing.assert_array_equal(spikes.fiberType, trains.fiberType)
+    assert store.has_stage('brainstem') and not store.has_stage('auditory_nerve')
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from corti.auditory_nerve_response import AuditoryNerveResponse
+from corti.base import an_consts as a, brain_consts as b, periph_consts as p, PeripheryType
+from corti.brainstem import CentralAuditoryResponse
+from corti.periphery_configuration import PeripheryOutput
+from corti.sweep import SuperpositionSweep
+
+
+def test_superposition_matches_the_pipeline():
+    rng = np.random.RandomState(0)
+    periphery = PeripheryOutput(output={p.CenterFrequency: np.array([8000., 4000., 1000., 150., 125.]),
+                                        p.AuditoryNerveFiberHighSpont: rng.rand(500, 5) * 300,
+                                        p.AuditoryNerveFiberMediumSpont: rng.rand(500, 5) * 100,
+                                        p.AuditoryNerveFiberLowSpont: rng.rand(500, 5) * 10},
+                                conf=SimpleNamespace(Fs=100e3, analysisFs=100e3, pypet=True, memmap=False,
+                                                     modelType=PeripheryType.ZILANY))
+    sweep = SuperpositionSweep(periphery)
+    weightings = sweep.weightings()
+    degradations = ['none', 'mild', 'ls-severe']
+    waves = sweep.waves(degradations, [weightings['cf_weighted'], weightings['unweighted']])
+    for modelType in sweep.modelTypes:
+        for j, degradation in enumerate(degradations):
+            an = AuditoryNerveResponse(periphery, degradation)
+            for i, anr in enumerate((an.cf_weighted_an_response(), an.unweighted_an_response())):
+                expected = CentralAuditoryResponse(periphery, anr, modelType, wavesOnly=True)._simulate()
+                for wave in (b.Wave1_AN, b.Wave3_CN, b.Wave5_IC):
+                    np.testing.assert_allclose(waves[modelType][wave][i, j], expected[wave],
+                                               atol=1e-10 * np.abs(expected[wave]).max())
+
+
+def test_batched_profiles_match_single_responses():
+    rng = np.random.RandomState(1)
+    periphery = PeripheryOutput(output={p.CenterFrequency: np.array([8000., 4000., 1000., 150.]),
+                                        p.AuditoryNerveFiberHighSpont: rng.rand(50, 4) * 300,
+                                        p.AuditoryNerveFiberMediumSpont: rng.rand(50, 4) * 100,
+                                        p.AuditoryNerveFiberLowSpont: rng.rand(50, 4) * 10},
+                                conf=SimpleNamespace(pypet=True, modelType=PeripheryType.ZILANY, Fs=100e3,
+                                                     analysisFs=100e3, memmap=False))
+    an = AuditoryNerveResponse(periphery, None)
+    perFiber = rng.rand(3, 4)
+    profiles = ['ls-moderate', 0.5, (1, .8, .6), np.array([[1, .9, .8, .7]]), perFiber]
+    batched = an.batched_an_response(profiles)
+    weights = an._map_cf_dependent_distribution(an.TotalFiberPerIHC)
+    expected = [an.sum_fibers(*weights, an.parse_degradation('ls-moderate')),
+                an.sum_fibers(*weights, (0.5, 0.5, 0.5)),
+                an.sum_fibers(*weights, (1, .8, .6)),
+                an.sum_fibers(*weights, ([1, .9, .8, .7],) * 3),
+                an.sum_fibers(*weights, perFiber)]
+    np.testing.assert_allclose(batched, expected, rtol=1e-12)
+    # a 1-D profile is a (low, medium, high) triple, even with as many CFs; anything else is ambiguous
+    with pytest.raises(ValueError):
+        an.batched_an_response([np.array([1, .9, .8, .7])])
+    np.testing.assert_allclose(an.batched_an_response(['severe'], cf_weighting=False)[0],
+                               AuditoryNerveResponse(periphery, 'severe').unweighted_an_response(), rtol=1e-12)
+
+
+def test_saved_components_are_the_weighted_fibers(tmp_path):
+    rng = np.random.RandomState(2)
+    periphery = PeripheryOutput(output={p.CenterFrequency: np.array([8000., 4000., 1000.]),
+                                        p.AuditoryNerveFiberHighSpont: rng.rand(40, 3) * 300,
+                                        p.AuditoryNerveFiberMediumSpont: rng.rand(40, 3) * 100,
+                                        p.AuditoryNerveFiberLowSpont: rng.rand(40, 3) * 10,
+                                        p.StimulusLevel: 60},
+                                conf=SimpleNamespace(pypet=False, modelType=PeripheryType.ZILANY, analysisFs=100e3,
+                                                     store='npz', memmap=True),
+                                outputFolder=str(tmp_path))
+    an = AuditoryNerveResponse(periphery, 'mild')
+    anr = an.cf_weighted_an_response()
+    assert isinstance(anr, np.memmap) and not anr.flags.writeable
+    saved = np.load(str(next(tmp_path.glob("*.npz"))))
+    np.testing.assert_array_equal(saved[a.SumANR], anr)
+    np.testing.assert_array_equal(saved[a.LowSR], an.lowSR)
+    np.testing.assert_array_equal(saved[a.HighSR], an.highSR)
+    np.testing.assert_allclose((an.lowSR + an.medSR + an.highSR) * an.scale(), anr, rtol=1e-12)
+    # the next response does not overwrite the mapped file of this one
+    before = np.array(anr)
+    an.unweighted_an_response()
+    np.testing.assert_array_equal(anr, before)
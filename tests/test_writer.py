@@ -0,0 +1,32 @@
+import threading
+
+import pytest
+
+from corti import writer as background
+from corti.writer import BackgroundWriter
+
+
+def test_writes_run_in_order_and_errors_surface_on_flush():
+    written, release = [], threading.Event()
+    writer = BackgroundWriter(threads=1, maxPending=1)
+    writer.submit(release.wait)
+    writer.submit(written.append, 0)
+    # the queue is full: the next submit waits until the writer moves on
+    threading.Timer(0.2, release.set).start()
+    writer.submit(written.append, 1)
+    assert release.is_set()
+    writer.submit(written.append, 2)
+    writer.flush()
+    assert written == [0, 1, 2]
+
+    def fail():
+        raise IOError("disk full")
+
+    writer.submit(fail)
+    with pytest.raises(IOError):
+        writer.close()
+    assert not any(thread.is_alive() for thread in writer.threads)
+
+
+def test_worker_pools_are_not_forked_from_the_writer():
+    assert background.process_context().get_start_method() in ('forkserver', 'spawn')
@@ -0,0 +1,152 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from scipy.signal import resample_poly
+
+pytest.importorskip("corti.zilany2014._zilany2014")
+
+from corti import mapped  # noqa: E402
+from corti.base import periph_consts as p  # noqa: E402
+from corti.periphery_configuration import SpikeTrains  # noqa: E402
+from corti.zilany2014 import run_zilany2014, _zilany2014  # noqa: E402
+from corti.zilany2014.util import FFGN, ffgn  # noqa: E402
+
+FS = 100e3
+
+
+def click(length=3000):
+    sound = np.zeros(length)
+    sound[200:300] = 0.1
+    return sound
+
+
+def run(anf_num=(1, 1, 1), **kwargs):
+    return run_zilany2014(sound=click(), fs=FS, anf_num=anf_num, cf=(125, 20e3, 6), species='human', seed=0,
+                          conf=None, level=80, **kwargs).output
+
+
+def test_parallel_channels_match_serial():
+    serial = run()
+    parallel = run(n_jobs=2, chunk_size=2)
+    for key, value in serial.items():
+        np.testing.assert_array_equal(value, parallel[key])
+
+
+def test_threaded_channels_match_serial():
+    serial = run()
+    threaded = run(n_jobs=3, executor='thread')
+    for key, value in serial.items():
+        np.testing.assert_array_equal(value, threaded[key])
+
+
+@pytest.mark.parametrize("anf_type", ['hsr', 'msr', 'lsr'])
+def test_native_decimation_matches_scipy(anf_type):
+    vihc = _zilany2014.run_ihc(np.random.RandomState(0).randn(5000) * 0.05, 1000., FS, 'human')
+    kwargs = dict(vihc=vihc, fs=FS, cf=1000., anf_type=anf_type, powerlaw='approximate', ffGn=False)
+    native = _zilany2014.run_synapse(decimation='native', **kwargs)
+    scipy = _zilany2014.run_synapse(decimation='scipy', **kwargs)
+    np.testing.assert_allclose(native, scipy, rtol=1e-10, atol=1e-10 * np.abs(scipy).max())
+
+
+def test_batched_ffgn_is_scaled_per_fiber_type():
+    noise = ffgn.generate(20000, 1e-4, 0.9, mu=np.repeat([100., 4., 0.1], 200), count=600,
+                          rng=np.random.RandomState(0))
+    assert noise.shape == (600, 20000)
+    stds = noise.reshape(3, -1).std(axis=1)
+    np.testing.assert_allclose(stds / [200, 30, 3], 1, rtol=0.2)
+
+
+def test_ffgn_keeps_the_recent_resamplers():
+    engine = FFGN()
+    y = np.random.RandomState(0).standard_normal((3, 40))
+    for n in range(10, 10 + FFGN.MaxResamplers + 2):
+        engine.upsample(y[:, :n], 5)
+    assert list(engine._resamplers) == [(n, 5) for n in range(12, 12 + FFGN.MaxResamplers)]
+    np.testing.assert_allclose(engine.upsample(y[:, :10], 5), resample_poly(y[:, :10], 5, 1, axis=-1,
+                                                                            window=engine.taps(5)), atol=1e-12)
+    assert list(engine._resamplers)[-1] == (10, 5) and len(engine._resamplers) == FFGN.MaxResamplers
+
+
+@pytest.mark.parametrize("anf_type", ['hsr', 'msr', 'lsr'])
+def test_fast_powerlaw_matches_actual(anf_type):
+    vihc = _zilany2014.run_ihc(np.random.RandomState(0).randn(5000) * 0.05, 1000., FS, 'human')
+    kwargs = dict(vihc=vihc, fs=FS, cf=1000., anf_type=anf_type, ffGn=False)
+    actual = _zilany2014.run_synapse(powerlaw='actual', **kwargs)
+    fast = _zilany2014.run_synapse(powerlaw='fast', powerlaw_tol=1e-6, **kwargs)
+    np.testing.assert_allclose(fast, actual, rtol=1e-5, atol=1e-5 * actual.max())
+
+
+def test_spike_trains_are_compact_per_fiber():
+    assert run()[p.AuditoryNerveSpikes] is None
+    trains = run(anf_num=(3, 2, 1), spikes=True, chunk_size=4)[p.AuditoryNerveSpikes]
+    assert len(trains) == 6 * 6
+    assert trains.times.dtype == np.float32
+    assert trains.offsets[0] == 0 and trains.offsets[-1] == len(trains.times)
+    np.testing.assert_array_equal(trains.fiberType[:6], [0, 0, 0, 1, 1, 2])
+    assert len(np.unique(trains.cf)) == 6
+    for i in range(len(trains)):
+        train = trains.train(i)
+        assert np.all(np.diff(train) > 0) and np.all(train >= 0)
+    restored = SpikeTrains.from_dict(trains.as_dict(p.AuditoryNerveSpikes), p.AuditoryNerveSpikes)
+    np.testing.assert_array_equal(restored.offsets, trains.offsets)
+    assert restored.fiberTypes == trains.fiberTypes
+
+
+def test_batched_spike_generator_is_reproducible():
+    vihc = _zilany2014.run_ihc(click(), 1000., FS, 'human')
+    synout = _zilany2014.run_synapse(vihc, FS, 1000., 'hsr', powerlaw='approximate', ffGn=False)
+    seeds = np.arange(500, dtype=np.uint64)
+    times, counts = _zilany2014.run_spike_generator_batch(synout, FS, 500, seeds=seeds)
+    again, _ = _zilany2014.run_spike_generator_batch(synout, FS, 500, seeds=seeds)
+    np.testing.assert_array_equal(times, again)
+    assert counts.sum() == len(times)
+    psth = _zilany2014.run_spike_generator_batch(synout, FS, 500, seeds=seeds, psth_binwidth=1e-3)
+    assert len(psth) == 30 and psth.sum() == len(times)
+
+
+def test_random_streams_do_not_depend_on_scheduling():
+    kwargs = dict(anf_num=(4, 2, 1), spikes=True, ffGn=True)
+    serial = run(**kwargs)
+    for scheduled in (run(n_jobs=2, chunk_size=4, **kwargs), run(n_jobs=3, executor='thread', **kwargs),
+                      run(chunk_size=1, **kwargs)):
+        for key in (p.AuditoryNerveFiberHighSpont, p.AuditoryNerveFiberMediumSpont, p.AuditoryNerveFiberLowSpont):
+            np.testing.assert_array_equal(serial[key], scheduled[key])
+        np.testing.assert_array_equal(serial[p.AuditoryNerveSpikes].times, scheduled[p.AuditoryNerveSpikes].times)
+        np.testing.assert_array_equal(serial[p.AuditoryNerveSpikes].offsets,
+                                      scheduled[p.AuditoryNerveSpikes].offsets)
+
+
+@pytest.mark.parametrize("species", ['cat', 'human'])
+def test_shared_middle_ear_matches_ihcan(species):
+    sound = np.random.RandomState(0).randn(3000) * 0.05
+    middle_ear = _zilany2014.run_middle_ear(sound, FS, species)
+    for cf in (500., 4000.):
+        np.testing.assert_array_equal(_zilany2014.run_ihc(sound, cf, FS, species),
+                                      _zilany2014.run_ihc(middle_ear, cf, FS, species, middle_ear=True))
+
+
+def test_cached_channels_match_simulated(tmp_path, monkeypatch):
+    kwargs = dict(anf_num=(2, 1, 1), spikes=True, ffGn=True)
+    plain = run(**kwargs)
+    first = run(cache=str(tmp_path), **kwargs)
+    assert len(os.listdir(str(tmp_path))) > 0
+    monkeypatch.setattr(_zilany2014, 'run_synapse', None)  # every channel must come from the cache
+    second = run(cache=str(tmp_path), **kwargs)
+    for output in (first, second):
+        for key in (p.AuditoryNerveFiberHighSpont, p.AuditoryNerveFiberMediumSpont, p.AuditoryNerveFiberLowSpont):
+            np.testing.assert_array_equal(plain[key], output[key])
+        np.testing.assert_array_equal(plain[p.AuditoryNerveSpikes].times, output[p.AuditoryNerveSpikes].times)
+
+
+def test_memory_mapped_rates(tmp_path):
+    expected = run()
+    output = run_zilany2014(sound=click(), fs=FS, anf_num=(1, 1, 1), cf=(125, 20e3, 6), species='human', seed=0,
+                            conf=SimpleNamespace(memmap=True), output=str(tmp_path), level=80).output
+    rates = output[p.AuditoryNerveFiberHighSpont]
+    assert isinstance(rates, np.memmap) and not rates.flags.writeable
+    np.testing.assert_array_equal(rates, expected[p.AuditoryNerveFiberHighSpont])
+    assert len(list(tmp_path.glob("*.npy"))) == 3
+    # named like the memory-mapped outputs of the Verhulst model
+    assert rates.filename == mapped.mapped_file(str(tmp_path), p.AuditoryNerveFiberHighSpont, 80)